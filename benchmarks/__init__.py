@@ -0,0 +1 @@
+"""Benchmarks of simiview, run as modules, e.g. python -m benchmarks.startup"""
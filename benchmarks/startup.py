@@ -0,0 +1,122 @@
+"""Cold start cost of the spike sorter
+
+Imports a module in a fresh interpreter with ``python -X importtime`` and
+reports the modules that took the longest to import, along with any heavy
+dependencies that should only be imported once they are needed.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --module simiview.spikesort.batch --repeat 5 --top 30
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+# dependencies that are slow to import and not needed to show the main window
+DEFERRED_MODULES = ['neo', 'matplotlib', 'sklearn', 'simianpy.signal', 'scipy.signal']
+
+def measure_import(module, python=sys.executable):
+    """Import `module` in a new interpreter
+
+    Returns
+    -------
+    wall_time : float
+        Seconds taken by the interpreter, including its own startup
+    imports : list[dict]
+        The self and cumulative import time, in seconds, of every imported module
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [python, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True
+    )
+    wall_time = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+    return wall_time, parse_importtime(result.stderr)
+
+def parse_importtime(output):
+    """Parse the report written to stderr by ``python -X importtime``"""
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append({
+            'module': name.strip(),
+            'depth': (len(name) - len(name.lstrip()) - 1) // 2,
+            'self': int(self_us) * 1e-6,
+            'cumulative': int(cumulative_us) * 1e-6
+        })
+    return imports
+
+def summarize(module, repeat=3, top=20):
+    wall_times = []
+    runs = []
+    for _ in range(repeat):
+        wall_time, imports = measure_import(module)
+        wall_times.append(wall_time)
+        runs.append(imports)
+    # the median over runs, so a single slow run does not skew the ranking
+    by_module = {}
+    for imports in runs:
+        for item in imports:
+            by_module.setdefault(item['module'], []).append(item)
+    modules = [
+        {
+            'module': name,
+            'self': statistics.median(item['self'] for item in items),
+            'cumulative': statistics.median(item['cumulative'] for item in items)
+        }
+        for name, items in by_module.items()
+    ]
+    modules.sort(key=lambda item: item['cumulative'], reverse=True)
+    # the time spent in the modules of each top level package, e.g. numpy or vispy
+    packages = {}
+    for item in modules:
+        package = item['module'].split('.')[0]
+        packages[package] = packages.get(package, 0) + item['self']
+    imported = set(by_module)
+    return {
+        'module': module,
+        'repeat': repeat,
+        'wall_time': statistics.median(wall_times),
+        'import_time': statistics.median(
+            sum(item['cumulative'] for item in imports if item['depth'] == 0) for imports in runs
+        ),
+        'packages': dict(sorted(packages.items(), key=lambda item: item[1], reverse=True)),
+        'slowest': modules[:top],
+        'deferred_imported': [name for name in DEFERRED_MODULES if name in imported],
+    }
+
+def print_summary(summary):
+    print(f"{summary['module']}: {summary['wall_time'] * 1e3:.0f} ms wall, "
+          f"{summary['import_time'] * 1e3:.0f} ms importing (median of {summary['repeat']})")
+    print("\nBy package:")
+    for package, seconds in list(summary['packages'].items())[:10]:
+        print(f"  {seconds * 1e3:8.1f} ms  {package}")
+    print("\nSlowest modules (cumulative, self):")
+    for item in summary['slowest']:
+        print(f"  {item['cumulative'] * 1e3:8.1f} ms {item['self'] * 1e3:8.1f} ms  {item['module']}")
+    if summary['deferred_imported']:
+        print(f"\nImported at startup, but should be deferred: {', '.join(summary['deferred_imported'])}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--module', default='simiview.spikesort.mainwindow', help="the module to import")
+    parser.add_argument('--repeat', type=int, default=3, help="number of fresh interpreters (default: 3)")
+    parser.add_argument('--top', type=int, default=20, help="number of modules listed (default: 20)")
+    parser.add_argument('--json', action='store_true', help="print the summary as JSON")
+    args = parser.parse_args(argv)
+
+    summary = summarize(args.module, repeat=args.repeat, top=args.top)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
+    return 1 if summary['deferred_imported'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
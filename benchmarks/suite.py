@@ -0,0 +1,317 @@
+"""Benchmarks of the hot paths of simiview, on synthetic data
+
+Each benchmark is timed over a number of repeats, then run once more under
+tracemalloc to measure its peak memory. Nothing is drawn, so no display or
+GL context is needed. Results are written as JSON lines, one record per
+benchmark and scale, so they can be collected and compared across releases.
+
+    python -m benchmarks.suite
+    python -m benchmarks.suite --scales 10k 100k 1M 10M --output results.jsonl
+    python -m benchmarks.suite --select ccg detect --repeat 10
+"""
+import argparse
+from datetime import datetime, timezone
+import importlib.util
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.synthetic import SCALES, parse_scale, synthetic_signal, synthetic_spikes, synthetic_gaze
+
+class Benchmark:
+    """A named benchmark
+
+    `setup(n, seed)` prepares the data for a scale of `n` items and returns
+    a function without arguments, which is what is timed.
+    """
+    def __init__(self, name, setup, max_scale=None, requires=()):
+        self.name = name
+        self.setup = setup
+        self.max_scale = max_scale
+        self.requires = requires
+
+BENCHMARKS = {}
+
+def benchmark(name, max_scale=None, requires=()):
+    """Register a setup function as a benchmark
+
+    Parameters
+    ----------
+    name : str
+    max_scale : str, optional
+        The largest scale run, unless forced, e.g. for algorithms whose memory grows quadratically
+    requires : tuple[str], optional
+        Modules that must be importable, otherwise the benchmark is skipped
+    """
+    def decorator(setup):
+        BENCHMARKS[name] = Benchmark(name, setup, max_scale=max_scale, requires=requires)
+        return setup
+    return decorator
+
+# --- spike sorting ---
+
+@benchmark('detect_waveforms')
+def _detect_waveforms(n, seed):
+    from simiview.spikesort.detection import detect_waveforms
+    signal, _, _ = synthetic_signal(n, seed=seed)
+    threshold = -4 * np.median(np.abs(signal)) / 0.6745
+    load_chunk = lambda start, n_samples: signal[start:start + n_samples]
+    return lambda: detect_waveforms(load_chunk, signal.size, threshold, chunk_size=1_000_000)
+
+@benchmark('detect_waveforms_tetrode')
+def _detect_waveforms_tetrode(n, seed):
+    from simiview.spikesort.detection import detect_waveforms, estimate_threshold
+    signal = np.column_stack([synthetic_signal(n, seed=seed + channel)[0] for channel in range(4)])
+    threshold = estimate_threshold(signal)
+    load_chunk = lambda start, n_samples: signal[start:start + n_samples]
+    return lambda: detect_waveforms(load_chunk, signal.shape[0], threshold, chunk_size=1_000_000)
+
+@benchmark('filter', requires=('simianpy',))
+def _filter(n, seed):
+    from simiview.spikesort.detection import filt, get_filter
+    signal, _, _ = synthetic_signal(n, seed=seed)
+    # the filter is designed once per session, so it is not part of the timing
+    get_filter()
+    return lambda: filt(signal)
+
+@benchmark('ccg_matrix', max_scale='10k')
+def _ccg_matrix(n, seed):
+    from simiview.spikesort.ccg_matrix import ccg_matrix
+    spikes = synthetic_spikes(n, seed=seed)
+    sorted_spikes = spikes['clusters'] > 0
+    spike_times = spikes['timestamps_ms'][sorted_spikes]
+    unit_ids = spikes['clusters'][sorted_spikes]
+    return lambda: ccg_matrix(spike_times, unit_ids, bin_size=0.2, max_lag=10)
+
+@benchmark('cluster_index_update')
+def _cluster_index_update(n, seed):
+    from simiview.spikesort.cluster_index import ClusterIndex
+    spikes = synthetic_spikes(n, seed=seed)
+    def run():
+        # a new index each time, so the one-off time ordering is included
+        ClusterIndex().update(spikes['clusters'], spikes['timestamps_ms'])
+    return run
+
+@benchmark('isi_histogram')
+def _isi_histogram(n, seed):
+    from simiview.spikesort.isi import isi_histogram
+    spikes = synthetic_spikes(n, seed=seed)
+    return lambda: isi_histogram(spikes['timestamps_ms'])
+
+@benchmark('match_templates')
+def _match_templates(n, seed):
+    from simiview.spikesort.cluster_index import ClusterIndex
+    from simiview.spikesort.template_matching import compute_templates, match_templates
+    spikes = synthetic_spikes(n, seed=seed)
+    cluster_index = ClusterIndex()
+    cluster_index.update(spikes['clusters'], spikes['timestamps_ms'])
+    cluster_ids, templates, spreads = compute_templates(spikes['waveforms'], cluster_index)
+    return lambda: match_templates(spikes['waveforms'], templates, cluster_ids, max_distance=2 * spreads)
+
+@benchmark('points_in_polygon', requires=('matplotlib',))
+def _points_in_polygon(n, seed):
+    from simiview.spikesort.points_in_poly import points_in_polygon
+    spikes = synthetic_spikes(n, seed=seed)
+    angle = np.linspace(0, 2 * np.pi, 200)
+    # a lasso of 200 vertices, as drawn by hand around a cluster
+    poly = np.column_stack([5 * np.cos(angle) + np.sin(5 * angle), 5 * np.sin(angle)])
+    return lambda: points_in_polygon(spikes['points'], poly)
+
+@benchmark('linecollection_get_pos', max_scale='1M', requires=('vispy',))
+def _linecollection_get_pos(n, seed):
+    from simiview.util.linecollection import LineCollection
+    spikes = synthetic_spikes(n, seed=seed)
+    lines = LineCollection()
+    lines.lines = spikes['waveforms']
+    idx = np.argsort(-spikes['clusters'], kind='stable')
+    return lambda: lines.get_pos(offset=0, idx=idx)
+
+@benchmark('lod_decimate')
+def _lod_decimate(n, seed):
+    from simiview.util.decimation import minmax_envelope, simplify_paths
+    # trials of 2 s, decimated for a view of 30 degrees and 2 s on 800 pixels
+    _, position = synthetic_gaze(2000, n_trials=max(n // 2000, 1), seed=seed)
+    position = position.astype(np.float32)
+    def run():
+        minmax_envelope(position[:, :, 0], 2)
+        simplify_paths(position, 30 / 800)
+    return run
+
+@benchmark('closest_lines', max_scale='1M', requires=('vispy',))
+def _closest_lines(n, seed):
+    from simiview.util.linecollection import PathCollection
+    _, position = synthetic_gaze(2000, n_trials=max(n // 2000, 1), seed=seed)
+    paths = PathCollection(paths=position)
+    paths.get_spatial_index()
+    clicks = np.random.default_rng(seed).uniform(-15, 15, (20, 2))
+    def run():
+        for click in clicks:
+            paths.get_closest_lines(click, 5)
+    return run
+
+# --- gaze ---
+
+def _gaze_data(n, seed):
+    from simiview.gaze import GazeData
+    time, position = synthetic_gaze(n, seed=seed)
+    return GazeData(time, position[0], ['x', 'y'])
+
+@benchmark('gaze_mask_blinks', requires=('xarray',))
+def _gaze_mask_blinks(n, seed):
+    gaze = _gaze_data(n, seed)
+    return lambda: gaze.mask_blinks(threshold=30, pad=10)
+
+@benchmark('gaze_saccades', requires=('xarray',))
+def _gaze_saccades(n, seed):
+    gaze = _gaze_data(n, seed)
+    # positions are in degrees and times in ms, so velocities are in degrees per ms
+    return lambda: gaze.get_saccades({'min': 0.3}, duration_query={'min': 10})
+
+@benchmark('gaze_fixations', requires=('xarray',))
+def _gaze_fixations(n, seed):
+    gaze = _gaze_data(n, seed)
+    return lambda: gaze.get_fixations({'max': 0.3}, duration_query={'min': 50})
+
+@benchmark('gaze_get_by_events', requires=('xarray',))
+def _gaze_get_by_events(n, seed):
+    gaze = _gaze_data(n, seed)
+    # the saccades and fixations overlapping each window are looked up too
+    gaze.get_saccades({'min': 0.3})
+    gaze.get_fixations({'max': 0.3})
+    # one event per second of data, with a window of 500 ms either side
+    events = [{'timestamp': timestamp} for timestamp in range(500, n - 500, 1000)]
+    return lambda: gaze.get_by_events(events, (-500, 500))
+
+@benchmark('gaze_dataset_events', requires=('xarray',))
+def _gaze_dataset_events(n, seed):
+    from simiview.gaze import GazeDataSet
+    # trials of 2 s, so the scale is the total number of samples
+    time, position = synthetic_gaze(2000, n_trials=max(n // 2000, 1), seed=seed)
+    dataset = GazeDataSet(time, position, ['x', 'y'])
+    def run():
+        dataset.mask_blinks(threshold=30, pad=10)
+        dataset.get_saccades({'min': 0.3}, duration_query={'min': 10})
+        dataset.get_fixations({'max': 0.3}, duration_query={'min': 50})
+    return run
+
+@benchmark('gaze_saccades_parallel', requires=('xarray',))
+def _gaze_saccades_parallel(n, seed):
+    gaze = _gaze_data(n, seed)
+    # four chunks, whatever the scale, so the pool is exercised at every scale
+    return lambda: gaze.detect_parallel('saccades', {'min': 0.3}, duration_query={'min': 10}, n_jobs=4, chunk_size=max(n // 4, 1))
+
+@benchmark('gaze_stream_velocity', requires=('xarray',))
+def _gaze_stream_velocity(n, seed):
+    gaze = _gaze_data(n, seed)
+    def run():
+        for _ in gaze.stream_velocity({'min': 0.3}, chunk_size=100_000):
+            pass
+    return run
+
+# --- running ---
+
+def environment():
+    """Where the benchmarks ran, recorded with each result"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            cwd=Path(__file__).parent, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+    }
+
+def run_benchmark(bench, scale, repeat=5, seed=0, force=False):
+    """Time a benchmark at a scale, returning its record"""
+    n = parse_scale(scale)
+    record = {'benchmark': bench.name, 'scale': scale, 'n': n, 'repeat': repeat, 'seed': seed}
+    missing = [module for module in bench.requires if importlib.util.find_spec(module) is None]
+    if missing:
+        return {**record, 'status': 'skipped', 'reason': f"requires {', '.join(missing)}"}
+    if bench.max_scale is not None and n > parse_scale(bench.max_scale) and not force:
+        return {**record, 'status': 'skipped', 'reason': f"scale above {bench.max_scale}"}
+    try:
+        func = bench.setup(n, seed)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        # memory is measured in a separate run, as tracing allocations slows them down
+        tracemalloc.start()
+        try:
+            tracemalloc.reset_peak()
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    except Exception as error:
+        return {**record, 'status': 'error', 'error': f"{type(error).__name__}: {error}"}
+    return {
+        **record,
+        'status': 'ok',
+        'times': times,
+        'min': min(times),
+        'median': statistics.median(times),
+        'peak_bytes': peak,
+    }
+
+def format_record(record):
+    label = f"{record['benchmark']:<24} {record['scale']:>5}"
+    if record['status'] == 'ok':
+        return f"{label} {record['median'] * 1e3:>10.2f} ms median {record['min'] * 1e3:>10.2f} ms min {record['peak_bytes'] / 2**20:>9.1f} MB peak"
+    return f"{label} {record['status']}: {record.get('reason') or record.get('error')}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--select', nargs='+', help="run benchmarks whose name contains any of these")
+    parser.add_argument('--scales', nargs='+', default=['10k', '100k', '1M'], help=f"scales to run, from {', '.join(SCALES)} or a number (default: 10k 100k 1M)")
+    parser.add_argument('--repeat', type=int, default=5, help="timed runs per benchmark (default: 5)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--force', action='store_true', help="run scales above a benchmark's maximum")
+    parser.add_argument('--output', help="append records to this JSON lines file, instead of printing them")
+    parser.add_argument('--list', action='store_true', help="list the benchmarks and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, bench in BENCHMARKS.items():
+            print(name)
+        return 0
+    benches = [
+        bench for name, bench in BENCHMARKS.items()
+        if not args.select or any(pattern in name for pattern in args.select)
+    ]
+    run = {
+        'run': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        **environment()
+    }
+    output = open(args.output, 'a') if args.output else sys.stdout
+    failed = False
+    try:
+        for bench in benches:
+            for scale in args.scales:
+                record = {**run, **run_benchmark(bench, scale, repeat=args.repeat, seed=args.seed, force=args.force)}
+                failed = failed or record['status'] == 'error'
+                output.write(json.dumps(record) + '\n')
+                output.flush()
+                print(format_record(record), file=sys.stderr)
+    finally:
+        if args.output:
+            output.close()
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
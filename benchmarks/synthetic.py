@@ -0,0 +1,159 @@
+"""Synthetic data for the benchmarks
+
+Every generator takes a seed, so repeated runs benchmark identical data.
+"""
+import numpy as np
+
+SCALES = {'10k': 10_000, '100k': 100_000, '1M': 1_000_000, '10M': 10_000_000}
+
+def parse_scale(scale):
+    """The number of items of a scale given by name (e.g. '100k') or as a number"""
+    if isinstance(scale, str) and scale in SCALES:
+        return SCALES[scale]
+    return int(float(scale))
+
+def spike_templates(n_units, n_samples=40, seed=0):
+    """Mean waveforms of shape (n_units, n_samples): a trough followed by a slower peak"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_samples)[np.newaxis]
+    trough = rng.uniform(8, 12, (n_units, 1))
+    amplitude = rng.uniform(40, 120, (n_units, 1))
+    width = rng.uniform(1.5, 3, (n_units, 1))
+    rebound = rng.uniform(0.2, 0.5, (n_units, 1))
+    return (
+        -amplitude * np.exp(-0.5 * ((t - trough) / width) ** 2)
+        + rebound * amplitude * np.exp(-0.5 * ((t - trough - 4 * width) / (2 * width)) ** 2)
+    ).astype(np.float32)
+
+def synthetic_signal(n_samples, spike_rate=20., n_units=3, noise=10., sampling_rate=30000, seed=0):
+    """A continuous signal in uV with spikes of a few units injected into noise
+
+    Parameters
+    ----------
+    n_samples : int
+        The length of the signal
+    spike_rate : float, optional
+        The firing rate of each unit in Hz, by default 20.
+    n_units : int, optional
+        The number of units, by default 3
+    noise : float, optional
+        The standard deviation of the background noise in uV, by default 10.
+    sampling_rate : int, optional
+        By default 30000
+
+    Returns
+    -------
+    signal : np.ndarray
+        Array of shape (n_samples,), float32
+    spike_samples : np.ndarray
+        The sorted sample index of each injected spike's trough
+    units : np.ndarray
+        The unit of each injected spike
+    """
+    rng = np.random.default_rng(seed)
+    templates = spike_templates(n_units, seed=seed)
+    width = templates.shape[1]
+    signal = rng.normal(0, noise, n_samples).astype(np.float32)
+
+    n_spikes = rng.poisson(spike_rate * n_units * n_samples / sampling_rate)
+    starts = np.sort(rng.integers(0, max(n_samples - width, 1), n_spikes))
+    units = rng.integers(0, n_units, n_spikes)
+    # overlapping spikes add up, as they would in a recording
+    idx = starts[:, np.newaxis] + np.arange(width)
+    np.add.at(signal, idx.ravel(), templates[units].ravel())
+    trough = templates.argmin(axis=1)
+    order = np.argsort(starts + trough[units], kind='stable')
+    return signal, (starts + trough[units])[order], units[order]
+
+def synthetic_spikes(n_spikes, n_units=8, n_samples=40, duration=3600., noise=8., n_features=3, seed=0):
+    """A labelled set of spikes, as saved by the spike sorter for a channel
+
+    Parameters
+    ----------
+    n_spikes : int
+        The number of spikes
+    n_units : int, optional
+        The number of sorted units, by default 8. Label 0 is left for unsorted spikes
+    n_samples : int, optional
+        The number of samples in each waveform, by default 40
+    duration : float, optional
+        The length of the recording in seconds, by default 3600.
+    noise : float, optional
+        The standard deviation of noise added to the waveforms, by default 8.
+    n_features : int, optional
+        The number of feature dimensions of the points, by default 3
+
+    Returns
+    -------
+    dict
+        'waveforms' (n_spikes, n_samples) float32, 'timestamps' sorted in
+        seconds, 'timestamps_ms', 'clusters' int8 with 10% of spikes unsorted,
+        and 'points' (n_spikes, n_features) float32
+    """
+    rng = np.random.default_rng(seed)
+    templates = spike_templates(n_units, n_samples, seed=seed)
+    units = rng.integers(0, n_units, n_spikes)
+    waveforms = templates[units]
+    # added in place, in chunks, so 10M spikes do not need several copies in memory
+    for start in range(0, n_spikes, 1_000_000):
+        stop = min(start + 1_000_000, n_spikes)
+        waveforms[start:stop] += rng.normal(0, noise, (stop - start, n_samples)).astype(np.float32)
+    timestamps = np.sort(rng.uniform(0, duration, n_spikes))
+    clusters = (units + 1).astype(np.int8)
+    clusters[rng.random(n_spikes) < 0.1] = 0
+    centres = rng.normal(0, 5, (n_units, n_features))
+    points = (centres[units] + rng.normal(0, 1, (n_spikes, n_features))).astype(np.float32)
+    return {
+        'waveforms': waveforms,
+        'timestamps': timestamps,
+        'timestamps_ms': timestamps * 1e3,
+        'clusters': clusters,
+        'points': points,
+    }
+
+def synthetic_gaze(n_timepoints, n_trials=1, saccade_rate=3., blink_rate=0.2, sampling_rate=1000, seed=0):
+    """Eye position traces in degrees, with fixations, saccades and blinks
+
+    Parameters
+    ----------
+    n_timepoints : int
+        The number of samples per trial
+    n_trials : int, optional
+        By default 1
+    saccade_rate : float, optional
+        Saccades per second, by default 3.
+    blink_rate : float, optional
+        Blinks per second, by default 0.2. During a blink, the position is far off the screen
+    sampling_rate : int, optional
+        By default 1000
+
+    Returns
+    -------
+    time : np.ndarray
+        Sample times in ms, of shape (n_timepoints,)
+    position : np.ndarray
+        Array of shape (n_trials, n_timepoints, 2), float32
+    """
+    rng = np.random.default_rng(seed)
+    position = np.empty((n_trials, n_timepoints, 2), dtype=np.float32)
+    # saccades last ~30 ms, following a smooth (raised cosine) velocity profile
+    saccade_length = max(int(0.03 * sampling_rate), 2)
+    profile = (1 - np.cos(np.linspace(0, np.pi, saccade_length))) / 2
+    for trial in range(n_trials):
+        n_saccades = rng.poisson(saccade_rate * n_timepoints / sampling_rate)
+        onsets = np.sort(rng.integers(0, n_timepoints, n_saccades))
+        targets = rng.uniform(-10, 10, (n_saccades + 1, 2))
+        # fixation target at each sample, then saccades interpolate between targets
+        segment = np.searchsorted(onsets, np.arange(n_timepoints), side='right')
+        trace = targets[segment]
+        for i, onset in enumerate(onsets):
+            stop = min(onset + saccade_length, n_timepoints)
+            ramp = profile[:stop - onset, np.newaxis]
+            trace[onset:stop] = targets[i] + ramp * (targets[i + 1] - targets[i])
+        trace += rng.normal(0, 0.05, trace.shape)
+        n_blinks = rng.poisson(blink_rate * n_timepoints / sampling_rate)
+        for onset in rng.integers(0, n_timepoints, n_blinks):
+            trace[onset:onset + int(0.15 * sampling_rate)] = -50
+        position[trial] = trace
+    time = np.arange(n_timepoints) * (1000 / sampling_rate)
+    return time, position
@@ -1,9 +1,9 @@
-from itertools import product
+import os
 
 import numpy as np
 import xarray as xr
 
-from simianpy.misc import binary_digitize
+from simiview.jobs import JobManager
 
 def parse_query(x, query=None):
     if query==None:
@@ -12,20 +12,482 @@ def parse_query(x, query=None):
     max_ = query.get('max', np.inf)
     return (min_ < x) & (x < max_)
 
+def find_runs(mask):
+    """The runs of True values along the last axis of a boolean array
+
+    Parameters
+    ----------
+    mask : np.ndarray
+        Array of shape (n_rows, n_samples)
+
+    Returns
+    -------
+    rows : np.ndarray
+        The row of each run
+    onsets : np.ndarray
+        The first sample of each run
+    offsets : np.ndarray
+        The sample after the last of each run
+    """
+    mask = np.asarray(mask, dtype=bool)
+    # rising and falling edges, with each row padded by False on both ends
+    edges = np.diff(mask.view(np.int8), axis=-1, prepend=0, append=0)
+    # within each row, rising and falling edges alternate
+    rows, samples = np.nonzero(edges)
+    return rows[::2], samples[::2], samples[1::2]
+
+def fill_intervals(rows, onsets, offsets, shape):
+    """A boolean array of `shape` (n_rows, n_samples), True within [onset, offset) of each interval
+
+    Intervals may overlap and are clipped to the samples. The fill is a
+    difference array (+1 at each onset, -1 at each offset) summed along each
+    row, so its cost does not depend on the number or length of the intervals.
+    """
+    n_rows, n_samples = shape
+    onsets = np.clip(onsets, 0, n_samples)
+    offsets = np.clip(offsets, 0, n_samples)
+    # each row has one extra slot, for the offsets at the end of the row
+    width = n_samples + 1
+    difference = (
+        np.bincount(rows * width + onsets, minlength=n_rows * width)
+        - np.bincount(rows * width + offsets, minlength=n_rows * width)
+    ).reshape(n_rows, width)
+    return np.cumsum(difference[:, :n_samples], axis=-1) > 0
+
+def off_screen(position, threshold):
+    """Whether any dimension of each sample of (..., n_samples, n_dims) positions is at or beyond the threshold"""
+    result = np.abs(position[..., 0]) >= threshold
+    for dim in range(1, position.shape[-1]):
+        result |= np.abs(position[..., dim]) >= threshold
+    return result
+
+def blink_intervals(position, threshold=30, pad=None):
+    """The samples to mask around blinks in (n_rows, n_samples, n_dims) positions
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (n_rows, n_samples), True for samples within `pad` samples of a blink
+    """
+    pad = 0 if pad is None else pad
+    rows, onsets, offsets = find_runs(off_screen(position, threshold))
+    return fill_intervals(rows, onsets - pad, offsets + pad, position.shape[:2])
+
+def make_table(columns):
+    """A structured array with a field for each of `columns`, a dict of equal-length arrays"""
+    columns = {name: np.asarray(values) for name, values in columns.items()}
+    n = len(next(iter(columns.values()))) if columns else 0
+    table = np.empty(n, dtype=[(name, values.dtype) for name, values in columns.items()])
+    for name, values in columns.items():
+        table[name] = values
+    return table
+
+def select_dimensions(position, dimensions, names=None):
+    """The positions of a single or a subset of dimensions, by name, or all if None"""
+    if names is None:
+        return position
+    if isinstance(names, str):
+        names = [names]
+    return position[..., [dimensions.index(name) for name in names]]
+
+def radial_velocity(time, position, filter_method=None):
+    """The speed between consecutive samples
+
+    Parameters
+    ----------
+    time : np.ndarray
+        Sample times of shape (n_samples,)
+    position : np.ndarray
+        Array of shape (..., n_samples, n_dims)
+    filter_method : callable, optional
+        If provided, applied to the differences of shape (..., n_samples - 1, n_dims), by default None
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (..., n_samples - 1)
+    """
+    difference = np.diff(position, axis=-2)
+    if filter_method is not None:
+        difference = filter_method(difference)
+    # summed one dimension at a time, which is much faster than reducing over the short last axis
+    squared = np.square(difference[..., 0])
+    for dim in range(1, difference.shape[-1]):
+        squared += np.square(difference[..., dim])
+    return np.sqrt(squared, out=squared) / np.diff(time)
+
+def velocity_events(velocity, velocity_query=None, blink_mask=None):
+    """The runs of samples whose velocity matches the query
+
+    Parameters
+    ----------
+    velocity : np.ndarray
+        Array of shape (n_rows, n_samples - 1), see `radial_velocity`
+    velocity_query : dict, optional
+        With 'min' and/or 'max' keys
+    blink_mask : np.ndarray, optional
+        Array of shape (n_rows, n_samples), False for masked samples. If
+        provided, events only include unmasked samples
+
+    Returns
+    -------
+    rows, onsets, offsets : np.ndarray
+        The row of each event, the sample it starts at and the sample it ends
+        at, i.e. the samples either side of its run of velocities
+    """
+    mask = parse_query(np.abs(velocity), velocity_query)
+    if blink_mask is not None:
+        mask &= blink_mask[..., :-1]
+        mask &= blink_mask[..., 1:]
+    return find_runs(mask)
+
+def stream_velocity(time, position, velocity_query=None, blink_mask=None, sos=None, dims=None, chunk_size=1_000_000):
+    """The velocity and velocity events of a long recording, one chunk of samples at a time
+
+    Only one chunk of the positions is read at a time, so `position` (and
+    `time`) may be memory-mapped arrays larger than RAM. The last sample,
+    filter state and any event still running at the end of a chunk are
+    carried over to the next, so the chunks join up seamlessly.
+
+    Parameters
+    ----------
+    time : np.ndarray
+        Sample times of shape (n_samples,)
+    position : np.ndarray
+        Array of shape (n_samples, n_dims)
+    velocity_query : dict, optional
+        With 'min' and/or 'max' keys, see `velocity_events`
+    blink_mask : np.ndarray, optional
+        Array of shape (n_samples,), False for masked samples
+    sos : np.ndarray, optional
+        Second-order sections of shape (n_sections, 6), applied causally to
+        the differences with `scipy.signal.sosfilt`. scipy is only imported if given
+    dims : list[int], optional
+        The indices of the dimensions to differentiate, by default all
+    chunk_size : int, optional
+        The number of samples per chunk, by default 1e6
+
+    Yields
+    ------
+    dict
+        'start', the index of the first velocity of the chunk, 'velocity'
+        between consecutive samples, and the 'onset' and 'offset' sample of
+        each event that ended within the chunk (or at the end of the recording)
+    """
+    causal_filter = None
+    if sos is not None:
+        from scipy.signal import sosfilt
+        sos = np.asarray(sos)
+        n_dims = position.shape[-1] if dims is None else len(dims)
+        state = {'zi': np.zeros((sos.shape[0], 2, n_dims))}
+        def causal_filter(difference):
+            difference, state['zi'] = sosfilt(sos, difference, axis=0, zi=state['zi'])
+            return difference
+    n_samples = time.shape[0]
+    # the onset of an event still running at the end of the last chunk
+    open_onset = None
+    for first in range(0, n_samples, chunk_size):
+        last = min(first + chunk_size, n_samples)
+        # each chunk is read with the last sample of the previous one
+        read_from = max(first - 1, 0)
+        chunk_position = np.asarray(position[read_from:last])
+        if dims is not None:
+            chunk_position = chunk_position[:, dims]
+        velocity = radial_velocity(np.asarray(time[read_from:last]), chunk_position, filter_method=causal_filter)
+
+        mask = parse_query(np.abs(velocity), velocity_query)
+        if blink_mask is not None:
+            chunk_mask = np.asarray(blink_mask[read_from:last])
+            mask &= chunk_mask[:-1]
+            mask &= chunk_mask[1:]
+        _, onsets, offsets = find_runs(mask[np.newaxis])
+        onsets, offsets = onsets + read_from, offsets + read_from
+        if open_onset is not None:
+            if onsets.size and onsets[0] == read_from:
+                onsets[0] = open_onset
+            else:
+                # the event ended with the previous chunk
+                onsets = np.insert(onsets, 0, open_onset)
+                offsets = np.insert(offsets, 0, read_from)
+            open_onset = None
+        if last < n_samples and offsets.size and offsets[-1] == last - 1:
+            # the event may continue into the next chunk
+            open_onset = onsets[-1]
+            onsets, offsets = onsets[:-1], offsets[:-1]
+        yield {'start': read_from, 'velocity': velocity, 'onset': onsets, 'offset': offsets}
+
+def saccade_columns(time, position, velocity, rows, onsets, offsets, dimensions, duration_query=None, peak_velocity_query=None):
+    """The saccades among velocity events, as columns
+
+    Every column is computed for all events at once: positions by integer
+    indexing, and peak velocities with a single `np.maximum.reduceat`
+    over the velocity of each event.
+
+    Parameters
+    ----------
+    time : np.ndarray
+        Sample times of shape (n_samples,)
+    position : np.ndarray
+        Array of shape (n_rows, n_samples, n_dims)
+    velocity : np.ndarray
+        Array of shape (n_rows, n_samples - 1)
+    rows, onsets, offsets : np.ndarray
+        The events, see `velocity_events`
+    dimensions : list[str]
+        The names of the position dimensions
+    duration_query, peak_velocity_query : dict, optional
+        With 'min' and/or 'max' keys
+
+    Returns
+    -------
+    dict
+        'trial', 'onset', 'offset', 'onset.time', 'offset.time', 'duration',
+        'peak_velocity', 'onset.<dim>' and 'offset.<dim>' for each dimension,
+        and 'amplitude'
+    """
+    duration = time[offsets] - time[onsets]
+    # the velocities of each event are contiguous in the flattened array;
+    # reducing over [onset, offset, onset, offset, ...] leaves the gaps in the odd entries
+    n_velocities = velocity.shape[-1]
+    flat = np.append(velocity.ravel(), -np.inf)
+    bounds = np.column_stack([rows * n_velocities + onsets, rows * n_velocities + offsets]).ravel()
+    peak_velocity = np.maximum.reduceat(flat, bounds)[::2] if bounds.size else np.empty(0, dtype=flat.dtype)
+
+    keep = parse_query(duration, duration_query) & parse_query(peak_velocity, peak_velocity_query)
+    rows, onsets, offsets = rows[keep], onsets[keep], offsets[keep]
+    onset_position = position[rows, onsets]
+    offset_position = position[rows, offsets]
+    columns = {
+        'trial': rows,
+        'onset': onsets,
+        'offset': offsets,
+        'onset.time': time[onsets],
+        'offset.time': time[offsets],
+        'duration': duration[keep],
+        'peak_velocity': peak_velocity[keep],
+    }
+    for field, field_position in [('onset', onset_position), ('offset', offset_position)]:
+        for dim_idx, dim in enumerate(dimensions):
+            columns[f'{field}.{dim}'] = field_position[:, dim_idx]
+    columns['amplitude'] = np.sqrt(np.sum(np.square(offset_position - onset_position), axis=-1))
+    return columns
+
+def fixation_columns(time, position, rows, onsets, offsets, dimensions, duration_query=None):
+    """The fixations among velocity events, as columns
+
+    The mean position of every fixation is computed in one pass, with
+    `np.add.reduceat` over the samples from each onset to its offset.
+
+    Parameters
+    ----------
+    time : np.ndarray
+        Sample times of shape (n_samples,)
+    position : np.ndarray
+        Array of shape (n_rows, n_samples, n_dims)
+    rows, onsets, offsets : np.ndarray
+        The events, see `velocity_events`
+    dimensions : list[str]
+        The names of the position dimensions
+    duration_query : dict, optional
+        With 'min' and/or 'max' keys
+
+    Returns
+    -------
+    dict
+        'trial', 'onset', 'offset', 'onset.time', 'offset.time', 'duration',
+        and the mean position in each dimension, by the dimension's name
+    """
+    duration = time[offsets] - time[onsets]
+    keep = parse_query(duration, duration_query)
+    rows, onsets, offsets = rows[keep], onsets[keep], offsets[keep]
+
+    n_samples, n_dims = position.shape[-2:]
+    # a fixation includes its offset sample; a row of zeros is appended so
+    # the bound after the last sample is a valid index
+    flat = np.concatenate([position.reshape(-1, n_dims), np.zeros((1, n_dims), dtype=position.dtype)])
+    bounds = np.column_stack([rows * n_samples + onsets, rows * n_samples + offsets + 1]).ravel()
+    if bounds.size:
+        sums = np.add.reduceat(flat, bounds, axis=0)[::2]
+    else:
+        sums = np.empty((0, n_dims), dtype=flat.dtype)
+    mean_position = sums / (offsets - onsets + 1)[:, np.newaxis]
+
+    columns = {
+        'trial': rows,
+        'onset': onsets,
+        'offset': offsets,
+        'onset.time': time[onsets],
+        'offset.time': time[offsets],
+        'duration': duration[keep],
+    }
+    for dim_idx, dim in enumerate(dimensions):
+        columns[dim] = mean_position[:, dim_idx]
+    return columns
+
+def filter_events(table, duration_query=None, peak_velocity_query=None):
+    """The rows of an event table whose duration (and peak velocity, for saccades) match the queries"""
+    keep = parse_query(table['duration'], duration_query)
+    if peak_velocity_query is not None:
+        keep &= parse_query(table['peak_velocity'], peak_velocity_query)
+    return table[keep]
+
+class IntervalIndex:
+    """Intervals sorted by onset, for finding those overlapping many windows at once
+
+    Each window is answered by a pair of `searchsorted` calls: the
+    intervals starting before its end, from the first whose offset (or that
+    of an earlier interval) is after its start. Events detected from a
+    single trace do not overlap, in which case no further filtering is needed.
+
+    Parameters
+    ----------
+    onsets, offsets : np.ndarray
+        The start and end of each interval
+    """
+    def __init__(self, onsets, offsets):
+        onsets, offsets = np.asarray(onsets), np.asarray(offsets)
+        self.order = np.argsort(onsets, kind='stable')
+        self.onsets = onsets[self.order]
+        self.offsets = offsets[self.order]
+        self.max_offsets = np.maximum.accumulate(self.offsets) if self.offsets.size else self.offsets
+        self.disjoint = bool(np.all(self.offsets[:-1] <= self.onsets[1:]))
+
+    def __len__(self):
+        return self.onsets.size
+
+    def overlapping(self, left, right):
+        """The intervals overlapping each window [left, right)
+
+        Parameters
+        ----------
+        left, right : np.ndarray
+            The bounds of each window
+
+        Returns
+        -------
+        windows : np.ndarray
+            The window of each match
+        intervals : np.ndarray
+            The index of the matching interval, in the order the intervals were given
+        """
+        left, right = np.asarray(left), np.asarray(right)
+        stop = np.searchsorted(self.onsets, right, side='left')
+        start = np.minimum(np.searchsorted(self.max_offsets, left, side='right'), stop)
+        counts = stop - start
+        windows = np.repeat(np.arange(counts.size), counts)
+        # the positions start[w], start[w] + 1, ..., stop[w] - 1 of every window, concatenated
+        first = np.cumsum(counts) - counts
+        idx = np.arange(counts.sum()) - np.repeat(first - start, counts)
+        if not self.disjoint:
+            keep = self.offsets[idx] > left[windows]
+            windows, idx = windows[keep], idx[keep]
+        return windows, self.order[idx]
+
+def gather_windows(array, starts, n_window, fill):
+    """Windows of `n_window` samples along the first axis of `array`, from each of `starts`
+
+    Windows within the array are read through a strided view, without
+    building an index per sample. Samples outside the array are `fill`.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (n_windows, n_window) + array.shape[1:]
+    """
+    n_samples = array.shape[0]
+    result = np.full((starts.size, n_window) + array.shape[1:], fill, dtype=np.result_type(array.dtype, np.asarray(fill).dtype))
+    inside = (starts >= 0) & (starts + n_window <= n_samples)
+    if n_window <= n_samples and inside.any():
+        # (n_samples - n_window + 1, ..., n_window) view, with the window axis last
+        windows = np.lib.stride_tricks.sliding_window_view(array, n_window, axis=0)
+        result[inside] = np.moveaxis(windows[starts[inside]], -1, 1)
+    edge = np.flatnonzero(~inside)
+    if edge.size:
+        idx = starts[edge, np.newaxis] + np.arange(n_window)
+        valid = (idx >= 0) & (idx < n_samples)
+        values = array[np.clip(idx, 0, n_samples - 1)]
+        values[~valid] = fill
+        result[edge] = values
+    return result
+
 class GazeData:
+    """Gaze positions over time
+
+    The positions are held in a numpy buffer which grows as data is
+    appended, so a streaming session does not copy its whole history for
+    each new chunk. `data` is an xarray view of the samples so far.
+    """
     def __init__(self, time: np.ndarray, position: np.ndarray, dimensions: list[str]):
-        self.data = xr.DataArray(
-            position, 
-            dims=("time", "dimension"), 
-            coords=dict(time=time, dimension=dimensions)
-        )
-        self.blink_mask = np.ones(self.data.time.size, dtype=bool)
+        self.dimensions = list(dimensions)
+        self._time = np.asarray(time)
+        self._position = np.asarray(position)
+        self._blink_mask = np.ones(self._time.size, dtype=bool)
+        self.n_samples = self._time.size
+        self._data = None
+        # the parameters of the last blink masking, reapplied to appended data
+        self._blink_params = None
         self.inferred = {}
+        self._interval_indices = {}
+
+    @property
+    def time(self):
+        return self._time[:self.n_samples]
+
+    @property
+    def position(self):
+        return self._position[:self.n_samples]
+
+    @property
+    def blink_mask(self):
+        return self._blink_mask[:self.n_samples]
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = xr.DataArray(
+                self.position,
+                dims=("time", "dimension"),
+                coords=dict(time=self.time, dimension=self.dimensions)
+            )
+        return self._data
+
+    def append(self, time: np.ndarray, position: np.ndarray):
+        """Append samples, e.g. the latest chunk of a streaming session
+
+        If blinks have been masked, they are masked in the new samples with
+        the same parameters, including the padding that reaches back into
+        the samples before them.
+        """
+        time = np.asarray(time)
+        n_new = time.size
+        stop = self.n_samples + n_new
+        if stop > self._time.size:
+            # grow geometrically, so appending is amortised O(1) per sample
+            capacity = max(stop, 2 * self._time.size)
+            self._time = self._grow(self._time, capacity)
+            self._position = self._grow(self._position, capacity)
+            self._blink_mask = self._grow(self._blink_mask, capacity, fill=True)
+        start = self.n_samples
+        self._time[start:stop] = time
+        self._position[start:stop] = position
+        self._blink_mask[start:stop] = True
+        self.n_samples = stop
+        self._data = None
+        if self._blink_params is not None:
+            self._mask_blinks_from(start, *self._blink_params)
+
+    def _grow(self, array, capacity, fill=None):
+        grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+        grown[:self.n_samples] = array[:self.n_samples]
+        if fill is not None:
+            grown[self.n_samples:] = fill
+        return grown
 
     def mask_blinks(self, threshold=30, pad=None):
         """Mask blinks in gaze data
 
         More specifically, this mask will hide all data points that are "off the screen" as defined by the threshold.
+        Data appended later is masked with the same parameters.
 
         Parameters
         ----------
@@ -34,11 +496,19 @@ class GazeData:
         pad : int, optional
             The number of samples around "blink" events to mask, by default None
         """
-        blink_start, blink_end = binary_digitize((np.abs(self.data) >= threshold).any('dimension'))
-        blink_start = np.clip(blink_start-pad, 0, self.blink_mask.size, out=blink_start)
-        blink_end = np.clip(blink_end+pad, 0, self.blink_mask.size, out=blink_end)
-        idx = np.concatenate([np.arange(start, end) for start, end in zip(blink_start, blink_end)])
-        self.blink_mask[idx] = False
+        self._blink_params = (threshold, 0 if pad is None else pad)
+        self._mask_blinks_from(0, *self._blink_params)
+
+    def _mask_blinks_from(self, start, threshold, pad):
+        """Mask the blinks affecting the samples from `start - pad` onwards
+
+        Those samples depend on whether the samples from `start - 2 * pad`
+        are off the screen, so only that tail of the data is processed.
+        """
+        first = max(start - 2 * pad, 0)
+        masked = blink_intervals(self.position[np.newaxis, first:], threshold, pad)[0]
+        write_from = max(start - pad, 0)
+        self.blink_mask[write_from:] &= ~masked[write_from - first:]
 
     def differentiate(self, 
             diff_method="radial", 
@@ -56,114 +526,511 @@ class GazeData:
             Select a single or a subset of dimensions
             If None, selects all dimensions, by default None
         filter_method : callable, optional
-            If provided, applies this function to the data, by default None
+            If provided, applies this function to the differences, of shape (n_samples - 1, n_dims), by default None
 
         Returns
         -------
-        _type_
-            _description_
+        np.ndarray
+            The velocity between consecutive samples, of shape (n_samples - 1,)
 
         Raises
         ------
         ValueError
-            _description_
+            If the method is not supported
         """
-        time = np.diff(data.time)
-        if diff_method=="radial":
-            if diff_dimensions is None:
-                data = self.data
-            else:
-                data = self.data.sel(dimension=diff_dimensions)
-            difference = data.diff("time")
-            if filter_method is not None:
-                difference = filter_method(difference)
-            difference = np.hypot(*difference.transpose(("dimension", "time")))
-        else:
-            raise ValueError
-        diff = difference / time
-        return diff
-
-    def identify_velocity_events(self, velocity_params={}):
-        velocity = self.differentiate(**velocity_params)
-        velocity = np.abs(velocity)
-        mask = parse_query(velocity, velocity_params)
-        onsets, offsets = binary_digitize(mask)
+        if diff_method != "radial":
+            raise ValueError(f"Unsupported differentiation method: {diff_method}")
+        position = select_dimensions(self.position, self.dimensions, diff_dimensions)
+        return radial_velocity(self.time, position, filter_method=filter_method)
+
+    def stream_velocity(self, velocity_query=None, diff_dimensions=None, sos=None, use_blink_mask=False, chunk_size=1_000_000):
+        """The velocity and velocity events, one chunk of samples at a time
+
+        Memory use is set by `chunk_size` rather than the length of the
+        recording, e.g. for a session of many hours with memory-mapped
+        positions. See `stream_velocity` for what is yielded.
+
+        Parameters
+        ----------
+        velocity_query : dict, optional
+            With 'min' and/or 'max' keys
+        diff_dimensions : str | list[str] | None, optional
+            Select a single or a subset of dimensions, by default all
+        sos : np.ndarray, optional
+            Second-order sections of a filter applied causally to the differences
+        use_blink_mask : bool, optional
+            Whether events exclude masked samples, as fixations do, by default False
+        chunk_size : int, optional
+            The number of samples per chunk, by default 1e6
+        """
+        dims = None
+        if diff_dimensions is not None:
+            names = [diff_dimensions] if isinstance(diff_dimensions, str) else diff_dimensions
+            dims = [self.dimensions.index(name) for name in names]
+        return stream_velocity(
+            self.time, self.position, velocity_query,
+            blink_mask=self.blink_mask if use_blink_mask else None,
+            sos=sos, dims=dims, chunk_size=chunk_size
+        )
+
+    def identify_velocity_events(self, velocity_query=None, velocity_params=None):
+        """Find the runs of samples whose velocity matches the query
+
+        Returns
+        -------
+        dict
+            'onset' and 'offset' sample of each event, and the 'velocity' between samples
+        """
+        velocity = self.differentiate(**(velocity_params or {}))
+        _, onsets, offsets = velocity_events(velocity[np.newaxis], velocity_query)
         return {'onset': onsets, 'offset': offsets, 'velocity': velocity}
 
-    def get_saccades(self, velocity_query, duration_query=None, peak_velocity_query=None, velocity_params={}):
-        data = self.identify_velocity_events(velocity_query, velocity_params)
-        dimensions = self.data.dimensions
-
-        records = []
-        for idx in range(data['onsets'].size):
-            record = {}
-            for field in ['onset', 'offset']:
-                record[f'{field}.time'] = self.data.time[data[field][idx]]
-            record['duration'] = duration = record['offset.time'] - record['onset.time']
-            tslice = slice(record['onset.time'], record['offset.time'])
-            record['peak_velocity'] = peak_velocity = data['velocity'].sel(time=tslice).max()
-            if not parse_query(duration, duration_query): continue
-            if not parse_query(peak_velocity, peak_velocity_query): continue
-
-            for field, dim in product(['onset', 'offset'], dimensions):
-                record[f'{field}.{dim}'] = self.data.isel(time=data[field][idx]).sel(dimension=dim)
-            record['amplitude'] = np.hypot(*[record['offset.{dim}']-record['onset.{dim}'] for dim in dimensions])
-            records.append(record)
+    def get_saccades(self, velocity_query, duration_query=None, peak_velocity_query=None, velocity_params=None):
+        """Find saccades, as runs of samples above a velocity
+
+        Parameters
+        ----------
+        velocity_query : dict
+            With 'min' and/or 'max' keys, e.g. {'min': 30}
+        duration_query, peak_velocity_query : dict, optional
+            With 'min' and/or 'max' keys
+        velocity_params : dict, optional
+            Passed to `differentiate`
+
+        Returns
+        -------
+        np.ndarray
+            A structured array with a row per saccade and the fields
+            'onset', 'offset' (samples), 'onset.time', 'offset.time',
+            'duration', 'peak_velocity', 'onset.<dim>', 'offset.<dim>' and 'amplitude'
+        """
+        events = self.identify_velocity_events(velocity_query, velocity_params)
+        onsets, offsets = events['onset'], events['offset']
+        columns = saccade_columns(
+            self.time, self.position[np.newaxis], events['velocity'][np.newaxis],
+            np.zeros_like(onsets), onsets, offsets, self.dimensions,
+            duration_query=duration_query, peak_velocity_query=peak_velocity_query
+        )
+        del columns['trial']
+        records = make_table(columns)
 
         self.inferred['saccades'] = records
 
         return records
 
-    def get_fixations(self, velocity_query, duration_query=None, velocity_params={}):
-        data = self.identify_velocity_events(velocity_query, velocity_params)
-        dimensions = self.data.dimensions
+    def get_fixations(self, velocity_query, duration_query=None, velocity_params=None):
+        """Find fixations, as runs of samples below a velocity
 
-        records = []
-        for idx in range(data['onsets'].size):
-            record = {}
-            for field in ['onset', 'offset']:
-                record[f'{field}.time'] = self.data.time[data[field][idx]]
-            record['duration'] = duration = record['offset.time'] - record['onset.time']
-            if not parse_query(duration, duration_query): continue
+        Masked samples (see `mask_blinks`) are never part of a fixation, so
+        a blink splits a fixation in two.
+
+        Parameters
+        ----------
+        velocity_query : dict
+            With 'min' and/or 'max' keys, e.g. {'max': 30}
+        duration_query : dict, optional
+            With 'min' and/or 'max' keys
+        velocity_params : dict, optional
+            Passed to `differentiate`
 
-            tslice = slice(record['onset.time'], record['offset.time'])
-            position = self.data.sel(time=tslice).mean('time')
-            for dim in dimensions:
-                record[dim] = position.sel(dimension=dim)
-            records.append(record)
+        Returns
+        -------
+        np.ndarray
+            A structured array with a row per fixation and the fields
+            'onset', 'offset' (samples), 'onset.time', 'offset.time',
+            'duration' and the mean position in each dimension
+        """
+        velocity = self.differentiate(**(velocity_params or {}))
+        _, onsets, offsets = velocity_events(velocity[np.newaxis], velocity_query, blink_mask=self.blink_mask[np.newaxis])
+        columns = fixation_columns(
+            self.time, self.position[np.newaxis], np.zeros_like(onsets), onsets, offsets,
+            self.dimensions, duration_query=duration_query
+        )
+        del columns['trial']
+        records = make_table(columns)
 
         self.inferred['fixations'] = records
 
         return records
 
+    def detect_parallel(self, kind, velocity_query, duration_query=None, peak_velocity_query=None, velocity_params=None,
+                        n_jobs=None, chunk_size=1_000_000, overlap=1000, logger=None):
+        """Find saccades or fixations in a long recording, in chunks on a pool of worker processes
+
+        Each chunk is sent to a worker with `overlap` samples of context
+        either side, and keeps the events starting within it. Events still
+        running at the end of their chunk's context are detected again
+        afterwards, with as much context as they need. The result matches
+        `get_saccades` or `get_fixations`, as long as any `filter_method`
+        settles within `overlap` samples.
+
+        Parameters
+        ----------
+        kind : str
+            'saccades' or 'fixations'
+        velocity_query, duration_query, peak_velocity_query, velocity_params
+            See `get_saccades` and `get_fixations`. A `filter_method` must be
+            picklable, e.g. a module-level function, and peak_velocity_query
+            only applies to saccades
+        n_jobs : int, optional
+            The number of worker processes, by default the number of CPUs.
+            With 1, the chunks are processed in turn in this process
+        chunk_size : int, optional
+            The number of samples per chunk, by default 1e6
+        overlap : int, optional
+            The samples of context either side of each chunk, by default 1000
+        logger : logging.Logger, optional
+
+        Returns
+        -------
+        np.ndarray
+            The events, as returned by `get_saccades` or `get_fixations`
+        """
+        if kind not in EVENT_METHODS:
+            raise ValueError(f"Unsupported event kind: {kind}")
+        # at least one sample of context, so an event starting a chunk is known to start there
+        overlap = max(int(overlap), 1)
+        windows = [
+            (start, min(start + chunk_size, self.n_samples), overlap, overlap)
+            for start in range(0, self.n_samples, chunk_size)
+        ]
+        if windows:
+            blocks = [self._event_window_args(kind, velocity_query, velocity_params, *window) for window in windows]
+            results = run_blocks(detect_events, blocks, n_jobs=n_jobs, logger=logger, name=kind)
+            chunks = [self._trim_window_events(table, *window) for table, window in zip(results, windows)]
+            table = np.concatenate([events for events, _ in chunks])
+            truncated = np.concatenate([truncated for _, truncated in chunks])
+            for idx in np.flatnonzero(truncated):
+                table[idx] = self._detect_long_event(kind, velocity_query, velocity_params, int(table['onset'][idx]), overlap)
+        else:
+            # no samples, so the empty table with the fields of the events
+            table = detect_events(*self._event_window_args(kind, velocity_query, velocity_params, 0, 0, 0, 0))
+
+        table = filter_events(table, duration_query, peak_velocity_query if kind == 'saccades' else None)
+        records = make_table({name: table[name] for name in table.dtype.names if name != 'trial'})
+        self.inferred[kind] = records
+        return records
+
+    def _event_window_args(self, kind, velocity_query, velocity_params, start, stop, before, after):
+        """The arguments of `detect_events` for the samples [start - before, stop + after)"""
+        first, last = max(start - before, 0), min(stop + after, self.n_samples)
+        return (
+            kind, self.time[first:last], self.position[np.newaxis, first:last],
+            self.blink_mask[np.newaxis, first:last], self.dimensions, velocity_query, velocity_params
+        )
+
+    def _trim_window_events(self, table, start, stop, before, after):
+        """The events of a window starting in [start, stop), in samples of the whole recording
+
+        Returns
+        -------
+        events : np.ndarray
+            The events, with their 'onset' and 'offset' shifted to the recording
+        truncated : np.ndarray
+            Whether each event runs to the end of the window, before the end of the recording
+        """
+        first, last = max(start - before, 0), min(stop + after, self.n_samples)
+        table = table.copy()
+        table['onset'] += first
+        table['offset'] += first
+        table = table[(table['onset'] >= start) & (table['onset'] < stop)]
+        truncated = (table['offset'] == last - 1) & (last < self.n_samples)
+        return table, truncated
+
+    def _detect_long_event(self, kind, velocity_query, velocity_params, onset, overlap):
+        """Detect the event starting at `onset` again, doubling the context after it until it ends within it"""
+        after = 2 * overlap
+        while True:
+            window = (onset, onset + 1, overlap, after)
+            table = detect_events(*self._event_window_args(kind, velocity_query, velocity_params, *window))
+            events, truncated = self._trim_window_events(table, *window)
+            if not truncated.any():
+                return events[0]
+            after *= 2
+
+    def get_interval_index(self, key):
+        """The interval index of an inferred table, e.g. 'saccades', built once per table"""
+        table = self.inferred[key]
+        cached = self._interval_indices.get(key)
+        if cached is None or cached[0] is not table:
+            cached = (table, IntervalIndex(table['onset.time'], table['offset.time']))
+            self._interval_indices[key] = cached
+        return cached[1]
+
     def get_by_events(self, events, bounds):
+        """The traces and inferred events around each of a set of events
+
+        Parameters
+        ----------
+        events : list[dict] or np.ndarray
+            Events with a 'timestamp', or the timestamps themselves
+        bounds : tuple[float, float]
+            The window [left, right) around each event, in the units of time
+
+        Returns
+        -------
+        dict
+            'time' (n_events, n_window) sample times relative to each event,
+            'trace' (n_events, n_window, n_dims) positions and 'mask'
+            (n_events, n_window) blink masks, with NaN positions and False
+            masks outside the data, so each column is the same latency for
+            every event. For each table in `inferred` (e.g.
+            'saccades'), the records overlapping each window, with the fields
+            'event', the index of the event, and 'latency', the onset relative to the event
+        """
+        if len(events) and isinstance(events[0], dict):
+            timestamps = np.array([event['timestamp'] for event in events])
+        else:
+            timestamps = np.asarray(events)
         left, right = bounds
-        result = []
-        for event in events:
-            data = {}
-            l, r = event['timestamp']+left, event['timestamp']+right
-            data['trace'] = trace = self.data.sel(time=slice(l, r)).copy()
-            data['mask'] = mask = self.blink_mask[l:r]
-            trace.time = trace.time - event['timestamp']
-
-            for key, value in self.inferred.items():
-                data[key] = []
-                for record in value:
-                    if r <= record['onset.time'] or record['offset.time'] <= l:
-                        continue
-                    relative_record = record.copy()
-                    relative_record['latency'] = record['onset.time'] - event['timestamp']
-                    data[key].append(record)
-            result.append(data)
+        time = self.time
+        # samples are taken to be evenly spaced; windows starting before the
+        # first sample have negative starts, and are padded
+        dt = time[1] - time[0]
+        n_window = int(round((right - left) / dt))
+        starts = np.round((timestamps + left - time[0]) / dt).astype(int)
+        result = {
+            # the sample times of the window, extrapolated outside the data
+            'time': time[0] + (starts[:, np.newaxis] + np.arange(n_window)) * dt - timestamps[:, np.newaxis],
+            'trace': gather_windows(self.position, starts, n_window, np.nan),
+            'mask': gather_windows(self.blink_mask, starts, n_window, False),
+        }
+        for key, table in self.inferred.items():
+            windows, idx = self.get_interval_index(key).overlapping(timestamps + left, timestamps + right)
+            records = table[idx]
+            result[key] = make_table({
+                **{name: records[name] for name in records.dtype.names},
+                'event': windows,
+                'latency': records['onset.time'] - timestamps[windows],
+            })
         return result
 
 class GazeDataSet:
-    def __init__(self, data: list[GazeData], attrs=None):
-        self.data = data
+    """Gaze positions of many trials of equal length, in one array
+
+    Blink masking, differentiation and event detection run on all trials
+    at once along the time axis. The positions may be memory-mapped, and
+    per-trial `GazeData` views (see `trial`) are created on demand without
+    copying them.
+
+    Parameters
+    ----------
+    time : np.ndarray
+        Sample times of shape (n_timepoints,), shared by all trials
+    position : np.ndarray
+        Array of shape (n_trials, n_timepoints, n_dimensions)
+    dimensions : list[str]
+        The names of the dimensions
+    attrs : dict, optional
+    """
+    def __init__(self, time: np.ndarray, position: np.ndarray, dimensions: list[str], attrs=None):
+        self.time = np.asarray(time)
+        self.position = position
+        self.dimensions = list(dimensions)
+        self.attrs = {} if attrs is None else attrs
+        self.blink_mask = np.ones(position.shape[:2], dtype=bool)
+        self.inferred = {}
+        # the .npy file of memory-mapped positions, which worker processes map again
+        self.path = None
+
     @classmethod
-    def from_npy(cls, path):
-        data = np.load(path)
-        # data should be an ndarray of shape (n_trials, n_timepoints, n_dimensions)
+    def from_npy(cls, path, mmap=False):
+        """Load positions of shape (n_trials, n_timepoints, n_dimensions), memory-mapped if `mmap`"""
+        data = np.load(path, mmap_mode='r' if mmap else None)
         time = np.arange(data.shape[1])
         dimensions = [f'dim_{i}' for i in range(data.shape[2])]
-        return cls([GazeData(time, trial, dimensions) for trial in data])
\ No newline at end of file
+        dataset = cls(time, data, dimensions)
+        if mmap:
+            dataset.path = path
+        return dataset
+
+    @classmethod
+    def from_gaze_data(cls, data: list[GazeData], attrs=None):
+        """Stack the samples of trials of equal length"""
+        dataset = cls(data[0].time, np.stack([trial.position for trial in data]), data[0].dimensions, attrs=attrs)
+        dataset.blink_mask[:] = np.stack([trial.blink_mask for trial in data])
+        return dataset
+
+    @property
+    def n_trials(self):
+        return self.position.shape[0]
+
+    def __len__(self):
+        return self.n_trials
+
+    def __getitem__(self, idx):
+        return self.trial(idx)
+
+    def __iter__(self):
+        return (self.trial(idx) for idx in range(self.n_trials))
+
+    @property
+    def data(self):
+        """The trials as a sequence of `GazeData` views, created as they are accessed"""
+        return self
+
+    def trial(self, idx):
+        """A `GazeData` view of a trial
+
+        It shares the positions and blink mask of the dataset, and its
+        inferred tables are the trial's rows of the dataset's.
+        """
+        trial = GazeData(self.time, self.position[idx], self.dimensions)
+        trial._blink_mask = self.blink_mask[idx]
+        for key, table in self.inferred.items():
+            records = table[table['trial'] == idx]
+            trial.inferred[key] = make_table({name: records[name] for name in records.dtype.names if name != 'trial'})
+        return trial
+
+    def mask_blinks(self, threshold=30, pad=None):
+        """Mask blinks in all trials, see `GazeData.mask_blinks`"""
+        self.blink_mask &= ~blink_intervals(self.position, threshold, pad)
+
+    def differentiate(self, diff_method="radial", diff_dimensions=None, filter_method=None):
+        """The velocity between consecutive samples of all trials, of shape (n_trials, n_timepoints - 1)
+
+        See `GazeData.differentiate`
+        """
+        if diff_method != "radial":
+            raise ValueError(f"Unsupported differentiation method: {diff_method}")
+        position = select_dimensions(self.position, self.dimensions, diff_dimensions)
+        return radial_velocity(self.time, position, filter_method=filter_method)
+
+    def get_saccades(self, velocity_query, duration_query=None, peak_velocity_query=None, velocity_params=None):
+        """Find the saccades of all trials, see `GazeData.get_saccades`
+
+        Returns
+        -------
+        np.ndarray
+            A structured array with a row per saccade, with its 'trial' and the fields of `GazeData.get_saccades`
+        """
+        velocity = self.differentiate(**(velocity_params or {}))
+        rows, onsets, offsets = velocity_events(velocity, velocity_query)
+        records = make_table(saccade_columns(
+            self.time, self.position, velocity, rows, onsets, offsets, self.dimensions,
+            duration_query=duration_query, peak_velocity_query=peak_velocity_query
+        ))
+        self.inferred['saccades'] = records
+        return records
+
+    def get_fixations(self, velocity_query, duration_query=None, velocity_params=None):
+        """Find the fixations of all trials, see `GazeData.get_fixations`
+
+        Returns
+        -------
+        np.ndarray
+            A structured array with a row per fixation, with its 'trial' and the fields of `GazeData.get_fixations`
+        """
+        velocity = self.differentiate(**(velocity_params or {}))
+        rows, onsets, offsets = velocity_events(velocity, velocity_query, blink_mask=self.blink_mask)
+        records = make_table(fixation_columns(
+            self.time, self.position, rows, onsets, offsets, self.dimensions, duration_query=duration_query
+        ))
+        self.inferred['fixations'] = records
+        return records
+
+    def detect_parallel(self, kind, velocity_query, duration_query=None, peak_velocity_query=None, velocity_params=None,
+                        n_jobs=None, trials_per_job=None, logger=None):
+        """Find the saccades or fixations of all trials, on a pool of worker processes
+
+        The trials are split into blocks, each detected by a worker, and the
+        tables of the blocks are concatenated with their trial numbers. A
+        memory-mapped dataset (see `from_npy`) is mapped again by each
+        worker, so only the path of the file is sent to it.
+
+        Parameters
+        ----------
+        kind : str
+            'saccades' or 'fixations'
+        velocity_query, duration_query, peak_velocity_query, velocity_params
+            See `GazeData.detect_parallel`
+        n_jobs : int, optional
+            The number of worker processes, by default the number of CPUs.
+            With 1, the blocks are processed in turn in this process
+        trials_per_job : int, optional
+            The number of trials in each block, by default enough for four blocks per worker
+        logger : logging.Logger, optional
+
+        Returns
+        -------
+        np.ndarray
+            The events, as returned by `get_saccades` or `get_fixations`
+        """
+        if kind not in EVENT_METHODS:
+            raise ValueError(f"Unsupported event kind: {kind}")
+        if trials_per_job is None:
+            trials_per_job = -(-self.n_trials // (4 * (n_jobs or os.cpu_count() or 1)))
+        trials_per_job = max(int(trials_per_job), 1)
+        starts = range(0, self.n_trials, trials_per_job)
+        blocks = []
+        for start in starts:
+            trials = slice(start, start + trials_per_job)
+            if self.path is not None:
+                position = (self.path, trials)
+            else:
+                position = self.position[trials]
+            blocks.append((
+                kind, self.time, position, self.blink_mask[trials], self.dimensions, velocity_query, velocity_params
+            ))
+        if blocks:
+            tables = run_blocks(detect_events, blocks, n_jobs=n_jobs, logger=logger, name=kind)
+        else:
+            # no trials, so the empty table with the fields of the events
+            tables = [detect_events(kind, self.time, self.position, self.blink_mask, self.dimensions, velocity_query, velocity_params)]
+        for start, table in zip(starts, tables):
+            table['trial'] += start
+        records = filter_events(np.concatenate(tables), duration_query, peak_velocity_query if kind == 'saccades' else None)
+        self.inferred[kind] = records
+        return records
+
+EVENT_METHODS = {'saccades': 'get_saccades', 'fixations': 'get_fixations'}
+
+def detect_events(kind, time, position, blink_mask, dimensions, velocity_query, velocity_params=None):
+    """Find the saccades or fixations of (n_trials, n_timepoints, n_dims) positions, e.g. in a worker process
+
+    The positions may be given as the (path, index) of a .npy file, which
+    is memory-mapped. The events are not filtered by duration or peak
+    velocity, see `filter_events`.
+
+    Returns
+    -------
+    np.ndarray
+        The events, with the 'trial' of each numbered from the first of `position`
+    """
+    if isinstance(position, tuple):
+        path, idx = position
+        position = np.load(path, mmap_mode='r')[idx]
+    dataset = GazeDataSet(time, position, dimensions)
+    dataset.blink_mask[:] = blink_mask
+    return getattr(dataset, EVENT_METHODS[kind])(velocity_query, velocity_params=velocity_params)
+
+def run_blocks(func, blocks, n_jobs=None, logger=None, name=None):
+    """Run `func(*args)` for each of `blocks` in a pool of worker processes
+
+    Returns
+    -------
+    list
+        The return value of each call, in the order of `blocks`
+
+    Raises
+    ------
+    Exception
+        The error of the first block that failed
+    """
+    if n_jobs == 1:
+        return [func(*args) for args in blocks]
+    results = [None] * len(blocks)
+    errors = []
+
+    jobs = JobManager(max_processes=n_jobs, logger=logger)
+    try:
+        for idx, args in enumerate(blocks):
+            def on_result(result, idx=idx):
+                results[idx] = result
+            jobs.submit(func, *args, name=f"{name or func.__name__} {idx}", on_result=on_result, on_error=errors.append, kind='process')
+        jobs.wait()
+    finally:
+        jobs.shutdown(cancel=True)
+    if errors:
+        raise errors[0]
+    return results
@@ -1,9 +1,22 @@
+from functools import lru_cache
+
+from simiview.util.decimation import lod_level, minmax_envelope, simplify_paths
 from simiview.util.linecollection import LineCollection, PathCollection
 from vispy.scene import Widget
 
-from simianpy.signal import sosFilter
+COMPONENTS = ['eyeh', 'eyev']
+SELECTED_COLOR = (1, 0, 0, 1)
+UNSELECTED_ALPHA = 0.1
+
+@lru_cache(maxsize=None)
+def get_filter():
+    """The 50 Hz lowpass applied to the traces, designed on first use"""
+    from simianpy.signal import sosFilter
+    return sosFilter('lowpass', 6, 50, 1000)
 
-filt = sosFilter('lowpass', 6, 50, 1000)
+def filt(traces):
+    """Apply the lowpass filter along the time axis of each trace"""
+    return get_filter()(traces, axis=-1)
 
 class GazeViewer(Widget):
     def __init__(self):
@@ -13,28 +26,42 @@ class GazeViewer(Widget):
 
         self.views = {}
         self.traces = {}
+        # the selected trials, drawn on top of all trials
+        self.overlays = {}
 
-        for idx, component in enumerate(['eyeh', 'eyev']):
+        for idx, component in enumerate(COMPONENTS):
             view = self.grid.add_view(row=idx, col=0)
             view.camera = 'panzoom'
             view.interactive = True
             view.camera.rect = (0, -15), (500, 30)
             trace = LineCollection()
             view.add(trace)
+            overlay = LineCollection()
+            overlay.order = 1
+            view.add(overlay)
             self.views[component] = view
             self.traces[component] = trace
+            self.overlays[component] = overlay
         
         self.views['gaze'] = gaze_view = self.grid.add_view(row=0, col=1, row_span=2, col_span=2)
         self.traces['gaze'] = gaze_trace = PathCollection()
+        self.overlays['gaze'] = gaze_overlay = PathCollection()
+        gaze_overlay.order = 1
         gaze_view.camera = 'panzoom'
         gaze_view.interactive = True
         gaze_view.camera.rect = (-15, -15), (30, 30)
         gaze_view.add(gaze_trace)
+        gaze_view.add(gaze_overlay)
 
 
         self.gaze_data = None
+        self._filtered_data = None
         self.filter_enabled = False
         self.selected_lines = None
+        # draw all but the selected trials decimated to the resolution of each view
+        self.lod_enabled = True
+        self._lod_levels = {}
+        self._colors = None
         self.freeze()
 
     def register_events(self, parent):
@@ -42,41 +69,134 @@ class GazeViewer(Widget):
         #     view.events.mouse_press.connect(lambda e: self.on_mouse_press(e, component))
         self.views['eyeh'].events.mouse_press.connect(lambda e: self.on_mouse_press(e, 'eyeh'))
         self.views['eyev'].events.mouse_press.connect(lambda e: self.on_mouse_press(e, 'eyev'))
+        self.views['gaze'].events.mouse_press.connect(lambda e: self.on_mouse_press(e, 'gaze'))
+        for component, view in self.views.items():
+            view.scene.transform.changed.connect(lambda e, component=component: self.on_view_change(component))
         parent.events.key_press.connect(self.on_key_press)
 
     def on_key_press(self, event):
         if event.key == 'f':
             self.filter_enabled = not self.filter_enabled
             self.update_traces()
+        elif event.key == 'l':
+            self.lod_enabled = not self.lod_enabled
+            self.update_traces()
+
+    def get_traces(self):
+        """The horizontal and vertical traces of shape (n_trials, n_samples, 2), filtered if enabled
+
+        The filtered traces are computed once per load and cached, so
+        toggling the filter only re-uploads the positions. The 2D gaze
+        paths are always drawn unfiltered.
+        """
+        if not self.filter_enabled:
+            return self.gaze_data
+        if self._filtered_data is None:
+            self._filtered_data = filt(np.moveaxis(self.gaze_data, 1, -1))
+            self._filtered_data = np.moveaxis(self._filtered_data, -1, 1)
+        return self._filtered_data
 
     def update_traces(self):
+        """Upload the positions of all trials, e.g. after loading or toggling the filter"""
+        if self.gaze_data is None:
+            return
+        for component in self.traces:
+            self.draw_component(component)
+        self.update_selection()
+
+    def get_lod_level(self, component):
+        """The level of detail of a view, see `lod_level`, or None for full resolution
+
+        Time traces are decimated to a min/max envelope once a pixel spans
+        more than four samples, and gaze paths are simplified on a grid of one pixel.
+        """
+        if not self.lod_enabled:
+            return None
+        view = self.views[component]
+        width, height = view.size
+        if width <= 0 or height <= 0:
+            return None
+        rect = view.camera.rect
+        if component == 'gaze':
+            return lod_level(max(rect.width / width, rect.height / height), full_resolution=0)
+        return lod_level(rect.width / width, full_resolution=4)
+
+    def draw_component(self, component):
+        """Upload the positions of all trials to a view, at its level of detail
+
+        The selected trials in the overlays are always drawn at full resolution.
+        """
+        level = self.get_lod_level(component)
+        self._lod_levels[component] = level
+        if component == 'gaze':
+            paths = self.gaze_data if level is None else simplify_paths(self.gaze_data, level)
+            self.traces[component].set_data(paths=paths)
+        else:
+            lines = self.get_traces()[:, :, COMPONENTS.index(component)]
+            if level is None:
+                self.traces[component].set_data(lines=lines)
+            else:
+                x, envelope = minmax_envelope(lines, level)
+                self.traces[component].set_data(lines=envelope, x=x)
+        if self._colors is not None:
+            self.traces[component].set_colors(color=self._colors)
+
+    def on_view_change(self, component):
+        """Decimate a view again once zooming has changed its level of detail"""
+        if self.gaze_data is None:
+            return
+        if self.get_lod_level(component) != self._lod_levels.get(component):
+            self.draw_component(component)
+
+    def update_selection(self):
+        """Recolour the trials and redraw the selected ones on top
+
+        Only the colours of the existing traces are updated, and the
+        positions of the selected trials alone are uploaded to the overlays.
+        """
         if self.gaze_data is None:
             return
         colors = np.ones((self.gaze_data.shape[0], 4), dtype=np.float32)
-        zorder = np.zeros(self.gaze_data.shape[0])
-        if self.selected_lines is not None:
-            colors[:, 3] = 0.1
-            colors[self.selected_lines] = (1, 0, 0, 1)
-            zorder[self.selected_lines] = 1
-        for component in ['eyeh', 'eyev']:
-            component_idx = 0 if component == 'eyeh' else 1
-            traces = self.gaze_data[:, :, component_idx]
-            if self.filter_enabled:
-                traces = filt(traces, axis=-1)
-            self.traces[component].set_data(lines=traces, color=colors, zorder=zorder)
-        self.traces['gaze'].set_data(paths=self.gaze_data, color=colors, zorder=zorder)
+        selected = None if self.selected_lines is None else np.atleast_1d(self.selected_lines)
+        if selected is not None and selected.size:
+            colors[:, 3] = UNSELECTED_ALPHA
+        self._colors = colors
+        for trace in self.traces.values():
+            trace.set_colors(color=colors)
+
+        if selected is None or not selected.size:
+            for overlay in self.overlays.values():
+                overlay.visible = False
+            return
+        traces = self.get_traces()[selected]
+        overlay_colors = np.tile(np.array(SELECTED_COLOR, dtype=np.float32), (selected.size, 1))
+        for component_idx, component in enumerate(COMPONENTS):
+            self.overlays[component].set_data(lines=traces[:, :, component_idx], color=overlay_colors)
+        self.overlays['gaze'].set_data(paths=self.gaze_data[selected], color=overlay_colors)
+        for overlay in self.overlays.values():
+            overlay.visible = True
 
     def on_mouse_press(self, event, component):
         if (event.button == 1 
             and 'Control' in event.mouse_event.modifiers 
             and self.gaze_data is not None):
             lineidx = self.traces[component].get_closest_line_from_mouse_event(event.mouse_event)
-            self.selected_lines = lineidx
-            self.update_traces()
+            if 'Shift' in event.mouse_event.modifiers and self.selected_lines is not None:
+                # add the trial to the selection, or remove it if already selected
+                selected = np.atleast_1d(self.selected_lines)
+                if lineidx in selected:
+                    self.selected_lines = selected[selected != lineidx]
+                else:
+                    self.selected_lines = np.append(selected, lineidx)
+            else:
+                self.selected_lines = lineidx
+            self.update_selection()
 
     def load_data(self, gaze_data):
         self.selected_lines = None
         self.gaze_data = gaze_data
+        self._filtered_data = None
+        self._colors = None
         # self.view.camera.rect = (0, -15), (gaze_data.shape[1], 30)
         self.update_traces()
 
@@ -172,7 +292,7 @@ class MainWindow(QMainWindow):
     def index_clicked(self, _):
         idx = [idx.row() for idx in self.table.selectionModel().selectedRows()]
         self.gaze_viewer.selected_lines = idx
-        self.gaze_viewer.update_traces()
+        self.gaze_viewer.update_selection()
 
     def header_clicked(self, logicalIndex):
         # Create a context menu
@@ -0,0 +1,265 @@
+"""Background jobs with progress, cancellation and result delivery
+
+Long operations are submitted to a `JobManager`, which runs them on a thread
+or process pool. Inside a job, the work reports its progress with
+`report_progress`, which also raises `JobCancelled` once the job has been
+cancelled; outside of a job it does nothing, so the same functions can be
+called directly (e.g. from the command line).
+
+Results, errors and progress are queued by the workers and delivered by
+`JobManager.poll`, which should be called regularly from the GUI thread
+(e.g. from a vispy timer), so callbacks may safely touch visuals and widgets.
+"""
+import itertools
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class JobCancelled(Exception):
+    pass
+
+_local = threading.local()
+
+def current_job():
+    """The job running on this thread, or None"""
+    return getattr(_local, 'job', None)
+
+def report_progress(progress, message=''):
+    """Report progress of the current job, raising JobCancelled if it was cancelled
+
+    Parameters
+    ----------
+    progress : float
+        Fraction of the job completed, between 0 and 1
+    message : str, optional
+        A short description of the current step, by default ''
+    """
+    job = current_job()
+    if job is not None:
+        job.report(progress, message)
+
+class Job:
+    """Handle to a submitted job"""
+    def __init__(self, manager, job_id, name, on_result=None, on_error=None):
+        self.manager = manager
+        self.id = job_id
+        self.name = name
+        self.on_result = on_result
+        self.on_error = on_error
+        self.progress = 0.
+        self.message = ''
+        self.status = 'pending'
+        self.future = None
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def done(self):
+        return self.status in ('finished', 'failed', 'cancelled')
+
+    def cancel(self):
+        """Request cancellation. A running job stops at its next progress report"""
+        self._cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+        self.manager._cancel_process_job(self.id)
+
+    def check(self):
+        if self.cancelled:
+            raise JobCancelled(self.name)
+
+    def report(self, progress, message=''):
+        self.check()
+        self.manager._events.put(('progress', self.id, progress, message))
+
+class _ProcessJob:
+    """Stand-in for a Job inside a worker process, forwarding progress through a queue"""
+    def __init__(self, job_id, progress_queue, cancelled):
+        self.id = job_id
+        self.progress_queue = progress_queue
+        self.cancelled_ids = cancelled
+
+    def check(self):
+        if self.id in self.cancelled_ids:
+            raise JobCancelled(self.id)
+
+    def report(self, progress, message=''):
+        self.check()
+        self.progress_queue.put((self.id, progress, message))
+
+def _run_in_thread(job, func, args, kwargs):
+    _local.job = job
+    try:
+        job.check()
+        return func(*args, **kwargs)
+    finally:
+        _local.job = None
+
+def _run_in_process(job_id, progress_queue, cancelled, func, args, kwargs):
+    _local.job = _ProcessJob(job_id, progress_queue, cancelled)
+    try:
+        _local.job.check()
+        return func(*args, **kwargs)
+    finally:
+        _local.job = None
+
+class JobManager:
+    """Runs jobs on thread or process pools and delivers their results
+
+    Parameters
+    ----------
+    max_threads : int, optional
+        Size of the thread pool, by default as chosen by ThreadPoolExecutor
+    max_processes : int, optional
+        Size of the process pool, created on first use, by default the number of CPUs
+    on_progress : callable, optional
+        Called from `poll` with the Job whenever its progress or status changes
+    logger : logging.Logger, optional
+        Errors from jobs without an `on_error` callback are logged here
+    """
+    def __init__(self, max_threads=None, max_processes=None, on_progress=None, logger=None):
+        self.max_processes = max_processes
+        self.on_progress = on_progress
+        self.logger = logger
+        self.jobs = {}
+
+        self._ids = itertools.count()
+        self._events = queue.SimpleQueue()
+        self._thread_pool = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='simiview-job')
+        self._process_pool = None
+        self._mp_manager = None
+        self._progress_queue = None
+        self._cancelled = None
+
+    def submit(self, func, *args, name=None, on_result=None, on_error=None, kind='thread', **kwargs):
+        """Run `func(*args, **kwargs)` in the background
+
+        Parameters
+        ----------
+        func : callable
+            The work to run. For kind='process' it must be picklable, as must its arguments
+        name : str, optional
+            A name shown with progress reports, by default the function's name
+        on_result : callable, optional
+            Called with the return value on the thread calling `poll`
+        on_error : callable, optional
+            Called with the exception on the thread calling `poll`
+        kind : str, optional
+            'thread' or 'process', by default 'thread'
+
+        Returns
+        -------
+        Job
+        """
+        job_id = next(self._ids)
+        job = Job(self, job_id, name or getattr(func, '__name__', 'job'), on_result=on_result, on_error=on_error)
+        self.jobs[job_id] = job
+        if kind == 'thread':
+            job.future = self._thread_pool.submit(_run_in_thread, job, func, args, kwargs)
+        elif kind == 'process':
+            self._ensure_process_pool()
+            job.future = self._process_pool.submit(
+                _run_in_process, job_id, self._progress_queue, self._cancelled, func, args, kwargs
+            )
+        else:
+            raise ValueError(f"Invalid job kind: {kind}")
+        job.status = 'running'
+        job.future.add_done_callback(lambda future: self._events.put(('done', job_id)))
+        return job
+
+    def _ensure_process_pool(self):
+        if self._process_pool is not None:
+            return
+        # multiprocessing is imported on first use, as the GUI rarely needs it
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        self._mp_manager = multiprocessing.Manager()
+        self._progress_queue = self._mp_manager.Queue()
+        self._cancelled = self._mp_manager.dict()
+        self._process_pool = ProcessPoolExecutor(max_workers=self.max_processes)
+
+    def _cancel_process_job(self, job_id):
+        if self._cancelled is not None:
+            self._cancelled[job_id] = True
+
+    def cancel_all(self):
+        for job in list(self.jobs.values()):
+            job.cancel()
+
+    @property
+    def busy(self):
+        return len(self.jobs) > 0
+
+    def poll(self):
+        """Deliver progress, results and errors of background jobs on the calling thread"""
+        if self._progress_queue is not None:
+            while True:
+                try:
+                    job_id, progress, message = self._progress_queue.get_nowait()
+                except queue.Empty:
+                    break
+                self._events.put(('progress', job_id, progress, message))
+
+        while True:
+            try:
+                event = self._events.get_nowait()
+            except queue.Empty:
+                break
+            kind, job_id = event[:2]
+            job = self.jobs.get(job_id)
+            if job is None:
+                continue
+            if kind == 'progress':
+                job.progress, job.message = event[2:]
+                self._notify(job)
+            elif kind == 'done':
+                self._finish(job)
+
+    def _finish(self, job):
+        self.jobs.pop(job.id, None)
+        future = job.future
+        if future.cancelled():
+            job.status = 'cancelled'
+        else:
+            error = future.exception()
+            if isinstance(error, JobCancelled):
+                job.status = 'cancelled'
+            elif error is not None:
+                job.status = 'failed'
+                job.message = str(error)
+                if job.on_error is not None:
+                    job.on_error(error)
+                elif self.logger is not None:
+                    self.logger.error(f"Job {job.name} failed", exc_info=error)
+            else:
+                job.status = 'finished'
+                job.progress = 1.
+                if job.on_result is not None:
+                    job.on_result(future.result())
+        self._notify(job)
+
+    def _notify(self, job):
+        if self.on_progress is not None:
+            self.on_progress(job)
+
+    def wait(self):
+        """Block until all submitted jobs are done, delivering their results"""
+        while self.jobs:
+            for job in list(self.jobs.values()):
+                try:
+                    job.future.exception()
+                except Exception:
+                    # the future was cancelled
+                    pass
+            self.poll()
+
+    def shutdown(self, cancel=True):
+        if cancel:
+            self.cancel_all()
+        self._thread_pool.shutdown(wait=False, cancel_futures=cancel)
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=cancel)
+            self._mp_manager.shutdown()
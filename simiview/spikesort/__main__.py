@@ -1,7 +1,140 @@
-from vispy import app
-from simiview.spikesort.app import SpikeSortApp
+"""Command line entry point of the spike sorter
+
+    python -m simiview.spikesort                      open the sorting GUI
+    python -m simiview.spikesort detect FILE [...]    detect waveforms and compute features
+    python -m simiview.spikesort assign FILE [...]    assign unsorted spikes to unit templates
+
+The detect and assign commands run without a display: they do not import
+PyQt or vispy, so they can run on compute nodes.
+"""
+import argparse
+import logging
+import sys
+
+from simiview.util.profiling import profiler
+
+def run_gui(args):
+    from PyQt5.QtWidgets import QApplication
+    from simiview.spikesort.mainwindow import MainWindow
+    loglevel = 'DEBUG' if args.verbose else 'WARN'
+    app = QApplication([])
+    window = MainWindow(logger_kwargs={'loggerName': 'SpikeSorter', 'fileName': 'spikesort.log', 'printLevel': loglevel})
+    window.show()
+    result = app.exec_()
+    if args.profile:
+        profiler.export(args.profile_out, logger=window.logger)
+    return result
+
+def get_channels(recording, channels, groups=None):
+    """The requested channels, by default the good channels of the recording unless groups are given"""
+    if not channels:
+        return [] if groups else recording.good_channels()
+    unknown = set(channels) - set(recording.channels)
+    if unknown:
+        raise SystemExit(f"Unknown channels: {', '.join(sorted(unknown))}")
+    return channels
+
+def get_groups(recording, groups):
+    """The channel groups given as [[name, channel, ...], ...], by name"""
+    groups = {name: channels for name, *channels in groups or []}
+    for name, channels in groups.items():
+        if not channels:
+            raise SystemExit(f"Channel group {name} has no channels")
+        get_channels(recording, channels)
+    return groups
+
+def run_detect(args, logger):
+    from simiview.spikesort.batch import detect_group, run_channels
+    from simiview.spikesort.recording import Recording
+    recording = Recording(args.file)
+    groups = get_groups(recording, args.group)
+    channels = get_channels(recording, args.channels, groups)
+    logger.info(f"Detecting waveforms on {len(channels)} channels and {len(groups)} channel groups of {recording.file_path}")
+    channel_args = {channel: (recording.file_path, channel, [channel]) for channel in channels}
+    channel_args.update({name: (recording.file_path, name, group) for name, group in groups.items()})
+    results, errors = run_channels(
+        detect_group, channel_args,
+        n_jobs=args.jobs, logger=logger,
+        threshold=args.threshold, threshold_k=args.threshold_k,
+        cmr=args.cmr, apply_filter=not args.no_filter,
+        chunk_size=args.chunk_size, n_components=args.n_components
+    )
+    return 1 if errors else 0
+
+def run_assign(args, logger):
+    from simiview.spikesort.batch import assign_channel, run_channels
+    from simiview.spikesort.recording import Recording
+    recording = Recording(args.file)
+    groups = get_groups(recording, args.group)
+    channels = get_channels(recording, args.channels, groups) + list(groups)
+    logger.info(f"Assigning unsorted spikes on {len(channels)} channels and channel groups of {recording.file_path}")
+    results, errors = run_channels(
+        assign_channel, {channel: (recording.directory / channel,) for channel in channels},
+        n_jobs=args.jobs, logger=logger,
+        threshold=None if args.threshold < 0 else args.threshold,
+        max_bytes=int(args.block_megabytes * 2**20)
+    )
+    return 1 if errors else 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m simiview.spikesort', description="Spike sorting")
+    parser.add_argument('-v', '--verbose', action='store_true', help="log debug messages")
+    parser.add_argument(
+        '--profile', action='store_true',
+        help="time the main operations and write their summary and a Chrome trace on exit; "
+             "operations in worker processes are not included"
+    )
+    parser.add_argument(
+        '--profile-out', default='spikesort_profile.json', metavar='PATH',
+        help="where --profile writes its summary, with the trace beside it (default: spikesort_profile.json)"
+    )
+    subparsers = parser.add_subparsers(dest='command')
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('file', help="a SpikeGadgets (.rec) or Plexon (.pl2) recording")
+    common.add_argument('-c', '--channels', nargs='+', help="channel names, by default all channels not marked as bad")
+    common.add_argument(
+        '-g', '--group', nargs='+', action='append', metavar=('NAME', 'CHANNEL'),
+        help="a channel group (e.g. a tetrode) sorted as one, saved as NAME; may be repeated"
+    )
+    common.add_argument('-j', '--jobs', type=int, default=None, help="number of worker processes, by default the number of CPUs")
+    # suppressed by default, so -v may be given before or after the command
+    common.add_argument('-v', '--verbose', action='store_true', default=argparse.SUPPRESS, help="log debug messages")
+    common.add_argument('--profile', action='store_true', default=argparse.SUPPRESS, help="time the main operations")
+    common.add_argument('--profile-out', default=argparse.SUPPRESS, metavar='PATH', help="where --profile writes its summary")
+
+    detect = subparsers.add_parser('detect', parents=[common], help="detect waveforms and compute their features")
+    detect.add_argument('--threshold', type=float, default=None, help="detection threshold in uV, by default estimated per channel")
+    detect.add_argument('--threshold-k', type=float, default=4., help="noise multiple of the estimated threshold (default: 4)")
+    detect.add_argument('--cmr', action='store_true', help="subtract the median of the good channels")
+    detect.add_argument('--no-filter', action='store_true', help="detect on the unfiltered signal")
+    detect.add_argument('--chunk-size', type=int, default=int(1e7), help="samples processed at once (default: 1e7)")
+    detect.add_argument('--n-components', type=int, default=3, help="principal components saved as features (default: 3)")
+
+    assign = subparsers.add_parser('assign', parents=[common], help="assign unsorted spikes to the nearest unit template")
+    assign.add_argument('--threshold', type=float, default=2., help="largest distance to a template, in multiples of the unit's spread; negative assigns every spike (default: 2)")
+    assign.add_argument('--block-megabytes', type=float, default=64, help="memory used per block of waveforms (default: 64)")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile:
+        profiler.enable()
+    if args.command is None:
+        return run_gui(args)
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format='%(asctime)s %(levelname)s %(message)s'
+    )
+    logger = logging.getLogger('SpikeSorter')
+    if args.command == 'detect':
+        result = run_detect(args, logger)
+    elif args.command == 'assign':
+        result = run_assign(args, logger)
+    if args.profile:
+        profiler.export(args.profile_out, logger=logger)
+    return result
 
 if __name__ == '__main__':
-    app.use_app('pyqt5')
-    spikesort_app = SpikeSortApp.from_directory('data')
-    app.run()
+    sys.exit(main())
@@ -1,5 +1,6 @@
 from pathlib import Path
 import json 
+import re
 
 import numpy as np
 from vispy import scene
@@ -7,14 +8,26 @@ from vispy.scene.visuals import XYZAxis, Markers
 from vispy.scene.cameras import ArcballCamera
 
 import simianpy as simi
+from simiview.jobs import JobManager
 from simiview.spikesort.lasso import LassoSelector
+from simiview.spikesort.cluster_index import ClusterIndex
+from simiview.spikesort.journal import ClusterJournal
+from simiview.spikesort.persistence import ClusterWriteError, ClusterWriter, save_atomic
+from simiview.spikesort.scheduler import UpdateScheduler
+from simiview.spikesort.memory import MemoryBudget
+from simiview.spikesort.detection import compute_pca, n_channels
+from simiview.spikesort.template_matching import compute_templates, match_templates
 from simiview.util.linecollection import LineCollection
 from simiview.spikesort.ccg_view_manager import CCGViewManager
 from simiview.spikesort.single_channel_viewer import SingleChannelViewer
-from simiview.spikesort.unit_view_manager import UnitViewManager
+from simiview.spikesort.unit_view_manager import UnitViewManager, channel_layout
 from simiview.spikesort.pointcloud_view_manager import PointCloudManager
 from simiview.util import scale_time
 from simiview.spikesort.colours import COLOURS
+from simiview.util.profiling import profile
+
+# features of a single channel of a channel group are named e.g. "Peak Amplitude (ch 2)"
+CHANNEL_DIMENSION = re.compile(r'^(?P<name>.*) \(ch (?P<channel>\d+)\)$')
 
 class SpikeSortApp(scene.SceneCanvas):
     @simi.misc.add_logging
@@ -25,10 +38,15 @@ class SpikeSortApp(scene.SceneCanvas):
         scene.SceneCanvas.__init__(self, keys='interactive', size=(800, 600))
         self.unfreeze()
 
-        self.threads = {}
+        # Long operations (detection, PCA, median traces, CCGs) run as background jobs
+        self.jobs = JobManager(logger=self.logger)
 
         self.data_directory = None
         self.save_path = None
+        # the channel directory of the data currently loaded, which may lag
+        # save_path while a newly selected channel is still being prepared
+        self.loaded_path = None
+        self.channel_paths = {}
 
         # Initialize data-related attributes
         self.points = None
@@ -36,9 +54,28 @@ class SpikeSortApp(scene.SceneCanvas):
         self.timestamps = None
         self.timestamps_ms = None
         self.clusters = None
+        self.cluster_index = ClusterIndex()
+        self.journal = ClusterJournal(
+            max_bytes=int(self.settings.get('journal', {}).get('max_megabytes', 64) * 2**20)
+        )
+        persistence_settings = self.settings.get('persistence', {})
+        self.cluster_writer = ClusterWriter(
+            debounce=persistence_settings.get('debounce_seconds', 0.5),
+            append_log=persistence_settings.get('append_log', True),
+            compact_every=persistence_settings.get('compact_every', 50),
+            logger=self.logger
+        )
+        memory_settings = self.settings.get('memory', {})
+        budget = memory_settings.get('budget_megabytes')
+        self.memory = MemoryBudget(
+            max_bytes=None if budget is None else int(budget * 2**20),
+            map_fraction=memory_settings.get('map_fraction', 0.5),
+            logger=self.logger
+        )
         self.active_cluster = 0
         self.cluster_visible = {}
         self.active_point = None
+        self.colors = None
         self.state = None
 
         # Set up the main grid layout
@@ -63,7 +100,7 @@ class SpikeSortApp(scene.SceneCanvas):
 
         widget = grid.add_widget(row=5, col=0, col_span=3)
         view = widget.add_view()
-        self.continuous_viewer = SingleChannelViewer(view, self.load_data, logger=self.logger)
+        self.continuous_viewer = SingleChannelViewer(view, self.on_waveforms_detected, jobs=self.jobs, logger=self.logger)
         self.continuous_viewer.register_events(self)
 
         # Store home position of cameras
@@ -73,13 +110,48 @@ class SpikeSortApp(scene.SceneCanvas):
         # Initialize scatter plot and lines for waveforms
         self.lines = LineCollection()
         self.graph_view.add(self.lines)
+        # the hovered waveform, drawn on top, so hovering does not re-sort every line
+        self.active_lines = LineCollection()
+        self.active_lines.order = 1
+        self.active_lines.visible = False
+        self.graph_view.add(self.active_lines)
+        # the z-order the lines were last sorted by
+        self._lines_zorder = None
 
         # Lasso selector for selecting points in the scatter plot
         self.lasso = LassoSelector(self.pointcloud_view, callback=self.update_cluster, get_active_color=self.get_active_color)
         self.lasso.register_events(self)
 
+        self._track_memory()
+
+        # Visual updates are marked dirty and applied once per frame, in this order
+        self.scheduler = UpdateScheduler()
+        self.scheduler.add_frame_callback(self.jobs.poll)
+        self.scheduler.register(self._update_cluster_index, 'labels')
+        self.scheduler.register(self.pointcloud_view.update_points, 'dimensions')
+        self.scheduler.register(self.pointcloud_view.update_hover, 'hover')
+        self.scheduler.register(self.update_colors, 'labels', 'colours', 'active_point')
+        self.scheduler.register(self.pointcloud_view.update_colors, 'labels', 'colours', 'active_point', 'dimensions')
+        self.scheduler.register(self.ccg_manager.update_ccgs, 'labels')
+        self.scheduler.register(self.unit_manager.update_units_view, 'labels')
+        self.scheduler.register(self.memory.enforce, 'labels', 'dimensions')
+
         self.show()
     
+    def _track_memory(self):
+        """Account for the major arrays, their copies in the visuals, and the caches derived from them"""
+        self.memory.track('waveforms', lambda: self.waveforms)
+        self.memory.track('points', lambda: self.points)
+        self.memory.track('timestamps', lambda: (self.timestamps, self.timestamps_ms))
+        self.memory.track('clusters', lambda: self.clusters)
+        self.memory.track('colors', lambda: self.colors)
+        self.memory.track('cluster index', lambda: self.cluster_index.indices)
+        self.memory.track('undo journal', lambda: self.journal.nbytes)
+        self.memory.track('waveform lines', lambda: (self.lines.pos, self.lines.color), category='visual')
+        self.memory.track('pointcloud', lambda: (self.pointcloud_view.points, getattr(self.pointcloud_view.scatter, '_data', None)), category='visual')
+        self.memory.track_cache('cluster statistics', self.cluster_index.cached_values, self.cluster_index.invalidate)
+        self.memory.track_cache('median trace', lambda: self.continuous_viewer._median_trace, self.continuous_viewer.clear_median_trace)
+
     def get_active_color(self):
         if self.state is None or self.state == 'add':
             return COLOURS[self.active_cluster]
@@ -106,75 +178,148 @@ class SpikeSortApp(scene.SceneCanvas):
             raise ValueError("Parent directory not set")
         self.save_path = self.data_directory / name
         self.save_path.mkdir(parents=True, exist_ok=True)
+        self.channel_paths[self._channel_key(index)] = self.save_path
 
         if self.continuous_viewer.sig is not None:
             self.continuous_viewer.channel_idx = index
             self.continuous_viewer.update_plot()
 
         if (self.save_path / 'waveforms.npy').exists() and (self.save_path / 'timestamps.npy').exists():
-            waveforms = np.load(self.save_path / 'waveforms.npy')
+            # large channels are read from disk as needed, rather than loaded
+            waveforms = self.memory.load(self.save_path / 'waveforms.npy')
             timestamps = np.load(self.save_path / 'timestamps.npy')
-            if (self.save_path / 'clusters.npy').exists():
-                clusters = np.load(self.save_path / 'clusters.npy')
-            else:
-                clusters = None
+            clusters = self.cluster_writer.load(self.save_path)
             if (self.save_path / 'points.npy').exists():
                 points = np.load(self.save_path / 'points.npy')
             else:
                 points = None
             self.load_data(waveforms, timestamps, clusters=clusters, points=points, save_waveforms=False)
 
+    @staticmethod
+    def _channel_key(index):
+        return tuple(np.atleast_1d(index).tolist())
+
+    def on_waveforms_detected(self, waveforms, timestamps, channel_idx=None):
+        """Save newly detected waveforms to their channel, and show them if that channel is selected."""
+        if channel_idx is None:
+            save_path = self.save_path
+        else:
+            save_path = self.channel_paths.get(self._channel_key(channel_idx), self.save_path)
+        # labels and features from a previous detection no longer match the waveforms
+        try:
+            self.cluster_writer.flush()
+        except ClusterWriteError as error:
+            # the labels that failed to save belong to the old waveforms
+            self.logger.warning(f"{error}; replacing the channel's files regardless")
+        self.cluster_writer.discard(save_path)
+        for name in ['points.npy', 'clusters.npy', 'clusters.log']:
+            (save_path / name).unlink(missing_ok=True)
+        # the old waveforms may still be memory-mapped (by the view or a running job),
+        # so the file is replaced rather than truncated and rewritten
+        save_atomic(save_path / 'waveforms.npy', waveforms)
+        save_atomic(save_path / 'timestamps.npy', timestamps)
+        if self.memory.should_memory_map(waveforms.nbytes):
+            waveforms = np.load(save_path / 'waveforms.npy', mmap_mode='r')
+        if save_path == self.save_path:
+            self.load_data(waveforms, timestamps, save_waveforms=False)
+
+    @profile()
     def load_data(self, waveforms, timestamps, clusters=None, points=None, save_waveforms=True):
-        """Load data into the SpikeSortApp and update the visualizations."""
-        # self.save_path = self.data_directory / name
-        # self.save_path.mkdir(parents=True, exist_ok=True)
+        """Load data into the SpikeSortApp and update the visualizations.
+
+        If points are not provided, they are computed from the waveforms using PCA
+        in a background job, and the data is shown once it completes.
+        """
+        save_path = self.save_path
+        if save_waveforms:
+            save_atomic(save_path / 'waveforms.npy', waveforms)
+            save_atomic(save_path / 'timestamps.npy', timestamps)
 
         if points is None:
-            # If points are not provided, compute them from waveforms using PCA
-            from sklearn.decomposition import PCA
-            pca = PCA(n_components=3)
-            points = pca.fit_transform(waveforms)
-            np.save(self.save_path / 'points.npy', points)
+            def on_result(points):
+                np.save(save_path / 'points.npy', points)
+                # the user may have moved on to another channel in the meantime
+                if save_path == self.save_path:
+                    self._set_data(save_path, waveforms, timestamps, clusters, points)
+            self.jobs.submit(compute_pca, waveforms, name=f"PCA ({save_path.name})", on_result=on_result)
+        else:
+            self._set_data(save_path, waveforms, timestamps, clusters, points)
+
+    @profile()
+    def _set_data(self, save_path, waveforms, timestamps, clusters, points):
+        self.loaded_path = save_path
         self.points = points
         self.waveforms = waveforms
         self.timestamps = timestamps
-        if save_waveforms:
-            np.save(self.save_path / 'waveforms.npy', waveforms)
-            np.save(self.save_path / 'timestamps.npy', timestamps)
         self.timestamps_ms = scale_time(self.timestamps, 's', 'ms')
 
         if clusters is not None:
             self.clusters = clusters
         else:
             self.clusters = np.zeros(self.points.shape[0], dtype=np.int8)
-            np.save(self.save_path / 'clusters.npy', self.clusters)
+            self.cluster_writer.submit(self.loaded_path, self.clusters)
+        self.cluster_index.clear()
+        self.journal.clear()
 
-        # Update visual components
-        self.update_visuals()
-        self.update_colors()
+        # a channel group has features per channel
+        dimensions = self.get_dimensions()
+        if dimensions != self.pointcloud_view.dimensions:
+            self.pointcloud_view.set_dimensions(dimensions)
 
-        # Update the unit manager and CCG manager with new data
-        self.unit_manager.update_units_view()
-        self.ccg_manager.update_ccgs()
+        # Update visual components, without waiting for the next frame
+        self.update_visuals()
+        self.scheduler.mark('labels', 'dimensions')
+        self.scheduler.flush()
+        self.memory.log_breakdown()
     
+    @property
+    def n_channels(self):
+        """The number of channels of the loaded waveforms, more than one for a channel group"""
+        return 1 if self.waveforms is None else n_channels(self.waveforms)
+
+    def get_dimensions(self):
+        """The dimensions the pointcloud may show for the loaded data
+
+        For a channel group, the principal components and waveform features
+        are available for each channel.
+        """
+        if self.n_channels == 1:
+            return PointCloudManager.DIMENSIONS
+        n_components = self.points.shape[1] // self.n_channels
+        features = [dimension for dimension in PointCloudManager.DIMENSIONS if not dimension.startswith('PCA') and dimension != 'Timestamp']
+        return (
+            [f"PCA {component + 1} (ch {channel + 1})" for component in range(n_components) for channel in range(self.n_channels)]
+            + ['Timestamp']
+            + [f"{feature} (ch {channel + 1})" for feature in features for channel in range(self.n_channels)]
+        )
+
     def _get_var(self, dimension):
+        waveforms = self.waveforms
+        channel = None
+        match = CHANNEL_DIMENSION.match(dimension)
+        if match is not None:
+            dimension, channel = match['name'], int(match['channel']) - 1
+            waveforms = self.waveforms[:, channel]
         if dimension == 'Timestamp':
             return self.timestamps * 10 / self.timestamps.max()
         elif dimension.startswith('PCA'):
             idx = int(dimension.split(' ')[-1]) - 1
+            if channel is not None:
+                # the components of each channel are concatenated
+                idx += channel * (self.points.shape[1] // self.n_channels)
             return self.points[:, idx]
         elif dimension == 'Peak Amplitude':
-            return self.waveforms.max(axis=1)
+            return waveforms.max(axis=1)
         elif dimension == 'Peak Time':
-            return self.waveforms.argmax(axis=1)
+            return waveforms.argmax(axis=1)
         elif dimension == 'Valley Amplitude':
-            return self.waveforms.min(axis=1)
+            return waveforms.min(axis=1)
         elif dimension == 'Valley Time':
-            return self.waveforms.argmin(axis=1)
+            return waveforms.argmin(axis=1)
         elif dimension == 'Peak-to-Valley Amplitude':
-            return self.waveforms.max(axis=1) - self.waveforms.min(axis=1)
+            return waveforms.max(axis=1) - waveforms.min(axis=1)
         elif dimension == 'Peak-to-Valley Time':
-            return self.waveforms.argmax(axis=1) - self.waveforms.argmin(axis=1)
+            return waveforms.argmax(axis=1) - waveforms.argmin(axis=1)
         else:
             raise ValueError(f"Invalid dimension: {dimension}")
 
@@ -186,43 +331,109 @@ class SpikeSortApp(scene.SceneCanvas):
 
     def save_data(self):
         """Save the current data to the save path."""
-        np.save(self.save_path / 'waveforms.npy', self.waveforms)
-        np.save(self.save_path / 'timestamps.npy', self.timestamps)
-        np.save(self.save_path / 'clusters.npy', self.clusters)
-        np.save(self.save_path / 'points.npy', self.points)
+        # memory-mapped waveforms are read from this file, and already saved
+        if not isinstance(self.waveforms, np.memmap):
+            save_atomic(self.loaded_path / 'waveforms.npy', self.waveforms)
+        save_atomic(self.loaded_path / 'timestamps.npy', self.timestamps)
+        np.save(self.loaded_path / 'points.npy', self.points)
+        self.cluster_writer.submit(self.loaded_path, self.clusters)
+        self.cluster_writer.flush()
 
     def update_visuals(self):
         """Update the visuals with the current data."""
         if self.points is None or self.waveforms is None:
             return
 
-        # Update the scatter plot with new points
-        self.pointcloud_view.update_points()
-        # Update the waveform lines
-        self.lines.set_data(lines=self.waveforms)
+        # Update the waveform lines, with the channels of a channel group side by side
+        lines, x_offset, width = channel_layout(self.waveforms)
+        self.lines.set_data(lines=lines, x_offset=x_offset)
+        self._lines_zorder = None
         # Update camera views
         minval, maxval = self.waveforms.min(None), self.waveforms.max(None)
-        self.graph_view.camera.rect = (0, minval), (40, maxval - minval)
+        self.graph_view.camera.rect = (0, minval), (width, maxval - minval)
         self.graph_view.camera.set_default_state()
 
+    def edit_clusters(self, indices, values):
+        """Set the cluster of the given points, recording the edit for undo."""
+        edit = self.journal.apply(self.clusters, indices, values)
+        if edit is not None:
+            self._update_clusters(edit.changes())
+        return edit
+
+    def undo(self):
+        """Revert the last cluster edit."""
+        if self.clusters is None:
+            return
+        edit = self.journal.undo(self.clusters)
+        if edit is not None:
+            self._update_clusters(edit.changes(undo=True))
+
+    def redo(self):
+        """Reapply the last undone cluster edit."""
+        if self.clusters is None:
+            return
+        edit = self.journal.redo(self.clusters)
+        if edit is not None:
+            self._update_clusters(edit.changes())
+
     def invalidate_cluster(self, cluster):
         """Invalidate a cluster by setting all points to -1."""
-        self.clusters[self.clusters == cluster] = -1
-        self._update_clusters()
+        self.edit_clusters(self.clusters == cluster, -1)
     
     def delete_cluster(self, cluster):
         """Delete a cluster by setting all points to 0."""
-        self.clusters[self.clusters == cluster] = 0
-        self._update_clusters()
+        self.edit_clusters(self.clusters == cluster, 0)
     
     def merge_clusters(self, clusters, new_cluster_id):
-        self.clusters[np.isin(self.clusters, clusters)] = new_cluster_id
+        self.edit_clusters(np.isin(self.clusters, clusters), new_cluster_id)
 
-    def _update_clusters(self):
-        np.save(self.save_path / 'clusters.npy', self.clusters)
-        self.update_colors()
-        self.ccg_manager.update_ccgs()
-        self.unit_manager.update_units_view()
+    @profile()
+    def assign_unsorted(self):
+        """Assign unsorted spikes to the nearest mean waveform of the sorted units.
+
+        Matching runs as a background job over the memory-mapped waveforms on
+        disk, and the assignments are applied as a single edit, which can be undone.
+        """
+        if self.clusters is None:
+            return
+        # the templates are computed from the labels as currently shown
+        self.scheduler.flush()
+        cluster_ids, templates, spreads = compute_templates(self.waveforms, self.cluster_index)
+        if len(cluster_ids) == 0:
+            self.logger.info("No sorted units to match unsorted spikes against")
+            return
+        settings = self.settings.get('template_matching', {})
+        threshold = settings.get('threshold', 2.)
+        max_distance = None if threshold is None else threshold * spreads
+        save_path = self.loaded_path
+        candidates = np.flatnonzero(self.clusters == 0)
+
+        def run():
+            waveforms = np.load(save_path / 'waveforms.npy', mmap_mode='r')
+            return match_templates(
+                waveforms, templates, cluster_ids,
+                max_distance=max_distance,
+                candidates=candidates,
+                max_bytes=int(settings.get('block_megabytes', 64) * 2**20)
+            )
+
+        def on_result(result):
+            labels, _ = result
+            if save_path != self.loaded_path:
+                return
+            # spikes sorted by hand while the job was running are left alone
+            keep = (labels != 0) & (self.clusters[candidates] == 0)
+            self.logger.info(f"Assigned {keep.sum()} of {candidates.size} unsorted spikes")
+            self.edit_clusters(candidates[keep], labels[keep].astype(self.clusters.dtype))
+        self.jobs.submit(run, name=f"Template matching ({save_path.name})", on_result=on_result)
+
+    def _update_clusters(self, delta=None):
+        # saving happens on the writer thread; delta is the (indices, labels) of the edit, if known
+        self.cluster_writer.submit(self.loaded_path, self.clusters, delta)
+        self.scheduler.mark('labels')
+
+    def _update_cluster_index(self):
+        self.cluster_index.update(self.clusters, self.timestamps_ms)
 
     def set_cluster_visibility(self, cluster, visible):
         self.cluster_visible[cluster] = visible
@@ -230,18 +441,26 @@ class SpikeSortApp(scene.SceneCanvas):
 
     def update_cluster(self, indices):
         """Update clusters based on selected indices."""
-        if self.state == 'add':
-            self.clusters[indices] = self.active_cluster
-        elif self.state == 'remove':
-            self.clusters[indices] = 0
-        elif self.state == 'replace':
-            self.clusters[self.clusters == self.active_cluster] = 0
-            self.clusters[indices] = self.active_cluster
-        elif self.state == 'invalidate':
-            self.clusters[indices] = -1
+        state = self.state
         self.state = None # Reset state after updating clusters
-        self._update_clusters()
-
+        if state == 'add':
+            self.edit_clusters(indices, self.active_cluster)
+        elif state == 'remove':
+            self.edit_clusters(indices, 0)
+        elif state == 'replace':
+            # recorded as a single edit: the old members are cleared, then the selection is assigned
+            previous = np.flatnonzero(self.clusters == self.active_cluster)
+            self.edit_clusters(
+                np.concatenate([previous, indices]),
+                np.concatenate([
+                    np.zeros(previous.size, dtype=self.clusters.dtype),
+                    np.full(len(indices), self.active_cluster, dtype=self.clusters.dtype)
+                ])
+            )
+        elif state == 'invalidate':
+            self.edit_clusters(indices, -1)
+
+    @profile()
     def get_colors(self):
         colors = np.ones((self.points.shape[0], 4), dtype=np.float32)
         for cluster, color in COLOURS.items():
@@ -254,20 +473,40 @@ class SpikeSortApp(scene.SceneCanvas):
             colors[:, -1] = 1.
         return colors
 
+    @profile()
     def update_colors(self):
-        """Update colors of the scatter plot and lines based on clusters."""
+        """Update colors of the lines based on clusters.
+
+        The colors are kept in self.colors for the scatter plot, which is
+        updated by the pointcloud manager in the same frame. The lines are
+        only sorted again when their z-order changes, otherwise just their
+        colours are uploaded.
+        """
         if self.points is None:
             return
-        colors = self.get_colors()
+        self.colors = colors = self.get_colors()
         z_order = self.clusters.copy()
         if self.active_cluster != 0:
             z_order[self.clusters == self.active_cluster] = self.clusters.max() + 1
-        if self.active_point is not None:
-            # Set the active point to the very front
-            z_order[self.active_point] = 99
-        # Update the colors of scatter plot and lines
-        self.pointcloud_view.update_colors()
-        self.lines.set_data(color=colors, zorder=z_order)
+        # each channel of a waveform is a line
+        line_colors = np.repeat(colors, self.n_channels, axis=0)
+        z_order = np.repeat(z_order, self.n_channels)
+        if self._lines_zorder is not None and np.array_equal(z_order, self._lines_zorder):
+            self.lines.set_colors(color=line_colors)
+        else:
+            self.lines.set_data(color=line_colors, zorder=z_order)
+            self._lines_zorder = z_order
+        self.update_active_lines()
+
+    def update_active_lines(self):
+        """Draw the active point's waveform on top of the others"""
+        if self.active_point is None or self.waveforms is None:
+            self.active_lines.visible = False
+            return
+        lines, x_offset, _ = channel_layout(np.asarray(self.waveforms[[self.active_point]]))
+        color = np.repeat(self.colors[[self.active_point]], self.n_channels, axis=0)
+        self.active_lines.set_data(lines=lines, x_offset=x_offset, color=color)
+        self.active_lines.visible = True
 
     def reset_cameras(self):
         """Reset cameras to their default positions."""
@@ -278,6 +517,7 @@ class SpikeSortApp(scene.SceneCanvas):
         with open('settings.json', 'r') as file:
             settings = json.load(file)
         self.keybindings = settings.pop('keybindings', {})
+        self.settings = settings
 
     def on_key_press(self, event):
         """Handle key press events based on self.keybindings."""
@@ -314,10 +554,22 @@ class SpikeSortApp(scene.SceneCanvas):
                     self.lasso.active = True
                     self.active_cluster = self.clusters.max() + 1
                     self.state = 'add'
+                    self.scheduler.mark('colours')
                 elif binding['action'] == 'reset_cameras':
                     self.reset_cameras()
                 elif binding['action'] == 'set_cluster':
                     self.active_cluster = binding['cluster']
+                    self.scheduler.mark('colours')
+                elif binding['action'] == 'undo':
+                    self.undo()
+                elif binding['action'] == 'redo':
+                    self.redo()
+                elif binding['action'] == 'assign_unsorted':
+                    self.assign_unsorted()
+                elif binding['action'] == 'memory_report':
+                    self.memory.log_breakdown()
+                elif binding['action'] == 'cancel_jobs':
+                    self.jobs.cancel_all()
                 handled = True
                 break
 
@@ -326,12 +578,17 @@ class SpikeSortApp(scene.SceneCanvas):
         
     def set_active_point(self, point):
         """Set the active point for highlighting."""
+        if point == self.active_point:
+            return
         self.active_point = point
-        self.update_colors()
+        self.scheduler.mark('active_point')
 
     def close(self):
         """Clean up before closing the application."""
         self.lasso.unregister_events(self)
-        for thread in self.threads.values():
-            thread.stop()
-        super().close()
+        self.jobs.shutdown()
+        self.scheduler.stop()
+        try:
+            self.cluster_writer.close()
+        finally:
+            super().close()
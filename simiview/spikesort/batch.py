@@ -0,0 +1,185 @@
+"""Spike sorting steps that run without the GUI
+
+Each function processes one channel (or channel group) and writes the same files as the GUI,
+in the channel's directory of the session (see `recording.session_directory`),
+so their results can be opened and refined in the sorting window. They are
+module-level functions so they can run in worker processes.
+"""
+from pathlib import Path
+
+import numpy as np
+
+from simiview.jobs import JobManager
+from simiview.spikesort.cluster_index import ClusterIndex
+from simiview.spikesort.detection import filt, detect_waveforms, estimate_threshold, compute_pca
+from simiview.spikesort.persistence import CLUSTERS_FILE, CLUSTERS_LOG, save_atomic, load_clusters
+from simiview.spikesort.recording import Recording
+from simiview.spikesort.template_matching import compute_templates, match_templates
+
+def detect_channel(file_path, channel, **kwargs):
+    """Detect waveforms on a single channel, see `detect_group`"""
+    return detect_group(file_path, channel, [channel], **kwargs)
+
+def detect_group(file_path, name, channels, threshold=None, threshold_k=4., cmr=False, apply_filter=True,
+                 chunk_size=int(1e7), n_components=3):
+    """Detect waveforms on a channel group and compute their features
+
+    The channels of the group (e.g. a tetrode) are read together, share their
+    threshold crossings, and their waveforms are saved with shape
+    (n_spikes, n_channels, n_samples). A group of one channel is saved with
+    shape (n_spikes, n_samples). Any existing waveforms, features and labels
+    of the group are replaced.
+
+    Parameters
+    ----------
+    file_path : str or Path
+        The recording
+    name : str
+        The name of the group, and of its directory
+    channels : list[str]
+        The channel names of the group
+    threshold : float, optional
+        The detection threshold in uV. By default, it is estimated per channel from the first chunk
+    threshold_k : float, optional
+        Multiple of the noise level used to estimate the threshold, by default 4.
+    cmr : bool, optional
+        Subtract the median of the good channels, by default False
+    apply_filter : bool, optional
+        Apply the detection filter, by default True
+    chunk_size : int, optional
+        The number of samples processed at once, by default 1e7
+    n_components : int, optional
+        The number of principal components saved as features per channel, by default 3
+
+    Returns
+    -------
+    dict
+        A summary of the group's detection
+    """
+    recording = Recording(file_path)
+    channel_idx = recording.get_channel_indices(list(channels))
+    if cmr:
+        common_idx = recording.get_channel_indices(recording.good_channels())
+
+    def load_chunk(start, n_samples):
+        t_slice = recording.get_time_slice(start, n_samples)
+        # all channels of the group are read at once
+        chunk = recording.load(t_slice, channel_idx)
+        if chunk.shape[1] == 1:
+            chunk = chunk[:, 0]
+        if cmr:
+            median = np.median(recording.load(t_slice, common_idx), axis=1)
+            chunk = chunk - (median if chunk.ndim == 1 else median[:, np.newaxis])
+        if apply_filter:
+            chunk = filt(chunk)
+        return chunk
+
+    if threshold is None:
+        threshold = estimate_threshold(load_chunk(0, min(chunk_size, recording.n_samples)), threshold_k)
+    waveforms, timestamps = detect_waveforms(
+        load_chunk, recording.n_samples, threshold,
+        chunk_size=chunk_size, time_offset=recording.time_offset
+    )
+
+    directory = recording.directory / name
+    directory.mkdir(parents=True, exist_ok=True)
+    # labels and features from a previous detection no longer match the waveforms
+    for file_name in ['points.npy', CLUSTERS_FILE, CLUSTERS_LOG]:
+        (directory / file_name).unlink(missing_ok=True)
+    # the GUI may have the previous waveforms memory-mapped
+    save_atomic(directory / 'waveforms.npy', waveforms)
+    save_atomic(directory / 'timestamps.npy', timestamps)
+    if waveforms.shape[0] > n_components:
+        np.save(directory / 'points.npy', compute_pca(waveforms, n_components=n_components))
+    save_atomic(directory / CLUSTERS_FILE, np.zeros(waveforms.shape[0], dtype=np.int8))
+    return {'channel': name, 'threshold': np.asarray(threshold).tolist(), 'n_spikes': int(waveforms.shape[0])}
+
+def assign_channel(directory, threshold=2., max_bytes=64 * 2**20):
+    """Assign the unsorted spikes of a sorted channel to the nearest unit template
+
+    Parameters
+    ----------
+    directory : str or Path
+        The channel directory
+    threshold : float, optional
+        Spikes further than this multiple of a unit's spread from its template
+        are left unsorted, by default 2. If None, every spike is assigned
+    max_bytes : int, optional
+        Approximate memory used per block of waveforms, by default 64 MB
+
+    Returns
+    -------
+    dict
+        A summary of the assignment
+    """
+    directory = Path(directory)
+    summary = {'channel': directory.name, 'n_unsorted': 0, 'n_assigned': 0}
+    clusters = load_clusters(directory)
+    if clusters is None:
+        return summary
+    waveforms = np.load(directory / 'waveforms.npy', mmap_mode='r')
+    timestamps = np.load(directory / 'timestamps.npy')
+    cluster_index = ClusterIndex()
+    cluster_index.update(clusters, timestamps)
+    cluster_ids, templates, spreads = compute_templates(waveforms, cluster_index)
+    candidates = np.flatnonzero(clusters == 0)
+    summary['n_unsorted'] = int(candidates.size)
+    if len(cluster_ids) == 0 or candidates.size == 0:
+        return summary
+
+    labels, _ = match_templates(
+        waveforms, templates, cluster_ids,
+        max_distance=None if threshold is None else threshold * spreads,
+        candidates=candidates,
+        max_bytes=max_bytes
+    )
+    assigned = labels != 0
+    clusters[candidates[assigned]] = labels[assigned]
+    # the snapshot includes any logged edits, so the log is dropped once it is in place
+    save_atomic(directory / CLUSTERS_FILE, clusters)
+    (directory / CLUSTERS_LOG).unlink(missing_ok=True)
+    summary['n_assigned'] = int(assigned.sum())
+    return summary
+
+def run_channels(func, channel_args, n_jobs=None, logger=None, **kwargs):
+    """Run `func(*args, **kwargs)` for each channel in a pool of worker processes
+
+    Parameters
+    ----------
+    func : callable
+        A module-level function, e.g. `detect_channel` or `assign_channel`
+    channel_args : dict
+        The positional arguments of each call, by channel name
+    n_jobs : int, optional
+        The number of worker processes, by default the number of CPUs
+    logger : logging.Logger, optional
+
+    Returns
+    -------
+    results : dict
+        The return value of each successful call, by channel name
+    errors : dict
+        The exception of each failed call, by channel name
+    """
+    results, errors = {}, {}
+
+    def on_progress(job):
+        if logger is not None and job.status == 'running':
+            logger.debug("%s: %.0f%% %s", job.name, 100 * job.progress, job.message)
+
+    jobs = JobManager(max_processes=n_jobs, on_progress=on_progress, logger=logger)
+    try:
+        for channel, args in channel_args.items():
+            def on_result(result, channel=channel):
+                results[channel] = result
+                if logger is not None:
+                    logger.info(f"{channel}: {result}")
+            def on_error(error, channel=channel):
+                errors[channel] = error
+                if logger is not None:
+                    logger.error(f"{channel} failed: {error!r}")
+            jobs.submit(func, *args, name=channel, on_result=on_result, on_error=on_error, kind='process', **kwargs)
+        jobs.wait()
+    finally:
+        jobs.shutdown(cancel=True)
+    return results, errors
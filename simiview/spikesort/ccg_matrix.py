@@ -3,13 +3,16 @@ from itertools import combinations
 import numpy as np
 
 from simiview.util import scale_time
+from simiview.jobs import report_progress
+from simiview.util.profiling import profile
 
-def ccg_matrix(spike_times, unit_ids, bin_size=0.1, max_lag=20, input_units='ms', sampling_rate=None, unitids=None, normalize=True):
-    spike_times = spike_times.astype(np.float32)
-    if input_units != 'ms':
-        spike_times = scale_time(spike_times, input_units, 'ms', sampling_rate=sampling_rate)
-        # spike_times = spike_times.astype(np.int32)
+@profile()
+def ccg_matrix(spike_times, unit_ids, bin_size=0.1, max_lag=20, input_units='ms', sampling_rate=None, unitids=None, normalize=True, unit_spike_times=None):
+    """Compute auto and cross correlograms for all pairs of units
 
+    If `unit_spike_times` is provided, it should map each unit id to its sorted
+    spike times (e.g. from a `ClusterIndex`), and the full arrays are not re-masked.
+    """
     if unitids is not None:
         unique_neurons = unitids
     else:
@@ -17,7 +20,13 @@ def ccg_matrix(spike_times, unit_ids, bin_size=0.1, max_lag=20, input_units='ms'
 
     neuron_spike_times = {}
     for neuron in unique_neurons:
-        neuron_spike_times[neuron] = np.sort(spike_times[unit_ids == neuron])
+        if unit_spike_times is not None:
+            times = unit_spike_times[neuron].astype(np.float32)
+        else:
+            times = np.sort(spike_times[unit_ids == neuron]).astype(np.float32)
+        if input_units != 'ms':
+            times = scale_time(times, input_units, 'ms', sampling_rate=sampling_rate)
+        neuron_spike_times[neuron] = times
     # Bins for the histogram
     # bins = np.arange(-max_lag, max_lag + bin_size*2, bin_size) - bin_size / 2
     lags = np.arange(-max_lag, max_lag + bin_size, bin_size)
@@ -27,8 +36,7 @@ def ccg_matrix(spike_times, unit_ids, bin_size=0.1, max_lag=20, input_units='ms'
     corrs = {}
     # Compute crosscorrelograms
     for neuron in unique_neurons:
-        neuron_spike_times = spike_times[unit_ids == neuron]
-        diffs = np.subtract.outer(neuron_spike_times, neuron_spike_times)
+        diffs = np.subtract.outer(neuron_spike_times[neuron], neuron_spike_times[neuron])
         # diffs = diffs[np.triu_indices_from(diffs, k=1)]  # Remove zero-lag and duplicate pairs
         # acg = np.histogram(diffs, bins=bins)[0]
         acg = np.histogram(diffs, bins=nbins, range=(-max_lag, max_lag))[0]
@@ -36,10 +44,10 @@ def ccg_matrix(spike_times, unit_ids, bin_size=0.1, max_lag=20, input_units='ms'
         acg[n_lags] = 0
         corrs[neuron, neuron] = acg
 
-    for neuron_i, neuron_j in combinations(unique_neurons, 2):
-        neuron_i_spike_times = spike_times[unit_ids == neuron_i]
-        neuron_j_spike_times = spike_times[unit_ids == neuron_j]
-        diffs = np.subtract.outer(neuron_i_spike_times, neuron_j_spike_times)
+    n_pairs = len(unique_neurons) * (len(unique_neurons) - 1) // 2
+    for pair_idx, (neuron_i, neuron_j) in enumerate(combinations(unique_neurons, 2)):
+        report_progress(pair_idx / max(n_pairs, 1), "Computing crosscorrelograms")
+        diffs = np.subtract.outer(neuron_spike_times[neuron_i], neuron_spike_times[neuron_j])
         # corrs[(neuron_i, neuron_j)] = np.histogram(diffs, bins=bins)[0]
         corrs[(neuron_i, neuron_j)] = np.histogram(diffs, bins=nbins, range=(-max_lag, max_lag))[0]
     
@@ -1,20 +1,38 @@
 import numpy as np
-from vispy.scene.visuals import InfiniteLine
+from vispy.scene.visuals import Line
+from vispy.scene import PanZoomCamera
 
 from itertools import combinations
 
 from simiview.spikesort.colours import COLOURS
-from simiview.util.barplot import BarPlot
+from simiview.util.barplot import BarMesh
 from simiview.spikesort.ccg_matrix import ccg_matrix
+from simiview.util.profiling import profile
 
 
 class CCGViewManager:
+    """Draws the CCG matrix of all cluster pairs in a single view
+
+    Each pair (a, b) with a <= b occupies the cell in row a and column b of an
+    upper triangular matrix. All bars are drawn by one mesh and all guide lines
+    by one line visual, so adding clusters resizes their buffers rather than
+    creating widgets.
+    """
+    MAX_LAG = 10
+    BIN_SIZE = 0.2
+    CELL_GAP = 0.1
+
     def __init__(self, parent, widget):
         self.parent = parent
         self.widget = widget
-        self.ccg_views = {}
-        self.ccg_bars = {}
-        self.ccg_grid = self.widget.add_grid()
+        self.view = self.widget.add_view()
+        self.view.camera = PanZoomCamera()
+        self.view.bgcolor = 'black'
+        self.bars = BarMesh(parent=self.view.scene)
+        self.guides = Line(method='gl', connect='segments', parent=self.view.scene)
+        self.cells = {}
+        self._job = None
+        self._generation = 0
 
     @property
     def save_path(self):
@@ -28,61 +46,89 @@ class CCGViewManager:
     def clusters(self):
         return self.parent.clusters
 
-    def _add_ccg_view(self, a, b):
-        view = self.ccg_grid.add_view(row=a - 1, col=b - 1)
-        view.camera = 'panzoom'
-        view.camera.rect = (-10, 0, 20, 1)
-        view.border_color = 'red'
-        InfiniteLine(-1, color=(1., 1., 1., 1.), parent=view.scene)
-        InfiniteLine(1, color=(1., 1., 1., 1.), parent=view.scene)
-        self.ccg_views[(a, b)] = view
+    @property
+    def cluster_index(self):
+        return self.parent.cluster_index
+
+    @property
+    def cell_size(self):
+        return 2 * self.MAX_LAG * (1 + self.CELL_GAP), 1 + self.CELL_GAP
+
+    def _cell_offset(self, row, col, n_clusters):
+        """The (x, y) position of lag 0 at the bottom of a cell; row 0 is drawn at the top"""
+        width, height = self.cell_size
+        return (col + 0.5) * width, (n_clusters - 1 - row) * height
 
     def update_ccg_grid(self):
+        """Lay out one cell per cluster pair and draw the guide lines at +/- 1 ms"""
         unique_clusters = self.get_sorted_cluster_ids()
-        existing_views = list(self.ccg_views.keys())
-        for a, b in existing_views:
-            if a not in unique_clusters or b not in unique_clusters:
-                widget = self.ccg_views.pop((a, b))
-                try:
-                    self.ccg_grid.remove_widget(widget)
-                except Exception as e:
-                    print(e)
-        for a in unique_clusters:
-            if (a, a) not in self.ccg_views:
-                self._add_ccg_view(a, a)
-        for (a, b) in combinations(unique_clusters, 2):
-            if (a, b) not in self.ccg_views:
-                self._add_ccg_view(a, b)
+        n_clusters = len(unique_clusters)
+        position = {cluster: idx for idx, cluster in enumerate(unique_clusters)}
+        pairs = [(a, a) for a in unique_clusters] + list(combinations(unique_clusters, 2))
+        self.cells = {
+            (a, b): self._cell_offset(position[a], position[b], n_clusters)
+            for a, b in pairs
+        }
+        if n_clusters == 0:
+            self.guides.visible = False
+            return
+        self.guides.visible = True
 
+        offsets = np.array(list(self.cells.values()), dtype=np.float32)
+        # two vertical guides per cell, as segments
+        guide = np.array([[-1, 0], [-1, 1], [1, 0], [1, 1]], dtype=np.float32)
+        pos = (guide[np.newaxis] + offsets[:, np.newaxis]).reshape(-1, 2)
+        self.guides.set_data(pos=pos, color=(1., 1., 1., 1.), connect='segments')
+
+        width, height = self.cell_size
+        self.view.camera.rect = (0, 0), (n_clusters * width, n_clusters * height)
+
+    @profile()
     def update_ccgs(self):
+        """Recompute the CCGs in a background job, and draw them when it completes."""
         self.update_ccg_grid()
-        if len(self.get_sorted_cluster_ids()) == 0:
+        # results of an older computation are dropped, as the clusters have changed since
+        self._generation += 1
+        if self._job is not None and not self._job.done:
+            self._job.cancel()
+        unique_clusters = self.get_sorted_cluster_ids()
+        if len(unique_clusters) == 0:
+            self.bars.visible = False
             return
-        lags, ccg = self._compute_ccgs()
-        for (a, b), pair_ccg in ccg.items():
-            if (a, b) not in self.ccg_bars:
-                self.ccg_bars[a, b] = BarPlot(lags, pair_ccg, color=COLOURS[a], parent=self.ccg_views[a, b].scene)
-            else:
-                self.ccg_bars[a, b].set_data(x=lags, y=pair_ccg, color=COLOURS[a])
-        for view in self.ccg_views.values():
-            view.bgcolor = 'black'
+        generation = self._generation
+        def on_result(result):
+            if generation == self._generation:
+                self._set_ccgs(*result)
+        unit_spike_times = {cluster: self.cluster_index.times(cluster) for cluster in unique_clusters}
+        self._job = self.parent.jobs.submit(
+            self._compute_ccgs, unique_clusters, unit_spike_times,
+            name='CCG', on_result=on_result
+        )
+
+    @profile()
+    def _set_ccgs(self, lags, ccg):
+        pairs = [pair for pair in self.cells if pair in ccg]
+        heights = np.stack([ccg[pair] for pair in pairs])
+        offsets = np.array([self.cells[pair] for pair in pairs])
+        colors = np.ones((len(pairs), 4), dtype=np.float32)
+        colors[:, :3] = [COLOURS[a] for a, _ in pairs]
+        edges = np.linspace(-self.MAX_LAG, self.MAX_LAG, heights.shape[1] + 1)
+        self.bars.set_data(edges, heights, offsets, colors)
 
     def get_sorted_cluster_ids(self):
-        unique_clusters = np.unique(self.clusters)
-        unique_clusters = unique_clusters[unique_clusters > 0]
-        unique_clusters = unique_clusters.tolist()
-        return unique_clusters
+        return self.cluster_index.get_sorted_cluster_ids()
 
-    def _compute_ccgs(self):
-        unique_clusters = self.get_sorted_cluster_ids()
+    @profile()
+    def _compute_ccgs(self, unique_clusters, unit_spike_times):
+        # runs as a job, so it must only use the spike times it is given, not the live labels
         lags, ccg = ccg_matrix(
-            self.timestamps_ms,
-            self.clusters,
-            bin_size=0.2,
-            max_lag=10,
-            unitids=unique_clusters
+            None,
+            None,
+            bin_size=self.BIN_SIZE,
+            max_lag=self.MAX_LAG,
+            unitids=unique_clusters,
+            unit_spike_times=unit_spike_times
         )
         # np.save(self.save_path / 'lags.npy', lags)
         # np.save(self.save_path / 'ccg.npy', ccg)
         return lags, ccg
-
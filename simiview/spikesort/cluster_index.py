@@ -0,0 +1,101 @@
+import hashlib
+
+import numpy as np
+
+class ClusterIndex:
+    """Per-cluster spike indices sorted by timestamp
+
+    The label array is grouped once per edit so that per-cluster computations
+    (ISIs, CCGs, mean waveforms, ...) can index their spikes directly rather
+    than re-masking the full label array. Derived values are cached by a
+    fingerprint of each cluster's membership, so clusters untouched by an edit
+    are not recomputed.
+    """
+    def __init__(self):
+        self.indices = {}
+        self.fingerprints = {}
+        self._time_order = None
+        self._timestamps = None
+        self._cache = {}
+
+    def clear(self):
+        self.indices = {}
+        self.fingerprints = {}
+        self._time_order = None
+        self._timestamps = None
+        self._cache = {}
+
+    def update(self, clusters, timestamps):
+        """Regroup spikes by cluster
+
+        Parameters
+        ----------
+        clusters : np.ndarray
+            Cluster label for each spike
+        timestamps : np.ndarray
+            Timestamp for each spike, used to order spikes within a cluster
+        """
+        if timestamps is not self._timestamps:
+            # timestamps do not change between edits, so the time ordering is computed once per load
+            self._timestamps = timestamps
+            self._time_order = np.argsort(timestamps, kind='stable')
+            self._cache = {}
+        order = self._time_order[np.argsort(clusters[self._time_order], kind='stable')]
+        unique_clusters, counts = np.unique(clusters, return_counts=True)
+        bounds = np.concatenate([[0], np.cumsum(counts)])
+
+        self.indices = {}
+        self.fingerprints = {}
+        for cluster, start, stop in zip(unique_clusters.tolist(), bounds[:-1], bounds[1:]):
+            idx = order[start:stop]
+            self.indices[cluster] = idx
+            self.fingerprints[cluster] = hashlib.blake2b(idx.tobytes(), digest_size=16).digest()
+
+        # drop cached values for clusters that no longer exist
+        for cache in self._cache.values():
+            for cluster in list(cache):
+                if cluster not in self.indices:
+                    cache.pop(cluster)
+
+    @property
+    def cluster_ids(self):
+        return list(self.indices.keys())
+
+    def get_sorted_cluster_ids(self):
+        """Cluster ids of sorted units, excluding unsorted (0) and invalid (-1) spikes"""
+        return [cluster for cluster in self.indices if cluster > 0]
+
+    def times(self, cluster):
+        """Sorted timestamps of the spikes in a cluster"""
+        return self.cached('times', cluster, lambda idx: self._timestamps[idx])
+
+    def cached(self, name, cluster, func):
+        """Compute a per-cluster value, reusing the cached value if membership is unchanged
+
+        Parameters
+        ----------
+        name : str
+            Name of the cached quantity
+        cluster : int
+            The cluster id
+        func : callable
+            Called with the cluster's sorted spike indices if the value must be recomputed
+        """
+        cache = self._cache.setdefault(name, {})
+        fingerprint = self.fingerprints[cluster]
+        if cluster in cache and cache[cluster][0] == fingerprint:
+            return cache[cluster][1]
+        value = func(self.indices[cluster])
+        cache[cluster] = (fingerprint, value)
+        return value
+
+    def cached_values(self):
+        """All cached values, e.g. to account for their memory"""
+        return [value for cache in self._cache.values() for _, value in cache.values()]
+
+    def invalidate(self, name=None):
+        """Drop cached values, either all of them or a single named quantity"""
+        if name is None:
+            self._cache = {}
+        else:
+            self._cache.pop(name, None)
@@ -0,0 +1,160 @@
+from functools import lru_cache
+
+import numpy as np
+
+from simiview.jobs import report_progress
+from simiview.util.profiling import profile, profiler
+
+WAVEFORM_WINDOW = (-8, 32)
+
+@lru_cache(maxsize=None)
+def get_filter():
+    """The detection filter: 50 and 100 Hz notches and a 300-3000 Hz bandpass
+
+    The filter is designed on first use, so importing this module stays cheap.
+    """
+    from simianpy.signal import sosFilter
+    return (
+        sosFilter('bandstop', 6, [49.9, 50.1], 30000)
+        + sosFilter('bandstop', 6, [99.9, 100.1], 30000)
+        + sosFilter('bandpass', 6, [300, 3000], 30000)
+    )
+
+@profile()
+def filt(data):
+    """Apply the detection filter to a signal, or to each channel of a (n_samples, n_channels) signal"""
+    if np.ndim(data) == 2:
+        sos_filter = get_filter()
+        return np.column_stack([sos_filter(channel) for channel in data.T])
+    return get_filter()(data)
+
+def estimate_threshold(chunk, k=4.):
+    """A negative detection threshold of `k` times the noise level of a preprocessed signal
+
+    The noise level is estimated as median(|x|) / 0.6745, which is robust to the spikes themselves.
+    For a (n_samples, n_channels) signal, there is one threshold per channel.
+    """
+    return -k * np.median(np.abs(chunk), axis=0) / 0.6745
+
+def n_channels(waveforms):
+    """The number of channels of waveforms of shape (n_spikes, n_samples) or (n_spikes, n_channels, n_samples)"""
+    return 1 if waveforms.ndim == 2 else waveforms.shape[1]
+
+def concatenate_channels(waveforms):
+    """Waveforms of shape (n_spikes, n_channels * n_samples), with the channels one after the other"""
+    return waveforms.reshape(waveforms.shape[0], -1)
+
+@profile()
+def extract_waveforms(chunk, threshold, window=WAVEFORM_WINDOW, min_separation=2):
+    """Find threshold crossings in a chunk and extract the waveform around each
+
+    For a channel group (e.g. a tetrode), the channels share their crossings:
+    a spike is detected when any channel crosses its threshold, and the
+    waveforms of every channel are extracted around it.
+
+    Parameters
+    ----------
+    chunk : np.ndarray
+        The preprocessed signal, of shape (n_samples,) or (n_samples, n_channels)
+    threshold : float or np.ndarray
+        Crossings are samples below this value, either overall or per channel
+    window : tuple[int, int], optional
+        Samples before and after the crossing to extract, by default (-8, 32)
+    min_separation : int, optional
+        Crossings must be more than this many samples after the previous one, by default 2
+
+    Returns
+    -------
+    waveforms : np.ndarray
+        Array of shape (n_crossings, window[1] - window[0]), or
+        (n_crossings, n_channels, window[1] - window[0]) for a channel group
+    crossings : np.ndarray
+        Sample index of each crossing within the chunk
+    """
+    pre, post = window
+    width = post - pre
+    # find the indices where the threshold is crossed, on any channel
+    if chunk.ndim == 2:
+        # one channel at a time, which is much faster than (chunk < threshold).any(axis=1)
+        threshold = np.broadcast_to(threshold, chunk.shape[1])
+        below = chunk[:, 0] < threshold[0]
+        for channel in range(1, chunk.shape[1]):
+            below |= chunk[:, channel] < threshold[channel]
+    else:
+        below = chunk < threshold
+    crossings = np.flatnonzero(below)
+    #remove crossings that are too close to each other
+    crossings = crossings[np.diff(crossings, prepend=-width) > min_separation]
+    # drop crossings whose window extends past the chunk
+    crossings = crossings[(crossings + pre >= 0) & (crossings + post <= chunk.shape[0])]
+    # get indexes of the waveforms
+    idx = np.repeat(crossings + pre, width) + np.tile(np.arange(width), crossings.size)
+    if chunk.ndim == 2:
+        # (n_crossings * width, n_channels) -> (n_crossings, n_channels, width)
+        waveforms = chunk[idx].reshape(-1, width, chunk.shape[1]).transpose(0, 2, 1)
+        return np.ascontiguousarray(waveforms), crossings
+    waveforms = chunk[idx].reshape(-1, width)
+    return waveforms, crossings
+
+@profile()
+def detect_waveforms(load_chunk, n_samples, threshold, chunk_size=int(1e7), time_offset=0, logger=None):
+    """Detect waveforms over a whole recording, one chunk at a time
+
+    Reports progress and honours cancellation when run as a job.
+
+    Parameters
+    ----------
+    load_chunk : callable
+        load_chunk(start, n_samples) returns the preprocessed signal for that range of samples,
+        of shape (n_samples,) or, for a channel group, (n_samples, n_channels) read at once
+    n_samples : int
+        The total number of samples
+    threshold : float or np.ndarray
+        The detection threshold, either overall or per channel
+    chunk_size : int, optional
+        The number of samples processed at once, by default 1e7
+    time_offset : float, optional
+        Added to the sample index of each crossing to produce its timestamp, by default 0
+    logger : logging.Logger, optional
+
+    Returns
+    -------
+    waveforms : np.ndarray
+        Array of shape (n_spikes, n_samples), or (n_spikes, n_channels, n_samples) for a channel group
+    timestamps : np.ndarray
+    """
+    all_waveforms = []
+    all_timestamps = []
+    if logger is not None:
+        logger.info("Detecting waveforms with threshold %s", threshold)
+    for i in range(0, n_samples, chunk_size):
+        report_progress(i / n_samples, f"Detecting waveforms, sample {i} of {n_samples}")
+        with profiler.span('detect_waveforms.chunk'):
+            chunk = load_chunk(i, chunk_size)
+            waveforms, crossings = extract_waveforms(chunk, threshold)
+        if logger is not None:
+            logger.info("Extracted %s waveforms from chunk %s", waveforms.shape[0], i)
+        all_waveforms.append(waveforms)
+        all_timestamps.append(crossings + i + time_offset)
+
+    if logger is not None:
+        logger.info("Finished detecting waveforms, concatenating")
+    return np.concatenate(all_waveforms, axis=0), np.concatenate(all_timestamps)
+
+@profile()
+def compute_pca(waveforms, n_components=3):
+    """Project waveforms onto their first principal components
+
+    For a channel group, the components of each channel are computed
+    separately and concatenated, giving features of shape
+    (n_spikes, n_channels * n_components) ordered by channel.
+    """
+    from sklearn.decomposition import PCA
+    if waveforms.ndim == 2:
+        report_progress(0., "Computing PCA")
+        return PCA(n_components=n_components).fit_transform(waveforms)
+    features = []
+    for channel in range(waveforms.shape[1]):
+        report_progress(channel / waveforms.shape[1], f"Computing PCA, channel {channel + 1} of {waveforms.shape[1]}")
+        features.append(PCA(n_components=n_components).fit_transform(waveforms[:, channel]))
+    return np.concatenate(features, axis=1)
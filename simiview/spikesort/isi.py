@@ -0,0 +1,79 @@
+import numpy as np
+
+def log_bins(min_isi=0.5, max_isi=1000, n_bins=50):
+    """Log-spaced ISI bin edges in ms"""
+    return np.logspace(np.log10(min_isi), np.log10(max_isi), n_bins + 1)
+
+def isi_histogram(spike_times, min_isi=0.5, max_isi=1000, n_bins=50):
+    """Histogram of inter-spike intervals with log-spaced bins
+
+    Parameters
+    ----------
+    spike_times : np.ndarray
+        Sorted spike times in ms
+    min_isi : float, optional
+        The lower edge of the first bin in ms, by default 0.5
+    max_isi : float, optional
+        The upper edge of the last bin in ms, by default 1000
+    n_bins : int, optional
+        The number of bins, by default 50
+
+    Returns
+    -------
+    edges : np.ndarray
+        Bin edges of shape (n_bins + 1,)
+    counts : np.ndarray
+        Number of intervals in each bin
+    """
+    isi = np.diff(spike_times)
+    isi = isi[(isi >= min_isi) & (isi < max_isi)]
+    # bins are uniform in log space, so the bin index is computed directly
+    # and counted with bincount rather than searched for with np.histogram
+    edges = log_bins(min_isi, max_isi, n_bins)
+    log_min, log_max = np.log10(min_isi), np.log10(max_isi)
+    bin_idx = ((np.log10(isi) - log_min) * (n_bins / (log_max - log_min))).astype(np.intp)
+    np.clip(bin_idx, 0, n_bins - 1, out=bin_idx)
+    # rounding can put an interval at an edge one bin off, so it is moved to the bin of the edges returned
+    bin_idx -= isi < edges[bin_idx]
+    bin_idx += isi >= edges[bin_idx + 1]
+    np.clip(bin_idx, 0, n_bins - 1, out=bin_idx)
+    counts = np.bincount(bin_idx, minlength=n_bins)
+    return edges, counts
+
+def isi_step_vertices(counts, offsets, width=1., pad=0.05):
+    """Step outline vertices for many ISI histograms laid out side by side
+
+    Parameters
+    ----------
+    counts : np.ndarray
+        Histogram counts of shape (n_histograms, n_bins)
+    offsets : np.ndarray
+        The x offset of each histogram's cell, of shape (n_histograms,)
+    width : float, optional
+        The width of each cell, by default 1.
+    pad : float, optional
+        Fraction of the cell width left empty at either side, by default 0.05
+
+    Returns
+    -------
+    pos : np.ndarray
+        Vertex positions of shape (n_histograms * 2 * n_bins, 2)
+    connect : np.ndarray
+        Segment indices of shape (n_segments, 2), connecting vertices only within a histogram
+    """
+    counts = np.atleast_2d(counts)
+    n_hist, n_bins = counts.shape
+    peak = counts.max(axis=1, keepdims=True)
+    y = counts / np.maximum(peak, 1)
+    # log-spaced bins are drawn evenly spaced, i.e. on a log axis
+    edges = np.linspace(pad, 1 - pad, n_bins + 1) * width
+    x = np.repeat(edges, 2)[1:-1]
+    x = x[np.newaxis, :] + np.asarray(offsets, dtype=float)[:, np.newaxis]
+    y = np.repeat(y, 2, axis=1)
+    pos = np.stack([x, y], axis=-1).reshape(-1, 2)
+
+    n_verts = 2 * n_bins
+    a = np.arange(n_verts - 1)
+    connect = np.stack([a, a + 1], axis=-1)
+    connect = connect[np.newaxis] + (np.arange(n_hist) * n_verts)[:, np.newaxis, np.newaxis]
+    return pos, connect.reshape(-1, 2)
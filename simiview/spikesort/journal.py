@@ -0,0 +1,193 @@
+from collections import deque
+
+import numpy as np
+
+def _index_dtype(max_value):
+    return np.uint32 if max_value < 2**32 else np.uint64
+
+def encode_indices(indices):
+    """Encode sorted, unique indices in the most compact of three forms
+
+    - 'array': the indices themselves
+    - 'runs': start and length of each run of consecutive indices
+    - 'bitmap': a packed bitmap over the span of the indices
+
+    Returns
+    -------
+    tuple
+        The encoding name followed by its payload
+    """
+    n = indices.size
+    if n == 0:
+        return ('array', indices.astype(np.uint32))
+    lo, hi = int(indices[0]), int(indices[-1])
+    dtype = _index_dtype(hi)
+    itemsize = np.dtype(dtype).itemsize
+
+    breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+    n_runs = breaks.size + 1
+    sizes = {
+        'array': n * itemsize,
+        'runs': 2 * n_runs * itemsize,
+        'bitmap': (hi - lo + 1 + 7) // 8,
+    }
+    encoding = min(sizes, key=sizes.get)
+    if encoding == 'array':
+        return ('array', indices.astype(dtype))
+    elif encoding == 'runs':
+        starts = indices[np.concatenate([[0], breaks])]
+        lengths = np.diff(np.concatenate([[0], breaks, [n]]))
+        return ('runs', starts.astype(dtype), lengths.astype(dtype))
+    else:
+        bitmap = np.zeros(hi - lo + 1, dtype=bool)
+        bitmap[indices - lo] = True
+        return ('bitmap', lo, hi - lo + 1, np.packbits(bitmap))
+
+def decode_indices(encoded):
+    encoding = encoded[0]
+    if encoding == 'array':
+        return encoded[1].astype(np.intp)
+    elif encoding == 'runs':
+        _, starts, lengths = encoded
+        starts, lengths = starts.astype(np.intp), lengths.astype(np.intp)
+        # expand runs without a python loop: offset each element by its run's start
+        run_offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        return np.arange(lengths.sum()) + run_offsets
+    elif encoding == 'bitmap':
+        _, lo, span, bitmap = encoded
+        return np.flatnonzero(np.unpackbits(bitmap, count=span)) + lo
+    raise ValueError(f"Unknown index encoding: {encoding}")
+
+def encode_labels(labels):
+    """Run-length encode labels if this is smaller than storing them directly"""
+    if labels.size == 0:
+        return ('array', labels)
+    breaks = np.flatnonzero(np.diff(labels) != 0) + 1
+    if (breaks.size + 1) * (labels.itemsize + 4) < labels.nbytes:
+        values = labels[np.concatenate([[0], breaks])]
+        lengths = np.diff(np.concatenate([[0], breaks, [labels.size]])).astype(np.uint32)
+        return ('runs', values, lengths)
+    return ('array', labels)
+
+def decode_labels(encoded):
+    if encoded[0] == 'array':
+        return encoded[1]
+    elif encoded[0] == 'runs':
+        _, values, lengths = encoded
+        return np.repeat(values, lengths)
+    raise ValueError(f"Unknown label encoding: {encoded[0]}")
+
+def _nbytes(encoded):
+    return sum(item.nbytes for item in encoded if isinstance(item, np.ndarray))
+
+class ClusterEdit:
+    """A single edit of the cluster labels, stored as a compact delta"""
+    def __init__(self, indices, before, after):
+        self.indices = encode_indices(indices)
+        self.before = encode_labels(before)
+        self.after = encode_labels(after)
+        self.n_changed = indices.size
+
+    @property
+    def nbytes(self):
+        return _nbytes(self.indices) + _nbytes(self.before) + _nbytes(self.after)
+
+    def changes(self, undo=False):
+        """The (indices, labels) assigned when this edit is redone, or undone if `undo`"""
+        return decode_indices(self.indices), decode_labels(self.before if undo else self.after)
+
+    def undo(self, clusters):
+        clusters[decode_indices(self.indices)] = decode_labels(self.before)
+
+    def redo(self, clusters):
+        clusters[decode_indices(self.indices)] = decode_labels(self.after)
+
+class ClusterJournal:
+    """Undo/redo history of edits to a cluster label array
+
+    Only the labels that change are stored, so the cost of an edit is
+    proportional to the number of spikes it touches rather than the size of
+    the label array. The oldest edits are dropped once the undo and redo
+    history together exceed `max_bytes`.
+    """
+    def __init__(self, max_bytes=64 * 2**20):
+        self.max_bytes = max_bytes
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.nbytes = 0
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack = []
+        self.nbytes = 0
+
+    @property
+    def can_undo(self):
+        return len(self.undo_stack) > 0
+
+    @property
+    def can_redo(self):
+        return len(self.redo_stack) > 0
+
+    def apply(self, clusters, indices, values):
+        """Set clusters[indices] = values in place and record the edit
+
+        Parameters
+        ----------
+        clusters : np.ndarray
+            The label array to edit
+        indices : np.ndarray
+            Indices or a boolean mask of the spikes to edit. If an index is
+            repeated, the last value assigned to it is kept
+        values : int | np.ndarray
+            The new label, either a scalar or one per index
+
+        Returns
+        -------
+        ClusterEdit | None
+            The recorded edit, or None if no label changed
+        """
+        indices = np.asarray(indices)
+        if indices.dtype == bool:
+            indices = np.flatnonzero(indices)
+        else:
+            indices = indices.astype(np.intp, copy=False)
+        values = np.broadcast_to(np.asarray(values, dtype=clusters.dtype), indices.shape)
+        # sort and deduplicate, keeping the last assignment to each index
+        indices, last = np.unique(indices[::-1], return_index=True)
+        after = values[::-1][last]
+
+        before = clusters[indices]
+        changed = before != after
+        if not changed.any():
+            return None
+        indices, before, after = indices[changed], before[changed], after[changed]
+        clusters[indices] = after
+
+        self.nbytes -= sum(redo_edit.nbytes for redo_edit in self.redo_stack)
+        self.redo_stack = []
+        edit = ClusterEdit(indices, before, after)
+        self.undo_stack.append(edit)
+        self.nbytes += edit.nbytes
+        # drop the oldest edits, but always keep the latest so it can be undone
+        while self.nbytes > self.max_bytes and len(self.undo_stack) > 1:
+            self.nbytes -= self.undo_stack.popleft().nbytes
+        return edit
+
+    def undo(self, clusters):
+        """Revert the most recent edit, returning it or None if there is nothing to undo"""
+        if not self.undo_stack:
+            return None
+        edit = self.undo_stack.pop()
+        edit.undo(clusters)
+        self.redo_stack.append(edit)
+        return edit
+
+    def redo(self, clusters):
+        """Reapply the most recently undone edit, returning it or None if there is nothing to redo"""
+        if not self.redo_stack:
+            return None
+        edit = self.redo_stack.pop()
+        edit.redo(clusters)
+        self.undo_stack.append(edit)
+        return edit
@@ -2,6 +2,7 @@ import numpy as np
 from vispy.scene.visuals import Line
 
 from simiview.spikesort.points_in_poly import points_in_polygon
+from simiview.util.profiling import profile
 class LassoSelector:
     MIN_MOVE_UPDATE_THRESHOLD = 5
     def __init__(self, scatter_manager, callback=None, get_active_color=None):
@@ -71,6 +72,7 @@ class LassoSelector:
             trail = self._get_lasso_poly(trail, closed)
             self.lasso_visual.set_data(trail, color=self.get_active_color(), width=2)
 
+    @profile()
     def select_points(self, poly):
         if poly.shape[0] < 3:
             return
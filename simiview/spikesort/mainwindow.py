@@ -1,6 +1,3 @@
-from pathlib import Path
-import warnings
-
 from PyQt5.QtWidgets import (
     QMainWindow, QApplication, QVBoxLayout, QHBoxLayout,
     QWidget, QAction, QFileDialog, QTableView, QHeaderView,
@@ -10,12 +7,11 @@ from PyQt5.QtWidgets import (
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QColor
 
-from neo.io import SpikeGadgetsIO, Plexon2IO
-import quantities as pq
 import numpy as np
 
 import simianpy as simi
 from simiview.spikesort.app import SpikeSortApp
+from simiview.spikesort.recording import Recording
 from simiview.spikesort.single_channel_viewer import SingleChannelViewer
 
 class MainWindow(QMainWindow):
@@ -72,7 +68,9 @@ class MainWindow(QMainWindow):
 
         # Initial VisPy app setup
         self.spike_sort_app = SpikeSortApp(logger=self.logger)
+        self.spike_sort_app.jobs.on_progress = self.show_job_progress
         # self.continuous_viewer = SingleChannelViewer()
+        self.recording = None
         self.current_file = None
         self.current_data = None
         self.data_path = None
@@ -87,35 +85,25 @@ class MainWindow(QMainWindow):
             "Open Data File", "", 
             "Spike Gadgets Rec File (*.rec);;Plexon Files (*.pl2);;All Files (*)", 
             options=options)
-        ftype_handlers = {
-            "Spike Gadgets Rec File (*.rec)": SpikeGadgetsIO,
-            "Plexon Files (*.pl2)": Plexon2IO
-        }
         if file_name:
-            if file_ext in ftype_handlers:
-                self.current_file = ftype_handlers[file_ext](file_name)
-            else:
-                raise ValueError(f"Unsupported file type: {file_ext}")
-            # self.current_file = SpikeGadgetsIO(file_name)
-            self.signal_data = self.current_file.read_block(lazy=True).segments[0].analogsignals[0]
-            self.data_path = Path(file_name).with_suffix('.simiview') / 'spikesort'
-
-            if file_ext == "Plexon Files (*.pl2)":
-                channels = [channel for channel in self.current_file.header['signal_channels']['name'] if 'WB' in channel]
-                warnings.warn("Plexon files are not fully supported. Do not use common median rejection.")
-            else:
-                channels = self.current_file.header['signal_channels']['name']
+            self.recording = Recording(file_name)
+            self.current_file = self.recording.reader
+            self.signal_data = self.recording.signal
+            self.data_path = self.recording.directory
+            channels = self.recording.channels
 
             self.spike_sort_app.load_session(self.data_path, self.signal_data, self.get_channel_indices(channels))
-            if (self.data_path / 'bad_channels.txt').exists():
-                with open(self.data_path / 'bad_channels.txt') as f:
-                    bad_channels = f.read().splitlines()
-            else:
-                bad_channels = None
+            bad_channels = self.recording.read_bad_channels()
             self.populate_table(channels, bad_channels=bad_channels)
 
+    @property
+    def channel_groups(self):
+        """Channel groups (e.g. tetrodes) sorted together, by name, from the settings"""
+        return self.spike_sort_app.settings.get('channel_groups', {})
+
     def populate_table(self, channels, bad_channels=None):
-        self.table.setRowCount(len(channels))
+        groups = {name: group for name, group in self.channel_groups.items() if set(group) <= set(channels)}
+        self.table.setRowCount(len(channels) + len(groups))
         self.channels = set(channels)
         if bad_channels is None:
             self.bad_channels = set()  # Track bad channels
@@ -135,13 +123,21 @@ class MainWindow(QMainWindow):
             check_box.clicked.connect(self.bad_channel_handler(channel))
             self.table.setCellWidget(i, 1, check_box)
 
+        # channel groups follow the channels, and are sorted as one
+        for i, name in enumerate(groups, start=len(channels)):
+            item = QTableWidgetItem(name)
+            item.setToolTip(', '.join(groups[name]))
+            self.table.setItem(i, 0, item)
+
     def select_channel(self):
         selected_items = self.table.selectedItems()
         if not selected_items or self.current_file is None:
             return
 
         selected_channel = selected_items[0].text()
-        selected_channel_index = self.get_channel_indices([selected_channel])
+        # a group is detected and sorted on all of its channels together
+        channels = self.channel_groups.get(selected_channel, [selected_channel])
+        selected_channel_index = self.get_channel_indices(channels)
         self.spike_sort_app.load_channel(selected_channel, selected_channel_index)
 
     def bad_channel_handler(self, channel):
@@ -150,8 +146,7 @@ class MainWindow(QMainWindow):
                 self.bad_channels.add(channel)
             else:
                 self.bad_channels.discard(channel)
-            with open(self.data_path / 'bad_channels.txt', 'w') as f:
-                f.write('\n'.join(self.bad_channels))
+            self.recording.write_bad_channels(self.bad_channels)
             self.spike_sort_app.continuous_viewer.all_channels = self.get_channel_indices(list(self.channels - self.bad_channels))            
             self.spike_sort_app.continuous_viewer.update_plot()
         return handler
@@ -162,6 +157,12 @@ class MainWindow(QMainWindow):
         #     np.save('clusters.npy', self.spike_sort_app.clusters)
             # You can also add code to save other data as needed
 
+    def show_job_progress(self, job):
+        if job.status == 'running':
+            self.statusBar().showMessage(f"{job.name}: {job.progress:.0%} {job.message}")
+        else:
+            self.statusBar().showMessage(f"{job.name}: {job.status}", 5000)
+
     def show_version(self):
         # Display version information
         print("Version 1.0")
@@ -172,8 +173,13 @@ class MainWindow(QMainWindow):
 
 if __name__ == '__main__':
     import sys
+    from simiview.util.profiling import profiler
     loglevel = 'DEBUG' if  '-v' in sys.argv else 'WARN'
+    if '--profile' in sys.argv:
+        profiler.enable()
     app = QApplication([])
     window = MainWindow(logger_kwargs={'loggerName': 'SpikeSorter', 'fileName': 'spikesort.log', 'printLevel': loglevel})
     window.show()
-    app.exec_()
\ No newline at end of file
+    app.exec_()
+    if profiler.enabled:
+        profiler.export('spikesort_profile.json', logger=window.logger)
\ No newline at end of file
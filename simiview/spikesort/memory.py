@@ -0,0 +1,155 @@
+import os
+
+import numpy as np
+
+def array_nbytes(value):
+    """The bytes held by an array, or by the arrays in a (nested) tuple, list or dict
+
+    An integer is taken to be a number of bytes held in memory.
+
+    Returns
+    -------
+    resident : int
+        Bytes held in memory
+    mapped : int
+        Bytes of memory-mapped arrays, which the OS pages in and out as needed
+    """
+    if value is None:
+        return 0, 0
+    if isinstance(value, (int, np.integer)):
+        # a size that is already known, e.g. ClusterJournal.nbytes
+        return int(value), 0
+    if isinstance(value, np.ndarray):
+        base = value
+        while isinstance(base, np.ndarray) and not isinstance(base, np.memmap) and base.base is not None:
+            base = base.base
+        if isinstance(base, np.memmap) or isinstance(value, np.memmap):
+            return 0, value.nbytes
+        return value.nbytes, 0
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        resident, mapped = 0, 0
+        for item in value:
+            item_resident, item_mapped = array_nbytes(item)
+            resident += item_resident
+            mapped += item_mapped
+        return resident, mapped
+    return 0, 0
+
+def format_bytes(nbytes):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(nbytes) < 1024 or unit == 'GB':
+            return f"{nbytes:.0f} {unit}" if unit == 'B' else f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+
+class MemoryBudget:
+    """Accounts for the memory held by the major arrays and caches of the app
+
+    Arrays are tracked through functions returning their current value, so
+    the accounting is always up to date without having to be notified of
+    every change. Caches are registered with a function that drops them;
+    when the resident total exceeds the budget, the largest caches are
+    dropped first until it fits. Arrays that can be read from disk (e.g.
+    waveforms) are memory-mapped rather than loaded once they would take
+    more than `map_fraction` of the budget.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        The budget. If None, memory is accounted for but never reclaimed
+    map_fraction : float, optional
+        The fraction of the budget a single array loaded from disk may take, by default 0.5
+    logger : logging.Logger, optional
+    """
+    def __init__(self, max_bytes=None, map_fraction=0.5, logger=None):
+        self.max_bytes = max_bytes
+        self.map_fraction = map_fraction
+        self.logger = logger
+        self.tracked = {}
+        self.caches = {}
+
+    def track(self, name, get_value, category='data'):
+        """Account for the array(s) returned by `get_value()` as `name`"""
+        self.tracked[name] = (category, get_value)
+
+    def track_cache(self, name, get_value, evict):
+        """Account for a cache, which is dropped with `evict()` when over budget
+
+        `evict` may return False if the cache is in use and was kept.
+        """
+        self.tracked[name] = ('cache', get_value)
+        self.caches[name] = evict
+
+    def breakdown(self):
+        """The resident and mapped bytes of everything tracked, by name
+
+        Returns
+        -------
+        dict
+            {name: {'category': str, 'resident': int, 'mapped': int}}
+        """
+        breakdown = {}
+        for name, (category, get_value) in self.tracked.items():
+            resident, mapped = array_nbytes(get_value())
+            breakdown[name] = {'category': category, 'resident': resident, 'mapped': mapped}
+        return breakdown
+
+    def resident_bytes(self):
+        return sum(item['resident'] for item in self.breakdown().values())
+
+    def should_memory_map(self, nbytes):
+        """Whether an array of `nbytes` read from disk should be memory-mapped instead of loaded"""
+        if self.max_bytes is None:
+            return False
+        return nbytes > self.map_fraction * self.max_bytes or self.resident_bytes() + nbytes > self.max_bytes
+
+    def load(self, path):
+        """Load a .npy file, memory-mapped if loading it would exceed the budget"""
+        if self.should_memory_map(os.path.getsize(path)):
+            if self.logger is not None:
+                self.logger.info("Memory-mapping %s (%s) to stay within the memory budget", path, format_bytes(os.path.getsize(path)))
+            return np.load(path, mmap_mode='r')
+        return np.load(path)
+
+    def enforce(self):
+        """Drop the largest caches until the resident total is within the budget
+
+        Returns
+        -------
+        list[str]
+            The names of the caches dropped
+        """
+        if self.max_bytes is None:
+            return []
+        breakdown = self.breakdown()
+        total = sum(item['resident'] for item in breakdown.values())
+        evicted = []
+        caches = sorted(self.caches, key=lambda name: breakdown[name]['resident'], reverse=True)
+        for name in caches:
+            if total <= self.max_bytes:
+                break
+            if breakdown[name]['resident'] == 0:
+                continue
+            if self.caches[name]() is False:
+                continue
+            total -= breakdown[name]['resident']
+            evicted.append(name)
+        if evicted and self.logger is not None:
+            self.logger.info("Over the memory budget of %s, dropped caches: %s", format_bytes(self.max_bytes), ', '.join(evicted))
+        return evicted
+
+    def format_breakdown(self):
+        breakdown = self.breakdown()
+        total_resident = sum(item['resident'] for item in breakdown.values())
+        total_mapped = sum(item['mapped'] for item in breakdown.values())
+        budget = 'none' if self.max_bytes is None else format_bytes(self.max_bytes)
+        lines = [f"Memory: {format_bytes(total_resident)} resident, {format_bytes(total_mapped)} mapped, budget {budget}"]
+        for name, item in sorted(breakdown.items(), key=lambda item: item[1]['resident'], reverse=True):
+            mapped = f" (+{format_bytes(item['mapped'])} mapped)" if item['mapped'] else ''
+            lines.append(f"  {name:<24} {item['category']:<6} {format_bytes(item['resident']):>10}{mapped}")
+        return '\n'.join(lines)
+
+    def log_breakdown(self):
+        if self.logger is not None:
+            self.logger.info("%s", self.format_breakdown())
@@ -0,0 +1,233 @@
+import os
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+CLUSTERS_FILE = 'clusters.npy'
+CLUSTERS_LOG = 'clusters.log'
+
+def save_atomic(path, array):
+    """Save an array to a .npy file such that a crash never leaves a partial file
+
+    The array is written to a temporary file in the same directory, flushed to
+    disk, then renamed over the destination.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as file:
+        np.save(file, array)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+def append_delta(path, indices, values):
+    """Append an edit (clusters[indices] = values) to a cluster log"""
+    with open(path, 'ab') as file:
+        np.save(file, np.asarray(indices, dtype=np.int64))
+        np.save(file, np.asarray(values))
+        file.flush()
+        os.fsync(file.fileno())
+
+def read_deltas(path):
+    """Yield the (indices, values) edits stored in a cluster log
+
+    A truncated record at the end of the log (e.g. from a crash mid-append) is ignored.
+    """
+    with open(path, 'rb') as file:
+        while True:
+            try:
+                indices = np.load(file)
+                values = np.load(file)
+            except (EOFError, ValueError, OSError):
+                return
+            yield indices, values
+
+def load_clusters(directory):
+    """Load the cluster labels of a channel, replaying any edits in its log
+
+    Returns None if no clusters have been saved for the channel.
+    """
+    directory = Path(directory)
+    if not (directory / CLUSTERS_FILE).exists():
+        return None
+    clusters = np.load(directory / CLUSTERS_FILE)
+    if (directory / CLUSTERS_LOG).exists():
+        for indices, values in read_deltas(directory / CLUSTERS_LOG):
+            clusters[indices] = values
+    return clusters
+
+class ClusterWriteError(RuntimeError):
+    """Raised by `ClusterWriter.flush` when labels could not be saved
+
+    Attributes
+    ----------
+    errors : dict
+        The exception of each channel directory that failed
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("Failed to save clusters to " + ', '.join(str(directory) for directory in errors))
+
+class ClusterWriter:
+    """Saves cluster labels on a background thread
+
+    Submissions are coalesced: the writer waits until no edit has been
+    submitted for `debounce` seconds, and then writes only the latest state of
+    each channel. Snapshots are written atomically. With `append_log`, edits
+    are appended to a log beside the snapshot, and the log is compacted into
+    the snapshot after `compact_every` edits, so a typical edit writes only
+    the labels it changed. If a write fails, the latest labels of that
+    channel are queued again as a snapshot, so no edit is ever appended to
+    the log after a gap, and the failure is raised by the next `flush`.
+    """
+    def __init__(self, debounce=0.5, append_log=True, compact_every=50, logger=None):
+        self.debounce = debounce
+        self.append_log = append_log
+        self.compact_every = compact_every
+        self.logger = logger
+
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._log_counts = {}
+        # the exceptions of failed writes, raised by the next flush
+        self._errors = {}
+        self._last_submit = 0.
+        self._writing = False
+        self._force = False
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name='ClusterWriter', daemon=True)
+        self._thread.start()
+
+    def submit(self, directory, clusters, delta=None):
+        """Queue the cluster labels of a channel for saving
+
+        Parameters
+        ----------
+        directory : Path
+            The channel directory
+        clusters : np.ndarray
+            The current cluster labels. A copy is taken, so the caller may keep editing it
+        delta : tuple[np.ndarray, np.ndarray], optional
+            The (indices, values) of the edit that produced these labels.
+            If None, the full labels are written at the next flush
+        """
+        with self._cond:
+            item = self._pending.setdefault(Path(directory), {'clusters': None, 'deltas': [], 'snapshot': False})
+            item['clusters'] = clusters.copy()
+            if delta is None:
+                item['snapshot'] = True
+                item['deltas'] = []
+            elif not item['snapshot']:
+                indices, values = delta
+                item['deltas'].append((np.asarray(indices).copy(), np.asarray(values).copy()))
+            self._last_submit = time.monotonic()
+            self._cond.notify_all()
+
+    def load(self, directory):
+        """Load the cluster labels of a channel once all pending writes are on disk
+
+        If edits were replayed from a log, the labels are queued to be compacted into
+        a new snapshot, so later edits are never appended after a truncated record.
+        """
+        self.flush()
+        clusters = load_clusters(directory)
+        if clusters is not None and (Path(directory) / CLUSTERS_LOG).exists():
+            self.submit(directory, clusters)
+        return clusters
+
+    def flush(self):
+        """Write all pending labels now and wait until they are on disk
+
+        Raises
+        ------
+        ClusterWriteError
+            If labels failed to save since the last flush. They stay queued, and are retried
+        """
+        with self._cond:
+            self._force = True
+            self._cond.notify_all()
+            while (self._pending or self._writing) and not self._errors:
+                self._cond.wait()
+            self._force = False
+            errors, self._errors = self._errors, {}
+        if errors:
+            raise ClusterWriteError(errors)
+
+    def discard(self, directory):
+        """Drop the pending labels and any failure of a channel, e.g. once its spikes are detected again"""
+        directory = Path(directory)
+        with self._cond:
+            # a write in progress may be for this channel
+            while self._writing:
+                self._cond.wait()
+            self._pending.pop(directory, None)
+            self._errors.pop(directory, None)
+            self._log_counts.pop(directory, None)
+
+    def close(self):
+        """Flush pending labels and stop the writer thread"""
+        try:
+            self.flush()
+        finally:
+            with self._cond:
+                self._closing = True
+                self._cond.notify_all()
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closing:
+                    self._cond.wait()
+                if self._closing and not self._pending:
+                    return
+                # coalesce edits until there is a pause of `debounce` seconds
+                while not (self._force or self._closing):
+                    remaining = self._last_submit + self.debounce - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                pending, self._pending = self._pending, {}
+                self._writing = True
+            try:
+                for directory, item in pending.items():
+                    try:
+                        self._write(directory, item)
+                    except Exception as error:
+                        if self.logger is not None:
+                            self.logger.exception(f"Failed to save clusters to {directory}")
+                        self._requeue(directory, item, error)
+            finally:
+                with self._cond:
+                    self._writing = False
+                    self._cond.notify_all()
+
+    def _requeue(self, directory, item, error):
+        """Queue the labels of a failed write again, as a snapshot"""
+        with self._cond:
+            self._errors[directory] = error
+            if self._closing:
+                return
+            # labels submitted since are newer, but their edits follow the failed ones
+            retry = self._pending.setdefault(directory, {'clusters': item['clusters'], 'deltas': [], 'snapshot': True})
+            retry['snapshot'] = True
+            retry['deltas'] = []
+            # retried after the debounce, rather than immediately
+            self._last_submit = time.monotonic()
+
+    def _write(self, directory, item):
+        log_path = directory / CLUSTERS_LOG
+        if self.append_log and not item['snapshot']:
+            for indices, values in item['deltas']:
+                append_delta(log_path, indices, values)
+            count = self._log_counts.get(directory, 0) + len(item['deltas'])
+            self._log_counts[directory] = count
+            if count < self.compact_every:
+                return
+        # the snapshot includes every logged edit, so the log can be dropped once it is in place
+        save_atomic(directory / CLUSTERS_FILE, item['clusters'])
+        if log_path.exists():
+            log_path.unlink()
+        self._log_counts[directory] = 0
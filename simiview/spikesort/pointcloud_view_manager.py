@@ -10,6 +10,7 @@ from vispy.scene import Widget
 from vispy.scene.cameras import ArcballCamera
 
 from simiview.spikesort.colours import COLOURS
+from simiview.util.profiling import profile
 
 class Toolbar(QWidget):
     def __init__(self, parent=None, dimensions=None, dimension_changed_callback=None):
@@ -40,6 +41,16 @@ class Toolbar(QWidget):
             self.combo_boxes[dim] = combo_box
             self.toolbar.addWidget(combo_box)
 
+    def set_dimensions(self, dimensions):
+        """Replace the dimensions offered, selecting the first three"""
+        self.dimensions = dimensions
+        for idx, combo_box in enumerate(self.combo_boxes.values()):
+            combo_box.blockSignals(True)
+            combo_box.clear()
+            combo_box.addItems(dimensions)
+            combo_box.setCurrentIndex(idx)
+            combo_box.blockSignals(False)
+
     def on_combobox_changed(self):
         dimensions = [box.currentText() for box in self.combo_boxes.values()]
         if self.dimension_changed_callback is not None:
@@ -51,8 +62,10 @@ class PointCloudManager:
         "Peak Time", "Valley Amplitude", "Valley Time"
     ]
     def __init__(self, parent, widget, callback=None):
+        self.dimensions = self.DIMENSIONS
         self.active_dimensions = self.DIMENSIONS[:3]
         self.points = None
+        self.hover_pos = None
         # Store reference to parent SpikeSortApp
         self.parent = parent
         self.widget = widget
@@ -89,18 +102,25 @@ class PointCloudManager:
 
     def update_active_dimensions(self, dimensions):
         self.active_dimensions = dimensions
-        self.update_points()
+        self.parent.scheduler.mark('dimensions')
 
+    def set_dimensions(self, dimensions):
+        """Offer a different set of dimensions, e.g. the per-channel features of a channel group"""
+        self.dimensions = dimensions
+        self.toolbar_widget.set_dimensions(dimensions)
+        self.update_active_dimensions(dimensions[:3])
+
+    @profile()
     def update_points(self):
-        """Update the visuals with the current data."""
+        """Recompute point positions for the active dimensions."""
         self.points = self.parent.get_points(self.active_dimensions)
-        if self.points is not None:
-            self.update_colors()
 
+    @profile()
     def update_colors(self):
-        """Update colors of the scatter plot based on clusters."""
-        colors = self.parent.get_colors()
-        self.scatter.set_data(self.points, face_color=colors, edge_color=None)
+        """Update the scatter plot with the current points and cluster colors."""
+        if self.points is None or self.parent.colors is None:
+            return
+        self.scatter.set_data(self.points, face_color=self.parent.colors, edge_color=None)
 
     def reset_camera(self):
         """Reset camera to its default position."""
@@ -111,16 +131,27 @@ class PointCloudManager:
         self.lasso.unregister_events(self.parent)
 
     def on_mouse_move(self, event):
-        """Handle mouse movement for highlighting points."""
+        """Handle mouse movement for highlighting points.
+
+        The nearest point is found once per frame, for the latest mouse position.
+        """
         if 'Alt' in event.mouse_event.modifiers and self.points is not None:
-            # Find the nearest point in the scatter plot
-            pos = event.mouse_event.pos
-            points = self.scatter.get_transform('visual', 'canvas').map(self.points)
-            points = points[:, :2] / points[:, 3:]
-
-            distances = np.linalg.norm(points - pos, axis=1)
-            active_point = np.argmin(distances)
-            self.parent.set_active_point(active_point)
+            self.hover_pos = event.mouse_event.pos
+            self.parent.scheduler.mark('hover')
         else:
+            self.hover_pos = None
             if self.parent.active_point is not None:
                 self.parent.set_active_point(None)
+
+    @profile()
+    def update_hover(self):
+        """Set the active point to the point nearest the mouse."""
+        if self.hover_pos is None or self.points is None:
+            return
+        # Find the nearest point in the scatter plot
+        points = self.scatter.get_transform('visual', 'canvas').map(self.points)
+        points = points[:, :2] / points[:, 3:]
+
+        distances = np.linalg.norm(points - self.hover_pos, axis=1)
+        active_point = int(np.argmin(distances))
+        self.parent.set_active_point(active_point)
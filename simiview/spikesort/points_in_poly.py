@@ -1,7 +1,8 @@
-from matplotlib.path import Path
 import numpy as np
 
 def points_in_polygon(points, poly):
+    # matplotlib is slow to import, and only needed once a lasso is drawn
+    from matplotlib.path import Path
     path = Path(poly)
     inside = path.contains_points(points[:, :2])
     return np.where(inside)[0]
@@ -0,0 +1,94 @@
+"""Opening recordings and reading their signals
+
+Shared by the main window and the command line, so this module must not
+import PyQt or vispy.
+"""
+from pathlib import Path
+import warnings
+
+import numpy as np
+
+# neo reader class of each file type, imported when a file is opened
+FILE_TYPES = {
+    '.rec': 'SpikeGadgetsIO',
+    '.pl2': 'Plexon2IO'
+}
+
+BAD_CHANNELS_FILE = 'bad_channels.txt'
+
+def session_directory(file_path):
+    """The directory where spike sorting results of a recording are saved"""
+    return Path(file_path).with_suffix('.simiview') / 'spikesort'
+
+def get_time_slice(sig, start, n_samples):
+    """get time slice in seconds from start and stop in samples"""
+    start = np.clip(start, 0, sig.shape[0])
+    stop = np.clip(start + n_samples, 0, sig.shape[0])
+
+    start = start / sig.sampling_rate + sig.t_start
+    stop = stop / sig.sampling_rate + sig.t_start
+    return start, stop
+
+def load_signal(sig, t_slice, channel_idx):
+    """Load a time slice of some channels of a lazy signal, in uV"""
+    data_chunk = sig.load(time_slice=t_slice, channel_indexes=channel_idx)
+    data_chunk = data_chunk.rescale('uV').magnitude
+    return data_chunk
+
+class Recording:
+    """A recording opened with the neo reader for its file type
+
+    Parameters
+    ----------
+    file_path : str or Path
+        A SpikeGadgets (.rec) or Plexon (.pl2) file
+    """
+    def __init__(self, file_path):
+        self.file_path = Path(file_path)
+        suffix = self.file_path.suffix.lower()
+        if suffix not in FILE_TYPES:
+            raise ValueError(f"Unsupported file type: {self.file_path.suffix}")
+        import neo.io
+        self.reader = getattr(neo.io, FILE_TYPES[suffix])(str(self.file_path))
+        self.signal = self.reader.read_block(lazy=True).segments[0].analogsignals[0]
+        self.directory = session_directory(self.file_path)
+
+        if suffix == '.pl2':
+            self.channels = [channel for channel in self.reader.header['signal_channels']['name'] if 'WB' in channel]
+            warnings.warn("Plexon files are not fully supported. Do not use common median rejection.")
+        else:
+            self.channels = list(self.reader.header['signal_channels']['name'])
+
+    @property
+    def n_samples(self):
+        return self.signal.shape[0]
+
+    @property
+    def time_offset(self):
+        """The offset added to sample indices to produce spike timestamps"""
+        return (self.signal.t_start / self.signal.sampling_rate).magnitude
+
+    def get_channel_indices(self, channel_names):
+        return self.reader.channel_name_to_index(0, channel_names)
+
+    def read_bad_channels(self):
+        """The channels marked as bad in the channel table, or None if none were saved"""
+        if not (self.directory / BAD_CHANNELS_FILE).exists():
+            return None
+        with open(self.directory / BAD_CHANNELS_FILE) as f:
+            return f.read().splitlines()
+
+    def write_bad_channels(self, bad_channels):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / BAD_CHANNELS_FILE, 'w') as f:
+            f.write('\n'.join(bad_channels))
+
+    def good_channels(self):
+        bad_channels = set(self.read_bad_channels() or [])
+        return [channel for channel in self.channels if channel not in bad_channels]
+
+    def get_time_slice(self, start, n_samples):
+        return get_time_slice(self.signal, start, n_samples)
+
+    def load(self, t_slice, channel_idx):
+        return load_signal(self.signal, t_slice, channel_idx)
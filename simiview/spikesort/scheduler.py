@@ -0,0 +1,59 @@
+from vispy import app
+from simiview.util.profiling import profile
+
+class UpdateScheduler:
+    """Coalesces visual updates into a single pass per frame
+
+    Components mark what has changed (e.g. 'labels', 'colours', 'active_point')
+    instead of updating visuals directly. On each tick of a vispy timer, every
+    handler registered for at least one dirty flag is called once, in
+    registration order, no matter how many times its flags were marked since
+    the previous frame.
+
+    Flags marked by a handler during a pass are seen by the handlers registered
+    after it in the same pass, so handlers should be registered in dependency order.
+    """
+    def __init__(self, interval=1 / 60, start=True):
+        self.handlers = []
+        self.frame_callbacks = []
+        self.dirty = set()
+        self._pass = None
+        self.timer = app.Timer(interval, connect=self.on_timer, start=start)
+
+    def register(self, callback, *flags):
+        """Call `callback()` in each pass where any of `flags` is dirty"""
+        self.handlers.append((frozenset(flags), callback))
+
+    def add_frame_callback(self, callback):
+        """Call `callback()` on every frame, before the dirty handlers"""
+        self.frame_callbacks.append(callback)
+
+    def mark(self, *flags):
+        if self._pass is not None:
+            self._pass.update(flags)
+        else:
+            self.dirty.update(flags)
+
+    def is_dirty(self, flag):
+        return flag in self.dirty or (self._pass is not None and flag in self._pass)
+
+    @profile()
+    def flush(self):
+        """Run the handlers for everything marked since the last pass"""
+        if not self.dirty or self._pass is not None:
+            return
+        self._pass, self.dirty = self.dirty, set()
+        try:
+            for flags, callback in self.handlers:
+                if flags & self._pass:
+                    callback()
+        finally:
+            self._pass = None
+
+    def on_timer(self, event):
+        for callback in self.frame_callbacks:
+            callback()
+        self.flush()
+
+    def stop(self):
+        self.timer.stop()
@@ -1,19 +1,21 @@
+import threading
+
 import numpy as np
 from vispy import scene
 
-from simianpy.signal import sosFilter
 import simianpy as simi
-
-filt = (
-    sosFilter('bandstop', 6, [49.9, 50.1], 30000) 
-    + sosFilter('bandstop', 6, [99.9, 100.1], 30000)
-    + sosFilter('bandpass', 6, [300, 3000], 30000)
-)
+from simiview.spikesort.detection import filt, detect_waveforms
+from simiview.spikesort.recording import get_time_slice, load_signal
+from simiview.util.profiling import profile
 
 class SingleChannelViewer:
     @simi.misc.add_logging
-    def __init__(self, view, update_spikes_callback=None, logger=None):
+    def __init__(self, view, update_spikes_callback=None, jobs=None, logger=None):
+        # held while the median trace is checked, allocated or filled, which
+        # happens on the main thread and in median and detection jobs
+        self._median_lock = threading.Lock()
         self.view = view
+        self.jobs = jobs
         self.sig = None
         self.channel_idx = None
         self.all_channels = None
@@ -28,34 +30,39 @@ class SingleChannelViewer:
         self.logger = logger
 
         self._median_trace = None
+        self._median_job = None
+        self._median_job_slice = None
+        self.detection_job = None
         self._init_vispy()
 
     def get_time_slice(self, start, n_samples):
         """get time slice in seconds from start and stop in samples"""
-        start = np.clip(start, 0, self.n_samples)
-        stop = np.clip(start + n_samples, 0, self.n_samples)
-
-        start = start / self.sig.sampling_rate + self.sig.t_start
-        stop = stop / self.sig.sampling_rate + self.sig.t_start
-        return start, stop
+        return get_time_slice(self.sig, start, n_samples)
     
+    @profile()
     def _load_data(self, t_slice, channel_idx):
-        data_chunk = self.sig.load(time_slice=t_slice, channel_indexes=channel_idx)
-        data_chunk = data_chunk.rescale('uV').magnitude
-        return data_chunk
+        return load_signal(self.sig, t_slice, channel_idx)
 
+    @profile()
     def _get_data_chunk(self):
         if self.channel_idx is None:
             return
         t_slice = self.get_time_slice(self.current_position, self.chunk_size)
-        self.logger.debug(f"Getting data chunk for channel {self.channel_idx} for {t_slice}")
-        data_chunk = self._load_data(t_slice, self.channel_idx).squeeze()
-        self.logger.debug(f"Data chunk shape: {data_chunk.shape}")
-        self.logger.debug(f"Data chunk: {data_chunk}")
+        self.logger.debug("Getting data chunk for channel %s for %s", self.channel_idx, t_slice)
+        # a channel group is previewed by its first channel
+        data_chunk = self._load_data(t_slice, np.atleast_1d(self.channel_idx)[:1]).squeeze()
+        self.logger.debug("Data chunk shape: %s", data_chunk.shape)
 
         if self.is_cmr_enabled:
-            median = self.get_median_trace(time_slice=t_slice)
-            data_chunk = data_chunk - median
+            # the cached trace is read without waiting for jobs holding the lock
+            median = self.get_cached_median_trace(t_slice)
+            if median is None and self.jobs is None:
+                median = self.get_median_trace(time_slice=t_slice)
+            if median is not None:
+                data_chunk = data_chunk - median
+            else:
+                # show the data without CMR until the median has been computed in the background
+                self._request_median_trace(t_slice)
         data_chunk = data_chunk * self.scale_factor
         if self.is_filter_enabled:
             self.logger.debug("Filtering data chunk")
@@ -66,7 +73,7 @@ class SingleChannelViewer:
 
     def update_plot(self):
         """ Update the plot with the current position and channels """
-        self.logger.debug(f"Updating plot for channel {self.channel_idx} for {self.current_position} - {self.current_position + self.chunk_size} samples")
+        self.logger.debug("Updating plot for channel %s for %s - %s samples", self.channel_idx, self.current_position, self.current_position + self.chunk_size)
         data_chunk = self._get_data_chunk()
         #TODO: implement colouring of detected waveforms
         self.line.set_data(pos=data_chunk)
@@ -148,15 +155,77 @@ class SingleChannelViewer:
         return self._sig
     @sig.setter
     def sig(self, value):
-        self._sig = value
-        self._median_trace = None
+        with self._median_lock:
+            self._sig = value
+            self._median_trace = None
     @property
     def all_channels(self):
         return self._all_channels
     @all_channels.setter
     def all_channels(self, value):
-        self._all_channels = value
-        self._median_trace = None
+        with self._median_lock:
+            self._all_channels = value
+            self._median_trace = None
+    def _median_trace_samples(self, time_slice=None):
+        if time_slice is None:
+            return slice(None)
+        start, stop = time_slice
+        start_idx = int(round((start-self.sig.t_start) * self.sig.sampling_rate))
+        stop_idx = int(round((stop-self.sig.t_start) * self.sig.sampling_rate))
+        return slice(start_idx, stop_idx)
+
+    def clear_median_trace(self):
+        """Drop the cached median trace, which is recomputed as needed
+
+        The trace is kept while a job is computing or reading it.
+
+        Returns
+        -------
+        bool
+            Whether the trace was dropped
+        """
+        if not self._median_lock.acquire(blocking=False):
+            return False
+        try:
+            self._median_trace = None
+        finally:
+            self._median_lock.release()
+        return True
+
+    def has_median_trace(self, time_slice=None):
+        """Whether the median trace is cached for the whole time slice"""
+        median_trace = self._median_trace
+        if median_trace is None:
+            return False
+        return not np.isnan(median_trace[self._median_trace_samples(time_slice)]).any()
+
+    def get_cached_median_trace(self, time_slice=None):
+        """A copy of the median trace for the time slice if it is fully cached, otherwise None
+
+        Sections are only ever filled in, never reallocated, so this does not need the lock.
+        """
+        median_trace = self._median_trace
+        if median_trace is None:
+            return None
+        median = median_trace[self._median_trace_samples(time_slice)].copy()
+        if np.isnan(median).any():
+            return None
+        return median
+
+    def _request_median_trace(self, time_slice):
+        """Compute the median trace for a time slice in the background, then redraw"""
+        if self._median_job is not None and not self._median_job.done:
+            if self._median_job_slice == time_slice:
+                return
+            self._median_job.cancel()
+        self._median_job_slice = time_slice
+        self._median_job = self.jobs.submit(
+            self.get_median_trace, time_slice=time_slice,
+            name='Median trace',
+            on_result=lambda _: self.update_plot()
+        )
+
+    @profile()
     def get_median_trace(self, time_slice=None):
         """Get the median trace of all channels
 
@@ -168,77 +237,82 @@ class SingleChannelViewer:
         Returns
         -------
         np.ndarray
-            The median trace of all channels in the time slice 
+            A copy of the median trace of all channels in the time slice 
             cast to np.float16
         """
         if time_slice is not None:
-            self.logger.info(f"Getting median trace for time slice {time_slice}")
-            start, stop = time_slice
-            start_idx = int(round((start-self.sig.t_start) * self.sig.sampling_rate))
-            stop_idx = int(round((stop-self.sig.t_start) * self.sig.sampling_rate))
-            time_slice_samples = slice(start_idx, stop_idx)
-        else:
-            self.logger.info(f"Getting median trace for all time")
-            time_slice_samples = slice(None)
-
-
-        if self._median_trace is None:
-            self.logger.info("No trace, allocating median trace empty array")
-            self._median_trace = np.full(self.n_samples, np.nan, dtype=np.float16)
-        if np.isnan(self._median_trace[time_slice_samples]).any():
-            self.logger.info("Missing data, calculating median trace")
-            data = self._load_data(time_slice, self.all_channels)
-            self.logger.debug(f"Data shape for median: {data.shape}")
-            self._median_trace[time_slice_samples] = np.median(
-                data,
-                axis=1
-            )
+            self.logger.info("Getting median trace for time slice %s", time_slice)
         else:
-            self.logger.info("Returning cached median trace")
+            self.logger.info("Getting median trace for all time")
+        time_slice_samples = self._median_trace_samples(time_slice)
 
-        return self._median_trace[time_slice_samples]
+        # jobs computing the same section wait for each other, rather than all loading it
+        with self._median_lock:
+            median_trace = self._median_trace
+            if median_trace is None:
+                self.logger.info("No trace, allocating median trace empty array")
+                median_trace = self._median_trace = np.full(self.n_samples, np.nan, dtype=np.float16)
+            if np.isnan(median_trace[time_slice_samples]).any():
+                self.logger.info("Missing data, calculating median trace")
+                data = self._load_data(time_slice, self.all_channels)
+                self.logger.debug("Data shape for median: %s", data.shape)
+                median_trace[time_slice_samples] = np.median(
+                    data,
+                    axis=1
+                )
+            else:
+                self.logger.info("Returning cached median trace")
+            return median_trace[time_slice_samples].copy()
 
     def detect_waveforms(self):
-        if self.threshold is None:
+        """Detect waveforms over the whole file with the current parameters
+
+        Detection runs as a background job when a job manager is available. The
+        current channel and preprocessing settings are captured, so the view may
+        change while detection runs. For a channel group, every channel is read
+        at once for each chunk, and the threshold is shared by all channels.
+        """
+        if self.threshold is None or self.channel_idx is None:
             return
-        self.detect_chunk_size = int(1e7)
-        self.waveforms = []
-        self.timestamps = []
-        # iterate through the whole file in chunks
-        self.logger.info(f"Detecting waveforms with threshold {self.threshold}")
-        for i in range(0, self.n_samples, self.detect_chunk_size):
-            t_slice = start, stop = self.get_time_slice(i, self.detect_chunk_size)
-            self.logger.info(f"Processing chunk {i}: {start} - {stop}")
-            chunk = self._load_data(t_slice, self.channel_idx).squeeze()
-            self.logger.info(f"Loaded chunk of size {chunk.size}")
-            if self.is_cmr_enabled:
+        channel_idx = self.channel_idx
+        is_cmr_enabled = self.is_cmr_enabled
+        is_filter_enabled = self.is_filter_enabled
+        scale_factor = self.scale_factor
+
+        def load_chunk(start, n_samples):
+            t_slice = self.get_time_slice(start, n_samples)
+            chunk = self._load_data(t_slice, channel_idx)
+            if chunk.shape[1] == 1:
+                chunk = chunk[:, 0]
+            if is_cmr_enabled:
+                # a copy, so the cache may be dropped while the chunk is processed
                 median = self.get_median_trace(time_slice=t_slice)
-                chunk = chunk - median
-                self.logger.info(f"CMR applied")
-            chunk = chunk * self.scale_factor
-            if self.is_filter_enabled:
+                chunk = chunk - (median if chunk.ndim == 1 else median[:, np.newaxis])
+            chunk = chunk * scale_factor
+            if is_filter_enabled:
                 chunk = filt(chunk)
-                self.logger.info(f"Filter applied")
-            # find the indices where the threshold is crossed
-            crossings = np.where(chunk < self.threshold)[0]
-            self.logger.info(f"Found {crossings.size} crossings")
-            #remove crossings that are too close to each other
-            crossings = crossings[np.diff(crossings, prepend=-40) > 2]
-            self.logger.info(f"Removed crossings too close to each other. {crossings.size} crossings left")
-            # get indexes of the waveforms
-            waveforms = chunk[np.repeat(crossings, 40) + np.tile(np.arange(-8, 32), crossings.size)].reshape(-1, 40)
-            self.logger.info(f"Extracted {waveforms.shape[0]} waveforms")
-            self.waveforms.append(waveforms)
-            timestamps = crossings + i + (self.sig.t_start/self.sig.sampling_rate).magnitude
-            self.timestamps.append(timestamps)
-
-        self.logger.info("Finished detecting waveforms, concatenating")
-        self.waveforms = np.concatenate(self.waveforms, axis=0)
-        self.timestamps = np.concatenate(self.timestamps)
-        self.logger.info("Finished concatenating")
-        if self.update_spikes_callback is not None:
-            self.logger.info("Calling update_spikes_callback")
-            self.update_spikes_callback(self.waveforms, self.timestamps)        
+            return chunk
+
+        def on_result(result):
+            self.waveforms, self.timestamps = result
+            if self.update_spikes_callback is not None:
+                self.logger.info("Calling update_spikes_callback")
+                self.update_spikes_callback(self.waveforms, self.timestamps, channel_idx=channel_idx)
+
+        args = (load_chunk, self.n_samples, self.threshold)
+        kwargs = dict(
+            chunk_size=int(1e7),
+            time_offset=(self.sig.t_start/self.sig.sampling_rate).magnitude,
+            logger=self.logger
+        )
+        if self.jobs is None:
+            on_result(detect_waveforms(*args, **kwargs))
+        else:
+            self.detection_job = self.jobs.submit(
+                detect_waveforms, *args, **kwargs,
+                name=f"Detect waveforms (channel {channel_idx})",
+                on_result=on_result
+            )
 
     def on_mouse_press(self, event):
         """ Handle mouse presses """
@@ -0,0 +1,123 @@
+import numpy as np
+
+from simiview.jobs import report_progress
+from simiview.util.profiling import profile
+
+def waveform_stats(waveforms, idx):
+    """Mean and standard deviation of the waveforms at `idx`"""
+    cluster_waveforms = waveforms[idx]
+    return cluster_waveforms.mean(axis=0), cluster_waveforms.std(axis=0)
+
+def compute_templates(waveforms, cluster_index, cluster_ids=None):
+    """Mean waveform of each cluster, to match spikes against
+
+    The statistics are cached on the cluster index, and shared with the unit view.
+
+    Parameters
+    ----------
+    waveforms : np.ndarray
+        Waveforms of shape (n_spikes, n_samples) or (n_spikes, n_channels, n_samples)
+    cluster_index : ClusterIndex
+        The index of the current labels
+    cluster_ids : list[int], optional
+        The clusters to compute templates for, by default all sorted units
+
+    Returns
+    -------
+    cluster_ids : np.ndarray
+        The cluster of each template
+    templates : np.ndarray
+        Mean waveforms of shape (n_templates, n_features), with the
+        channels of a channel group concatenated
+    spreads : np.ndarray
+        The RMS of each cluster's standard deviation, i.e. the expected RMS
+        distance of a member spike from its template
+    """
+    if cluster_ids is None:
+        cluster_ids = cluster_index.get_sorted_cluster_ids()
+    stats = [
+        cluster_index.cached('waveform_stats', cluster, lambda idx: waveform_stats(waveforms, idx))
+        for cluster in cluster_ids
+    ]
+    n_features = int(np.prod(waveforms.shape[1:]))
+    templates = np.array([mean_ for mean_, _ in stats], dtype=np.float32).reshape(-1, n_features)
+    spreads = np.array([np.sqrt(np.mean(std_ ** 2)) for _, std_ in stats], dtype=np.float32)
+    return np.asarray(cluster_ids), templates, spreads
+
+@profile()
+def match_templates(waveforms, templates, template_ids, max_distance=None, candidates=None, max_bytes=64 * 2**20, unassigned=0):
+    """Assign spikes to their nearest template
+
+    Distances are computed by matrix multiplication over blocks of spikes,
+    so only one block of waveforms is held in memory at a time, and
+    `waveforms` may be a memory-mapped array larger than RAM.
+
+    Parameters
+    ----------
+    waveforms : np.ndarray
+        Waveforms of shape (n_spikes, n_samples) or (n_spikes, n_channels, n_samples),
+        e.g. np.load(..., mmap_mode='r')
+    templates : np.ndarray
+        Templates of shape (n_templates, n_features), see `compute_templates`
+    template_ids : np.ndarray
+        The cluster of each template
+    max_distance : float or np.ndarray, optional
+        The largest RMS distance, in the units of the waveforms, at which a
+        spike is assigned, either overall or per template. By default, every
+        spike is assigned
+    candidates : np.ndarray, optional
+        Sorted indices of the spikes to match, by default all spikes
+    max_bytes : int, optional
+        Approximate memory used per block, by default 64 MB
+    unassigned : int, optional
+        The label of spikes further than max_distance from every template, by default 0
+
+    Returns
+    -------
+    labels : np.ndarray
+        The assigned cluster of each candidate spike
+    distances : np.ndarray
+        The RMS distance of each candidate spike to its nearest template
+    """
+    n_spikes = waveforms.shape[0]
+    # the channels of a channel group are matched together
+    n_features = int(np.prod(waveforms.shape[1:]))
+    templates = np.asarray(templates, dtype=np.float32)
+    template_ids = np.asarray(template_ids)
+    if candidates is None:
+        n_candidates = n_spikes
+    else:
+        candidates = np.asarray(candidates)
+        n_candidates = candidates.size
+    labels = np.full(n_candidates, unassigned, dtype=template_ids.dtype if template_ids.size else np.int8)
+    distances = np.full(n_candidates, np.inf, dtype=np.float32)
+    if templates.shape[0] == 0 or n_candidates == 0:
+        return labels, distances
+
+    template_sq = np.einsum('ij,ij->i', templates, templates)
+    if max_distance is not None:
+        # compared against squared euclidean distances
+        max_sq = (np.broadcast_to(np.asarray(max_distance, dtype=np.float32), template_sq.shape) ** 2) * n_features
+    # a block holds the waveforms as float32 and their distances to each template
+    block_size = max(1, int(max_bytes // (4 * (n_features + templates.shape[0]))))
+    for start in range(0, n_candidates, block_size):
+        report_progress(start / n_candidates, f"Matching templates, spike {start} of {n_candidates}")
+        stop = min(start + block_size, n_candidates)
+        if candidates is None:
+            block = np.asarray(waveforms[start:stop], dtype=np.float32)
+        else:
+            block = np.asarray(waveforms[candidates[start:stop]], dtype=np.float32)
+        block = block.reshape(block.shape[0], n_features)
+        # |x - t|^2 = |x|^2 - 2 x.t + |t|^2
+        dist_sq = block @ templates.T
+        dist_sq *= -2
+        dist_sq += template_sq
+        dist_sq += np.einsum('ij,ij->i', block, block)[:, np.newaxis]
+        nearest = dist_sq.argmin(axis=1)
+        nearest_sq = np.maximum(dist_sq[np.arange(nearest.size), nearest], 0)
+        block_labels = template_ids[nearest]
+        if max_distance is not None:
+            block_labels[nearest_sq > max_sq[nearest]] = unassigned
+        labels[start:stop] = block_labels
+        distances[start:stop] = np.sqrt(nearest_sq / n_features)
+    return labels, distances
@@ -1,47 +1,133 @@
 import numpy as np
-from vispy.scene.visuals import Line, Text
+from vispy.scene.visuals import Line, Text, Mesh
 from vispy.scene import PanZoomCamera
 from PyQt5 import QtWidgets, QtCore, QtGui
 
 from simiview.spikesort.colours import COLOURS
+from simiview.spikesort.isi import isi_histogram, isi_step_vertices
+from simiview.spikesort.template_matching import waveform_stats
+from simiview.util.linecollection import LineCollection
+from simiview.util.profiling import profile
+
+CHANNEL_GAP = 0.1
+
+def channel_layout(waveforms, gap=CHANNEL_GAP):
+    """Lay out the channels of waveforms side by side, as lines of a LineCollection
+
+    Parameters
+    ----------
+    waveforms : np.ndarray
+        Array of shape (n, n_samples), or (n, n_channels, n_samples) for a channel group
+    gap : float, optional
+        The space between channels, as a fraction of n_samples, by default 0.1
+
+    Returns
+    -------
+    lines : np.ndarray
+        Array of shape (n * n_channels, n_samples), the channels of each waveform in turn
+    x_offset : np.ndarray
+        The x offset of each line
+    width : float
+        The width taken by the channels of a waveform
+    """
+    n_samples = waveforms.shape[-1]
+    if waveforms.ndim == 2:
+        return waveforms, np.zeros(waveforms.shape[0]), n_samples
+    n, n_channels, _ = waveforms.shape
+    step = n_samples * (1 + gap)
+    x_offset = np.tile(np.arange(n_channels) * step, n)
+    return waveforms.reshape(n * n_channels, n_samples), x_offset, (n_channels - 1) * step + n_samples
 
 class UnitViewManager:
+    """Draws a summary of every cluster into a single view
+
+    Each cluster has a cell, laid out left to right, containing its mean
+    waveform with a band of one standard deviation, its spike count and its
+    ISI histogram. For a channel group, the mean waveform of each channel is
+    drawn side by side. The cells of all clusters share one line collection, one
+    text visual, one ISI line and one background mesh, so adding or removing
+    clusters only updates their data.
+    """
+    CELL_GAP = 0.1
+    ISI_HEIGHT = 0.5
+    BACKGROUND = (0., 0., 0., 1.)
+    SELECTED_BACKGROUND = (0.2, 0.2, 0.2, 1.)
+
     def __init__(self, parent, widget):
         self.parent = parent
         self.widget = widget
 
-        self.unit_views = {}
-        self.unit_waveforms = {}
-        self.units_grid = self.widget.add_grid()
+        self.view = self.widget.add_view()
+        self.view.camera = PanZoomCamera()
+        self.view.camera.interactive = False
+        self.view.bgcolor = 'black'
+        self.view.events.mouse_press.connect(self.on_mouse_press)
+
+        # draw order: backgrounds, then borders, then data
+        self.backgrounds = Mesh(parent=self.view.scene)
+        self.border = Line(method='gl', connect='strip', width=2, parent=self.view.scene)
+        self.waveform_lines = LineCollection()
+        self.view.add(self.waveform_lines)
+        self.isi_lines = Line(method='gl', connect='segments', parent=self.view.scene)
+        self.labels = Text(color='w', anchor_x='left', anchor_y='top', font_size=8, parent=self.view.scene)
 
+        self.cell_clusters = []
         self.selected = set()
         self.active = None
+        self._waveform_range = None
 
     @property
     def waveform_xy(self):
         return 0, self.waveforms.min()
-    
+
     @property
     def waveform_rect(self):
-        return (0, self.waveforms.min()), (40, self.waveforms.max() - self.waveforms.min())
+        return (0, self.waveforms.min()), (self.trace_width, self.waveforms.max() - self.waveforms.min())
 
     @property
     def waveforms(self):
         return self.parent.waveforms
 
+    @property
+    def n_samples(self):
+        return self.waveforms.shape[-1]
+
+    @property
+    def n_channels(self):
+        return 1 if self.waveforms.ndim == 2 else self.waveforms.shape[1]
+
+    @property
+    def trace_width(self):
+        """The width of the waveforms of all channels, side by side"""
+        return (self.n_channels - 1) * self.n_samples * (1 + CHANNEL_GAP) + self.n_samples
+
     @property
     def clusters(self):
         return self.parent.clusters
 
-    def _add_units_view(self, cluster):
-        view = self.units_grid.add_view(row=0, col=cluster)
-        view.camera = PanZoomCamera(aspect=1)
-        view.camera.interactive = False
-        view.camera.rect = self.waveform_rect
-        view.border_color = 'black'
-        view.padding = 5
-        view.events.mouse_press.connect(self.mouse_press_handler_gen(cluster))
-        self.unit_views[cluster] = view
+    @property
+    def cluster_index(self):
+        return self.parent.cluster_index
+
+    @property
+    def cell_width(self):
+        return self.trace_width * (1 + self.CELL_GAP)
+
+    def get_waveform_range(self):
+        """The minimum and maximum over all waveforms, computed once per loaded channel"""
+        if self._waveform_range is None or self._waveform_range[0] is not self.waveforms:
+            self._waveform_range = (self.waveforms, float(self.waveforms.min()), float(self.waveforms.max()))
+        return self._waveform_range[1:]
+
+    def cell_at(self, pos):
+        """The cluster whose cell contains a position in canvas coordinates, or None"""
+        if not self.cell_clusters:
+            return None
+        x, _ = self.view.scene.transform.imap(pos)[:2]
+        idx = int(np.floor(x / self.cell_width))
+        if 0 <= idx < len(self.cell_clusters):
+            return self.cell_clusters[idx]
+        return None
 
     def set_selected(self, cluster):
         if cluster in self.selected:
@@ -54,36 +140,63 @@ class UnitViewManager:
         self.update_viewbox_states()
 
     def update_viewbox_states(self):
-        for c, view in self.unit_views.items():
-            if c in self.selected:
-                view.bgcolor = (0.2, 0.2, 0.2, 1)
-            else:
-                view.bgcolor = 'black'
-            if c == self.active:
-                view.border_color = COLOURS[c]
-            else:
-                view.border_color = 'black'
+        """Highlight the backgrounds of selected cells and outline the active cell"""
+        n_cells = len(self.cell_clusters)
+        if n_cells == 0:
+            self.backgrounds.visible = False
+            self.border.visible = False
+            return
+        width = self.cell_width
+        bottom, top = -self.ISI_HEIGHT - self.CELL_GAP, 1.
+        x0 = np.arange(n_cells) * width
+        x1 = x0 + self.trace_width
+        corners = np.stack([
+            np.stack([x0, np.full(n_cells, bottom)], axis=-1),
+            np.stack([x1, np.full(n_cells, bottom)], axis=-1),
+            np.stack([x1, np.full(n_cells, top)], axis=-1),
+            np.stack([x0, np.full(n_cells, top)], axis=-1),
+        ], axis=1)
+        faces = np.array([[0, 1, 2], [0, 2, 3]])[np.newaxis] + 4 * np.arange(n_cells)[:, np.newaxis, np.newaxis]
+        colors = np.array([
+            self.SELECTED_BACKGROUND if cluster in self.selected else self.BACKGROUND
+            for cluster in self.cell_clusters
+        ], dtype=np.float32)
+        self.backgrounds.set_data(
+            vertices=corners.reshape(-1, 2),
+            faces=faces.reshape(-1, 3),
+            vertex_colors=np.repeat(colors, 4, axis=0)
+        )
+        self.backgrounds.visible = True
+
+        if self.active in self.cell_clusters:
+            idx = self.cell_clusters.index(self.active)
+            outline = corners[idx][[0, 1, 2, 3, 0]]
+            self.border.set_data(pos=outline, color=COLOURS[self.active] + [1.])
+            self.border.visible = True
+        else:
+            self.border.visible = False
 
     def set_active(self, cluster):
         self.active = cluster
         self.update_viewbox_states()
 
-    def mouse_press_handler_gen(self, cluster):
-        def mouse_press_handler(event):
-            if event.button == 1 and 'Shift' in event.mouse_event.modifiers:
-                self.set_selected(cluster)
-                self.set_active(cluster)
-            elif event.button == 1:
+    def on_mouse_press(self, event):
+        cluster = self.cell_at(event.pos)
+        if cluster is None:
+            return
+        if event.button == 1 and 'Shift' in event.mouse_event.modifiers:
+            self.set_selected(cluster)
+            self.set_active(cluster)
+        elif event.button == 1:
+            self.reset_selected()
+            self.set_active(cluster)
+        elif event.button == 2:
+            # self.set_selected(cluster)
+            # use pyqt5 to create a context menu
+            if cluster not in self.selected:
                 self.reset_selected()
                 self.set_active(cluster)
-            elif event.button == 2:
-                # self.set_selected(cluster)
-                # use pyqt5 to create a context menu
-                if cluster not in self.selected:
-                    self.reset_selected()
-                    self.set_active(cluster)
-                self.customContextMenu()
-        return mouse_press_handler
+            self.customContextMenu()
 
     def customContextMenu(self):
         # widget = self.widget.canvas.native
@@ -102,60 +215,83 @@ class UnitViewManager:
     def customAction(self):
         print("Custom action on", self.selected if self.selected else self.active)
 
-    def update_units_grid(self):
-        existing_views = list(self.unit_views.keys())
-        clusters = np.unique(self.clusters)
-        for unit in existing_views:
-            if unit not in clusters:
-                widget = self.unit_views.pop(unit)
-                if hasattr(widget.parent, 'remove'):
-                    widget.widget.remove(widget)
-        for cluster in clusters:
-            if cluster == -1:
-                continue
-            if cluster not in self.unit_views:
-                self._add_units_view(cluster)
-
     def _compute_waveform_data(self):
-        unique_clusters = np.unique(self.clusters)
         waveform_data = {}
-        t = np.arange(self.waveforms.shape[1])
-        for cluster in unique_clusters:
+        for cluster in self.cluster_index.cluster_ids:
             if cluster == -1:
                 continue
-            mean_ = self.waveforms[self.clusters == cluster].mean(axis=0)
-            mean_ = np.array([t, mean_]).T
+            mean_, std_ = self.cluster_index.cached(
+                'waveform_stats', cluster, lambda idx: waveform_stats(self.waveforms, idx)
+            )
             waveform_data[cluster] = {
                 'mean': mean_,
-                'count': (self.clusters == cluster).sum()
+                'std': std_,
+                'count': self.cluster_index.indices[cluster].size
             }
         return waveform_data
 
+    def _compute_isi_data(self):
+        isi_data = {}
+        for cluster in self.cluster_index.cluster_ids:
+            if cluster == -1:
+                continue
+            isi_data[cluster] = self.cluster_index.cached(
+                'isi', cluster, lambda idx: isi_histogram(self.cluster_index.times(cluster))[1]
+            )
+        return isi_data
+
+    def update_isi_view(self):
+        isi_data = self._compute_isi_data()
+        if not isi_data:
+            self.isi_lines.visible = False
+            return
+        counts = np.stack([isi_data[cluster] for cluster in self.cell_clusters])
+        offsets = np.arange(len(self.cell_clusters)) * self.cell_width
+        pos, connect = isi_step_vertices(counts, offsets=offsets, width=self.trace_width)
+        # ISI histograms sit below the waveforms in each cell
+        pos[:, 1] = pos[:, 1] * self.ISI_HEIGHT - self.ISI_HEIGHT - self.CELL_GAP
+        n_verts = pos.shape[0] // len(self.cell_clusters)
+        colors = np.ones((len(self.cell_clusters), 4), dtype=np.float32)
+        colors[:, :3] = [COLOURS[cluster] for cluster in self.cell_clusters]
+        self.isi_lines.set_data(pos=pos, connect=connect, color=np.repeat(colors, n_verts, axis=0))
+        self.isi_lines.visible = True
+
+    @profile()
     def update_units_view(self):
-        #TODO: does not remove waveforms from empty clusters
         waveform_data = self._compute_waveform_data()
-        self.update_units_grid()
-        for cluster, wf_info in waveform_data.items():
-            label_text = "N={count}".format(**wf_info)
-            if cluster not in self.unit_waveforms:
-                line = Line(
-                    wf_info['mean'],
-                    color=COLOURS[cluster],
-                    parent=self.unit_views[cluster].scene
-                )
-
-                x, y = self.waveform_xy
-                text_xy = x, y * 0.9
-                label = Text(label_text,
-                             color='w',
-                             anchor_x='left',
-                             parent=self.unit_views[cluster].scene,
-                             pos=text_xy
-                             )
-                self.unit_waveforms[cluster] = {
-                    'line': line,
-                    'label': label
-                }
-            else:
-                self.unit_waveforms[cluster]['line'].set_data(wf_info['mean'])
-                self.unit_waveforms[cluster]['label'].text = label_text
\ No newline at end of file
+        self.cell_clusters = list(waveform_data.keys())
+        n_cells = len(self.cell_clusters)
+        if n_cells == 0:
+            for visual in [self.waveform_lines, self.isi_lines, self.labels]:
+                visual.visible = False
+            self.update_viewbox_states()
+            return
+
+        # waveforms are scaled into [0, 1] in each cell, using the range of all waveforms
+        lo, hi = self.get_waveform_range()
+        scale = 1 / max(hi - lo, np.finfo(float).eps)
+        means = np.stack([waveform_data[cluster]['mean'] for cluster in self.cell_clusters])
+        stds = np.stack([waveform_data[cluster]['std'] for cluster in self.cell_clusters])
+        lines, channel_offsets, _ = channel_layout((np.concatenate([means, means - stds, means + stds]) - lo) * scale)
+        n_channels = self.n_channels
+
+        cell_offsets = np.arange(n_cells) * self.cell_width
+        colors = np.ones((3 * n_cells, 4), dtype=np.float32)
+        colors[:, :3] = np.tile([COLOURS[cluster] for cluster in self.cell_clusters], (3, 1))
+        colors[n_cells:, 3] = 0.4
+        # bands are drawn beneath the means
+        zorder = np.repeat([1, 0, 0], n_cells)
+        self.waveform_lines.set_data(
+            lines=lines, offset=np.zeros(lines.shape[0]),
+            x_offset=np.repeat(np.tile(cell_offsets, 3), n_channels) + channel_offsets,
+            color=np.repeat(colors, n_channels, axis=0), zorder=np.repeat(zorder, n_channels)
+        )
+        self.waveform_lines.visible = True
+
+        self.labels.text = ["N={count}".format(**waveform_data[cluster]) for cluster in self.cell_clusters]
+        self.labels.pos = np.stack([cell_offsets + 1, np.full(n_cells, 1.)], axis=-1)
+        self.labels.visible = True
+
+        self.update_isi_view()
+        self.update_viewbox_states()
+        self.view.camera.rect = (0, -self.ISI_HEIGHT - 2 * self.CELL_GAP), (n_cells * self.cell_width, 1 + self.ISI_HEIGHT + 3 * self.CELL_GAP)
@@ -1,31 +1,161 @@
 import numpy as np
-from vispy.scene.visuals import Polygon
+from vispy.scene.visuals import Polygon, Mesh
+
+def step_vertices(x, y, bottom=-.1, out=None):
+    """Vertices of the step outline of a bar series
+
+    Parameters
+    ----------
+    x : np.ndarray
+        Bin centres of shape (n_bins,), or bin edges of shape (n_bins + 1,)
+    y : np.ndarray
+        Bar heights of shape (n_bins,)
+    bottom : float | np.ndarray, optional
+        The base of the outline, either a scalar or one value per x
+        (only the first and last are used), by default -.1
+    out : np.ndarray, optional
+        Array of shape (2 * n_bins + 2, 2) to write the vertices to
+
+    Returns
+    -------
+    np.ndarray
+        Vertices of shape (2 * n_bins + 2, 2): the bottom left corner, the
+        top left and right corner of each bar, then the bottom right corner
+
+    Raises
+    ------
+    ValueError
+        If y is not one series of heights. Many series are drawn with `BarMesh`
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y)
+    if y.ndim != 1:
+        raise ValueError(f"Bar heights must have shape (n_bins,), not {y.shape}")
+    n_bins = y.size
+    if out is None:
+        out = np.empty((2 * n_bins + 2, 2))
+    left, right = _bar_sides(x, n_bins)
+    bottom = np.broadcast_to(bottom, x.shape)
+    out[0] = left[0], bottom[0]
+    out[1:-1:2, 0] = left
+    out[2:-1:2, 0] = right
+    out[1:-1, 1] = np.repeat(y, 2)
+    out[-1] = right[-1], bottom[-1]
+    return out
+
+def _bar_sides(x, n_bins):
+    if x.size == n_bins + 1:
+        return x[:-1], x[1:]
+    width = np.diff(x)
+    width = np.append(width, width[-1])
+    return x - width / 2, x + width / 2
 
 class BarPlot(Polygon):
+    """A bar plot drawn as the polygon of its step outline
+
+    The vertices are kept in a preallocated buffer. When only the heights
+    change, with the same bins and bottom, only the heights in the buffer are
+    rewritten.
+    """
     def __init__(self, x, y, bottom=-.1, **kwargs):
-        bottom = self._get_bottoms(x, bottom)
+        self._x = None
+        self._bottom = None
+        self._vertices = None
         pos = self.get_vertices(x, y, bottom)
         kwargs['triangulate'] = False
         Polygon.__init__(self, pos=pos, **kwargs)
 
-    def _get_bottoms(self, x, bottom):
-        if np.isscalar(bottom):
-            bottom = np.repeat(bottom, x.size)
-        return bottom
-
     def set_data(self, **kwargs):
-        x = kwargs.pop('x')
+        x = kwargs.pop('x', None)
         y = kwargs.pop('y')
-        bottom = self._get_bottoms(x, kwargs.pop('bottom', -.1))
+        bottom = kwargs.pop('bottom', -.1)
+        if 'color' in kwargs:
+            self.color = kwargs.pop('color')
         self.pos = self.get_vertices(x, y, bottom)
         self._update()
 
     def get_vertices(self, x, y, bottom):
-        width = np.diff(x)
-        width = np.insert(width, -1, width[-1])
-        vertices = [(x[0]-width[0]/2, bottom[0])]
-        for xi, yi, wi in zip(x, y, width):
-            vertices.append((xi-wi/2, yi))
-            vertices.append((xi+wi/2, yi))
-        vertices.append((x[-1]+width[-1]/2, bottom[-1]))
-        return np.array(vertices)
\ No newline at end of file
+        """Vertices of the outline, reusing the buffer and the bins if they are unchanged
+
+        If x is None, the bins of the previous call are used.
+        """
+        y = np.asarray(y)
+        if y.ndim != 1:
+            raise ValueError(f"Bar heights must have shape (n_bins,), not {y.shape}")
+        if x is None:
+            x = self._x
+        n_verts = 2 * y.size + 2
+        same_bins = (
+            self._vertices is not None
+            and self._vertices.shape[0] == n_verts
+            and (x is self._x or np.array_equal(x, self._x))
+            and np.array_equal(bottom, self._bottom)
+        )
+        if same_bins:
+            self._vertices[1:-1, 1] = np.repeat(y, 2)
+            return self._vertices
+        if self._vertices is None or self._vertices.shape[0] != n_verts:
+            self._vertices = np.empty((n_verts, 2))
+        self._x = np.array(x, dtype=float)
+        self._bottom = np.array(bottom)
+        return step_vertices(self._x, y, bottom, out=self._vertices)
+
+
+class BarMesh(Mesh):
+    """Many bar series drawn as a single mesh
+
+    Every series shares the same bin edges and is placed at its own (x, y)
+    offset, so a whole matrix of histograms is drawn in one draw call. The
+    vertex and face buffers are only reallocated when the number of series
+    or bins changes.
+    """
+    def __init__(self, **kwargs):
+        Mesh.__init__(self, **kwargs)
+        # the node is frozen by Mesh, and MeshVisual uses _vertices for its vertex buffer
+        self.unfreeze()
+        self._bar_vertices = None
+        self._bar_faces = None
+        self._bar_shape = None
+        self.freeze()
+
+    def _allocate(self, n_series, n_bins):
+        n_quads = n_series * n_bins
+        self._bar_vertices = np.zeros((n_quads, 4, 2), dtype=np.float32)
+        quad_faces = np.array([[0, 1, 2], [0, 2, 3]], dtype=np.uint32)
+        self._bar_faces = (quad_faces[np.newaxis] + 4 * np.arange(n_quads, dtype=np.uint32)[:, np.newaxis, np.newaxis]).reshape(-1, 3)
+        self._bar_shape = (n_series, n_bins)
+
+    def set_data(self, edges, y, offsets, colors, bottom=0.):
+        """Set the bars of all series
+
+        Parameters
+        ----------
+        edges : np.ndarray
+            Bin edges of shape (n_bins + 1,), shared by all series
+        y : np.ndarray
+            Bar heights of shape (n_series, n_bins)
+        offsets : np.ndarray
+            The (x, y) offset of each series, of shape (n_series, 2)
+        colors : np.ndarray
+            RGBA colour of each series, of shape (n_series, 4)
+        bottom : float, optional
+            The base of the bars, by default 0.
+        """
+        y = np.atleast_2d(y)
+        n_series, n_bins = y.shape
+        if n_series == 0:
+            self.visible = False
+            return
+        self.visible = True
+        if self._bar_shape != (n_series, n_bins):
+            self._allocate(n_series, n_bins)
+        offsets = np.asarray(offsets, dtype=np.float32)
+        vertices = self._bar_vertices.reshape(n_series, n_bins, 4, 2)
+        left, right = edges[:-1], edges[1:]
+        vertices[..., 0] = np.stack([left, right, right, left], axis=-1)
+        vertices[..., 0] += offsets[:, np.newaxis, np.newaxis, 0]
+        vertices[..., 1] = bottom
+        vertices[:, :, 2:, 1] = y[..., np.newaxis]
+        vertices[..., 1] += offsets[:, np.newaxis, np.newaxis, 1]
+        vertex_colors = np.repeat(np.asarray(colors, dtype=np.float32), n_bins * 4, axis=0)
+        Mesh.set_data(self, vertices=self._bar_vertices.reshape(-1, 2), faces=self._bar_faces, vertex_colors=vertex_colors)
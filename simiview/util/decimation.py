@@ -0,0 +1,80 @@
+import numpy as np
+
+def lod_level(data_per_pixel, full_resolution=1.):
+    """The level of detail for a view showing `data_per_pixel` units per pixel
+
+    Levels are powers of two, so the traces are only decimated again when
+    zooming in or out by a factor of two, not while panning. Returns None
+    when the view shows no more than `full_resolution` units per pixel, or
+    has no size yet, in which case the traces are drawn at full resolution.
+    """
+    if not np.isfinite(data_per_pixel) or data_per_pixel <= full_resolution:
+        return None
+    return float(2 ** np.floor(np.log2(data_per_pixel)))
+
+def minmax_envelope(lines, bin_size):
+    """The min/max envelope of time traces, with one bin per `bin_size` samples
+
+    Drawn as a line, the minimum and maximum of each bin form a vertical
+    segment, so the envelope covers the same pixels as the full traces.
+
+    Parameters
+    ----------
+    lines : np.ndarray
+        Array of shape (n_lines, n_points)
+    bin_size : int
+
+    Returns
+    -------
+    x : np.ndarray
+        The sample at which each point is drawn, of shape (2 * n_bins,)
+    envelope : np.ndarray
+        Array of shape (n_lines, 2 * n_bins), the minimum and maximum of each bin in turn
+    """
+    bin_size = max(int(bin_size), 1)
+    n_lines, n_points = lines.shape
+    n_bins = -(-n_points // bin_size)
+    if n_bins * bin_size != n_points:
+        # the last bin is padded with its last sample
+        lines = np.pad(lines, ((0, 0), (0, n_bins * bin_size - n_points)), mode='edge')
+    bins = lines.reshape(n_lines, n_bins, bin_size)
+    envelope = np.empty((n_lines, n_bins, 2), dtype=lines.dtype)
+    np.min(bins, axis=-1, out=envelope[..., 0])
+    np.max(bins, axis=-1, out=envelope[..., 1])
+    centres = np.minimum(np.arange(n_bins) * bin_size + (bin_size - 1) / 2, n_points - 1)
+    return np.repeat(centres, 2), envelope.reshape(n_lines, 2 * n_bins)
+
+def simplify_paths(paths, cell_size):
+    """Simplify 2D paths by dropping vertices in the same grid cell as the one before
+
+    On a grid of `cell_size`, e.g. a pixel, consecutive vertices within a
+    cell draw nothing new, so only the first of each run is kept (and the
+    last vertex of each path). Paths are padded to the same number of
+    vertices by repeating their last vertex, which draws nothing.
+
+    Parameters
+    ----------
+    paths : np.ndarray
+        Array of shape (n_paths, n_points, 2)
+    cell_size : float
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (n_paths, n_kept, 2), with n_kept the most vertices kept of any path
+    """
+    n_paths, n_points, _ = paths.shape
+    if n_points < 3:
+        return paths
+    with np.errstate(invalid='ignore'):
+        cells = np.floor(paths / cell_size)
+    keep = np.empty((n_paths, n_points), dtype=bool)
+    keep[:, 0] = True
+    np.any(cells[:, 1:] != cells[:, :-1], axis=-1, out=keep[:, 1:])
+    keep[:, -1] = True
+    # the position of each kept vertex in its simplified path
+    rank = np.cumsum(keep, axis=1) - 1
+    simplified = np.repeat(paths[:, -1:], rank[:, -1].max() + 1, axis=1)
+    rows, _ = np.nonzero(keep)
+    simplified[rows, rank[keep]] = paths[keep]
+    return simplified
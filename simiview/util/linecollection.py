@@ -1,14 +1,159 @@
+import threading
+
 import numpy as np
 import numpy.typing as npt
 from vispy.scene.visuals import Line
 
-class PathCollection(Line):
+from simiview.util.spatial_index import GridIndex
+
+def sort_colors(kwargs, idx, n_lines, n_points):
+    """Expand per-line or per-vertex colours in `kwargs` to sorted vertex colours, in place"""
+    # define and sort color array if provided either per-line or per-vertex
+    if 'vertex_colors' in kwargs and 'color' in kwargs:
+        raise ValueError("Cannot specify both 'vertex_colors' and 'color")
+    if 'vertex_colors' in kwargs:
+        vert_colors = kwargs.pop('vertex_colors')
+        n_color_dims = vert_colors.shape[-1]
+        vert_colors = vert_colors.reshape(n_lines, n_points, n_color_dims)
+        vert_colors = vert_colors[idx].reshape(-1, n_color_dims)
+        kwargs['color'] = vert_colors
+    if 'color' in kwargs:
+        kwargs['color'] = np.repeat(kwargs['color'][idx], n_points, axis=0)
+    # optionally apply alpha values to color array if provided
+    if 'alpha' in kwargs:
+        alpha = kwargs.pop('alpha')
+        alpha = np.repeat(alpha[idx], n_points)
+        kwargs['color'][:, 3] = alpha
+
+class ClosestLines:
+    """Picking of the lines of a collection nearest a position
+
+    The vertices are indexed on a uniform grid (see `GridIndex`), built on a
+    background thread whenever `set_data` changes them. Until the index of
+    the current vertices is ready, queries scan every vertex instead.
+    """
+    def _init_spatial_index(self):
+        # (generation, GridIndex) of the last index built
+        self._spatial_index = None
+        self._index_generation = 0
+        self._index_request = None
+        self._index_thread = None
+        self._index_lock = threading.Lock()
+
+    def _request_spatial_index(self, pos, labels):
+        """Index the vertices `pos` of the lines `labels` in the background, replacing any pending request"""
+        with self._index_lock:
+            self._index_generation += 1
+            self._index_request = (self._index_generation, pos, labels)
+            if self._index_thread is None:
+                self._index_thread = threading.Thread(target=self._build_spatial_indices, name='GridIndex', daemon=True)
+                self._index_thread.start()
+
+    def _build_spatial_indices(self):
+        while True:
+            with self._index_lock:
+                request, self._index_request = self._index_request, None
+                if request is None:
+                    self._index_thread = None
+                    return
+            generation, pos, labels = request
+            self._spatial_index = (generation, GridIndex(pos, labels))
+
+    def _current_spatial_index(self) -> GridIndex | None:
+        """The index of the current vertices, or None while it is being built"""
+        built = self._spatial_index
+        if built is None or built[0] != self._index_generation:
+            return None
+        return built[1]
+
+    def get_spatial_index(self) -> GridIndex:
+        """The index of the current vertices, built now if it is not ready"""
+        index = self._current_spatial_index()
+        if index is None:
+            with self._index_lock:
+                generation = self._index_generation
+            index = GridIndex(self.get_pos(), np.repeat(np.arange(self.n_lines), self.n_points))
+            self._spatial_index = (generation, index)
+        return index
+
+    def _scan_closest_lines(self, position, k):
+        """`get_closest_lines`, by the distance to every vertex"""
+        distances = np.linalg.norm(self.get_pos() - position, axis=1).reshape(self.n_lines, self.n_points)
+        distances = np.where(np.isfinite(distances), distances, np.inf).min(axis=1, initial=np.inf)
+        lines = np.argsort(distances, kind='stable')[:k]
+        return lines[np.isfinite(distances[lines])]
+
+    def get_closest_lines(self, position: np.ndarray, k: int = 1) -> np.ndarray:
+        """
+        Get the indices of the k lines closest to a given position.
+
+        Parameters
+        ----------
+        position (np.ndarray):  
+            A 1D array containing the (x, y) position to search for.
+        k (int):  
+            The number of lines to return.
+
+        Returns
+        -------
+        np.ndarray: The indices of up to k lines, closest first.
+        """
+        position = np.asarray(position, dtype=float)[:2]
+        index = self._current_spatial_index()
+        if index is None:
+            return self._scan_closest_lines(position, k)
+        lines, _ = index.nearest(position, k)
+        return lines
+
+    def get_closest_line(self, position : np.ndarray) -> int:
+        """
+        Get the index of the line closest to a given position.
+
+        Parameters
+        ----------
+        position (np.ndarray):  
+            A 1D array containing the (x, y) position to search for.
+
+        Returns
+        -------
+        int: The index of the closest line.
+        """
+        return int(self.get_closest_lines(position, 1)[0])
+    
+    def get_closest_line_from_mouse_event(self, event) -> int:
+        """
+        Get the index of the line closest to a given mouse event.
+
+        Parameters
+        ----------
+        event (MouseEvent):  
+            A MouseEvent object containing the mouse position.
+
+        Returns
+        -------
+        int: The index of the closest line.
+        """
+        # Get the position of the mouse event 
+        # and transform to visual coordinates
+        pos = self.get_transform('canvas', 'visual').map(event.pos)[:2]
+
+        # Find the index of the line closest to the mouse position
+        return self.get_closest_line(pos)
+
+    def get_closest_lines_from_mouse_event(self, event, k: int = 1) -> np.ndarray:
+        """The indices of the k lines closest to a mouse event, closest first"""
+        pos = self.get_transform('canvas', 'visual').map(event.pos)[:2]
+        return self.get_closest_lines(pos, k)
+
+class PathCollection(ClosestLines, Line):
     def __init__(self, **kwargs):
         if 'pos' in kwargs:
             raise ValueError
         if 'connect' in kwargs:
             raise ValueError
         self.paths = None
+        self.line_order = None
+        self._init_spatial_index()
         Line.__init__(self)
         if 'paths' in kwargs:
             self.set_data(**kwargs)
@@ -64,38 +209,42 @@ class PathCollection(Line):
         # sort lines and convert to vertex position array
         kwargs['pos'] = self.get_pos(idx)
 
-        # define and sort color array if provided either per-line or per-vertex
-        if 'vertex_colors' in kwargs and 'color' in kwargs:
-            raise ValueError("Cannot specify both 'vertex_colors' and 'color")
-        if 'vertex_colors' in kwargs:
-            vert_colors = kwargs.pop('vertex_colors')
-            n_color_dims = vert_colors.shape[-1]
-            vert_colors = vert_colors.reshape(self.n_lines, self.n_points, n_color_dims)
-            vert_colors = vert_colors[idx].reshape(-1, n_color_dims)
-            kwargs['color'] = vert_colors
-        if 'color' in kwargs:
-            kwargs['color'] = np.repeat(kwargs['color'][idx], self.n_points, axis=0)
-        # optionally apply alpha values to color array if provided
-        if 'alpha' in kwargs:
-            alpha = kwargs.pop('alpha')
-            alpha = np.repeat(alpha[idx], self.n_points)
-            kwargs['color'][:, 3] = alpha
+        self.line_order = idx
+        # the vertices are in the order of `idx`
+        self._request_spatial_index(kwargs['pos'], np.repeat(idx, self.n_points))
+        sort_colors(kwargs, idx, self.n_lines, self.n_points)
 
         return super().set_data(**kwargs)
 
-class LineCollection(Line):
+    def set_colors(self, **kwargs):
+        """Update only the colours of the lines, keeping their positions and z-order
+
+        Takes the 'color', 'vertex_colors' and 'alpha' arguments of
+        `set_data`, in the original order of the lines. The vertex positions
+        are not regenerated or uploaded again, so this is much cheaper than
+        `set_data` for e.g. highlighting a selection.
+        """
+        sort_colors(kwargs, self.line_order, self.n_lines, self.n_points)
+        return super().set_data(**kwargs)
+
+class LineCollection(ClosestLines, Line):
     def __init__(self, **kwargs):
         if 'pos' in kwargs:
             raise ValueError
         if 'connect' in kwargs:
             raise ValueError
         self.lines = None
+        self.line_order = None
+        self._init_spatial_index()
         self.offset = kwargs.pop('offset', 0)
+        self.x_offset = kwargs.pop('x_offset', 0)
+        # the x-coordinate of each point, shared by all lines, by default its index
+        self.x = kwargs.pop('x', None)
         Line.__init__(self)
         if 'lines' in kwargs:
             self.set_data(**kwargs)
 
-    def get_pos(self, offset: npt.NDArray | None = None, idx: npt.NDArray | None = None) -> np.ndarray:
+    def get_pos(self, offset: npt.NDArray | None = None, idx: npt.NDArray | None = None, x_offset: npt.NDArray | None = None) -> np.ndarray:
         """
         Generate (x, y) positions for points in multiple lines with an offset applied.
 
@@ -107,6 +256,8 @@ class LineCollection(Line):
             An offset array of shape (n_lines,) or a scalar to be applied to each line.  
         idx (np.ndarray):
             An array of indices to sort the lines by.
+        x_offset (Union[np.ndarray, float, int]):
+            An array of shape (n_lines,) or a scalar added to the x-coordinates of each line.
 
         Returns
         -------
@@ -116,6 +267,8 @@ class LineCollection(Line):
         lines = self.lines
         if offset is None:
             offset = self.offset
+        if x_offset is None:
+            x_offset = self.x_offset
 
         if lines.ndim != 2:
             raise ValueError("Lines must be a 2D array")
@@ -134,7 +287,13 @@ class LineCollection(Line):
             lines_with_offset = lines_with_offset[idx]
 
         # Generate x-coordinates
-        x_coords = np.broadcast_to(np.arange(self.n_points), lines.shape)
+        x_coords = np.broadcast_to(np.arange(self.n_points) if self.x is None else self.x, lines.shape)
+        if not np.isscalar(x_offset):
+            if x_offset.shape != (self.n_lines,):
+                raise ValueError("x_offset must be a scalar or an array with shape (n_lines,)")
+            x_offset = x_offset[:, np.newaxis] if idx is None else x_offset[idx, np.newaxis]
+        if np.any(x_offset):
+            x_coords = x_coords + x_offset
 
         # Stack x and y coordinates
         positions = np.stack([x_coords, lines_with_offset], axis=-1).reshape(-1, 2)
@@ -158,7 +317,10 @@ class LineCollection(Line):
 
     def set_data(self, **kwargs):
         zorder = kwargs.pop('zorder', None)
-        offset = kwargs.pop('offset', self.offset)
+        self.offset = offset = kwargs.pop('offset', self.offset)
+        self.x_offset = x_offset = kwargs.pop('x_offset', self.x_offset)
+        # new lines are drawn at their indices, unless given x-coordinates
+        self.x = kwargs.pop('x', None if 'lines' in kwargs else self.x)
 
         if 'lines' in kwargs:
             self.lines = kwargs.pop('lines')
@@ -170,64 +332,22 @@ class LineCollection(Line):
         idx = np.argsort(-zorder)
 
         # sort lines and convert to vertex position array
-        kwargs['pos'] = self.get_pos(offset, idx)
-
-        # define and sort color array if provided either per-line or per-vertex
-        if 'vertex_colors' in kwargs and 'color' in kwargs:
-            raise ValueError("Cannot specify both 'vertex_colors' and 'color")
-        if 'vertex_colors' in kwargs:
-            vert_colors = kwargs.pop('vertex_colors')
-            n_color_dims = vert_colors.shape[-1]
-            vert_colors = vert_colors.reshape(self.n_lines, self.n_points, n_color_dims)
-            vert_colors = vert_colors[idx].reshape(-1, n_color_dims)
-            kwargs['color'] = vert_colors
-        if 'color' in kwargs:
-            kwargs['color'] = np.repeat(kwargs['color'][idx], self.n_points, axis=0)
-        # optionally apply alpha values to color array if provided
-        if 'alpha' in kwargs:
-            alpha = kwargs.pop('alpha')
-            alpha = np.repeat(alpha[idx], self.n_points)
-            kwargs['color'][:, 3] = alpha
+        kwargs['pos'] = self.get_pos(offset, idx, x_offset)
 
-        return super().set_data(**kwargs)
-    
-    def get_closest_line(self, position : np.ndarray) -> int:
-        """
-        Get the index of the line closest to a given position.
-
-        Parameters
-        ----------
-        position (np.ndarray):  
-            A 1D array containing the (x, y) position to search for.
-
-        Returns
-        -------
-        int: The index of the closest line.
-        """
-        # Calculate the distance between the position and each line
-        pos = self.get_pos()
-        distances = np.linalg.norm(pos - position, axis=1)
-        idx = int(np.argmin(distances) // self.n_points)
+        self.line_order = idx
+        # the vertices are in the order of `idx`
+        self._request_spatial_index(kwargs['pos'], np.repeat(idx, self.n_points))
+        sort_colors(kwargs, idx, self.n_lines, self.n_points)
 
-        # Return the index of the line with the smallest distance
-        return idx
-    
-    def get_closest_line_from_mouse_event(self, event) -> int:
-        """
-        Get the index of the line closest to a given mouse event.
+        return super().set_data(**kwargs)
 
-        Parameters
-        ----------
-        event (MouseEvent):  
-            A MouseEvent object containing the mouse position.
+    def set_colors(self, **kwargs):
+        """Update only the colours of the lines, keeping their positions and z-order
 
-        Returns
-        -------
-        int: The index of the closest line.
+        Takes the 'color', 'vertex_colors' and 'alpha' arguments of
+        `set_data`, in the original order of the lines. The vertex positions
+        are not regenerated or uploaded again, so this is much cheaper than
+        `set_data` for e.g. highlighting a selection.
         """
-        # Get the position of the mouse event 
-        # and transform to visual coordinates
-        pos = self.get_transform('canvas', 'visual').map(event.pos)[:2]
-
-        # Find the index of the line closest to the mouse position
-        return self.get_closest_line(pos)
\ No newline at end of file
+        sort_colors(kwargs, self.line_order, self.n_lines, self.n_points)
+        return super().set_data(**kwargs)
@@ -0,0 +1,210 @@
+"""Timing of named spans of code
+
+Spans are timed with the module-level `profiler`:
+
+    from simiview.util.profiling import profiler, profile
+
+    with profiler.span('load_data'):
+        ...
+
+    @profile('get_colors')
+    def get_colors(self):
+        ...
+
+While the profiler is disabled (the default), a span costs one attribute
+check. Once enabled, the duration of every span is recorded, and can be
+summarised as percentiles, or exported as JSON or as a Chrome trace, which
+can be opened in chrome://tracing or https://ui.perfetto.dev. The entry
+points enable it with `--profile`, alongside `-v`, and on exit export the
+profile and log its summary.
+"""
+from collections import deque
+import functools
+import json
+import os
+import random
+import threading
+import time
+
+import numpy as np
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, self.start, time.perf_counter())
+        return False
+
+class _SpanStats:
+    """The count, total and max of a span's durations, and a uniform sample of them for percentiles"""
+    __slots__ = ('count', 'total', 'max', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+        self.samples = []
+
+    def add(self, duration, max_samples, rng):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        if len(self.samples) < max_samples:
+            self.samples.append(duration)
+        else:
+            # reservoir sampling: each duration so far is kept with the same probability
+            index = rng.randrange(self.count)
+            if index < max_samples:
+                self.samples[index] = duration
+
+class Profiler:
+    """Records the durations of named spans
+
+    Parameters
+    ----------
+    max_events : int, optional
+        The number of most recent spans kept for the Chrome trace, by default 1e6
+    max_samples : int, optional
+        The number of durations of each span kept for its percentiles, by default 1e4.
+        Counts, totals and maxima cover every span
+    """
+    def __init__(self, max_events=1_000_000, max_samples=10_000):
+        self.enabled = False
+        self.max_samples = max_samples
+        self.stats = {}
+        self.events = deque(maxlen=max_events)
+        self._rng = random.Random(0)
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}
+            self.events.clear()
+            self._origin = time.perf_counter()
+
+    def span(self, name):
+        """A context manager timing the code it wraps as the span `name`"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def record(self, name, start, stop):
+        """Record a span from its start and stop times, as given by time.perf_counter"""
+        with self._lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = _SpanStats()
+            stats.add(stop - start, self.max_samples, self._rng)
+            self.events.append((name, start, stop, threading.get_ident()))
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """Statistics of each span's durations, in seconds
+
+        Returns
+        -------
+        dict
+            For each span, its count, total, mean, max and the given percentiles (as 'p50', ...).
+            Percentiles are estimated from a sample of at most `max_samples` durations
+        """
+        with self._lock:
+            spans = {
+                name: (stats.count, stats.total, stats.max, np.array(stats.samples))
+                for name, stats in self.stats.items()
+            }
+        summary = {}
+        for name, (count, total, max_duration, samples) in spans.items():
+            stats = {
+                'count': count,
+                'total': total,
+                'mean': total / count,
+                'max': max_duration,
+            }
+            for q, value in zip(percentiles, np.percentile(samples, percentiles)):
+                stats[f'p{q}'] = float(value)
+            summary[name] = stats
+        return dict(sorted(summary.items(), key=lambda item: item[1]['total'], reverse=True))
+
+    def format_summary(self):
+        lines = [f"{'span':<32} {'count':>8} {'total ms':>10} {'mean ms':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+        for name, stats in self.summary().items():
+            lines.append(
+                f"{name:<32} {stats['count']:>8} {stats['total'] * 1e3:>10.1f} {stats['mean'] * 1e3:>9.2f} "
+                f"{stats['p50'] * 1e3:>9.2f} {stats['p90'] * 1e3:>9.2f} {stats['p99'] * 1e3:>9.2f} {stats['max'] * 1e3:>9.2f}"
+            )
+        return '\n'.join(lines)
+
+    def export_json(self, path):
+        """Write the summary of all spans to a JSON file"""
+        with open(path, 'w') as file:
+            json.dump(self.summary(), file, indent=2)
+
+    def export_chrome_trace(self, path):
+        """Write the recorded spans to a file in the Chrome trace event format"""
+        pid = os.getpid()
+        with self._lock:
+            events = list(self.events)
+            origin = self._origin
+        trace = [
+            {
+                'name': name,
+                'ph': 'X',
+                'ts': (start - origin) * 1e6,
+                'dur': (stop - start) * 1e6,
+                'pid': pid,
+                'tid': tid,
+            }
+            for name, start, stop, tid in events
+        ]
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, file)
+
+    def export(self, path, logger=None):
+        """Write the summary to `path` and the Chrome trace beside it, as `<stem>.trace.json`
+
+        The summary is also logged at info level if a logger is given.
+        """
+        path = str(path)
+        stem = path[:-len('.json')] if path.endswith('.json') else path
+        self.export_json(stem + '.json')
+        self.export_chrome_trace(stem + '.trace.json')
+        if logger is not None:
+            logger.info("Profile of %s spans written to %s\n%s", len(self.stats), stem + '.json', self.format_summary())
+
+profiler = Profiler()
+
+def profile(name=None):
+    """Decorator timing each call of a function as a span, by default named by its qualified name"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+            with _Span(profiler, span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
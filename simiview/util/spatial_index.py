@@ -0,0 +1,127 @@
+import numpy as np
+
+class GridIndex:
+    """A uniform grid over labelled 2D points, for finding the labels nearest a position
+
+    The points are sorted by cell, so the points of a column of cells are
+    contiguous. A query searches squares of cells around the position,
+    doubling their size until the k nearest labels found are closer than
+    any point outside the square, so its cost depends on the density of
+    points near the position rather than on the number of points. Far from
+    the points, where a square would take in most of them, the occupied
+    cells are searched nearest first instead.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        Array of shape (n_points, 2). Points that are not finite are ignored
+    labels : np.ndarray
+        The label of each point, e.g. the line it belongs to
+    points_per_cell : int, optional
+        The average number of points per cell, by default 8
+    """
+    # the most points gathered from a square, before searching cells nearest first
+    max_square_points = 4096
+
+    def __init__(self, points, labels, points_per_cell=8):
+        points = np.asarray(points, dtype=float)
+        labels = np.asarray(labels)
+        finite = np.isfinite(points).all(axis=1)
+        points, labels = points[finite], labels[finite]
+        self.n_points = points.shape[0]
+        if self.n_points:
+            self.origin = points.min(axis=0)
+            extent = points.max(axis=0) - self.origin
+        else:
+            self.origin, extent = np.zeros(2), np.zeros(2)
+        # square cells, so the squares searched are as small as possible
+        area = np.prod(np.where(extent > 0, extent, extent.max()))
+        cell_size = np.sqrt(area * points_per_cell / max(self.n_points, 1))
+        self.cell_size = cell_size if cell_size > 0 else 1.
+        self.shape = tuple(np.floor(extent / self.cell_size).astype(int) + 1)
+        cells = self._cells(points)
+        keys = cells[:, 0] * self.shape[1] + cells[:, 1]
+        order = np.argsort(keys, kind='stable')
+        self.points = points[order]
+        self.labels = labels[order]
+        # the points of cell `key` are points[starts[key]:starts[key + 1]]
+        self.starts = np.concatenate([[0], np.cumsum(np.bincount(keys, minlength=self.shape[0] * self.shape[1]))])
+        self.occupied = np.flatnonzero(np.diff(self.starts))
+        self.occupied_corners = self.origin + self.cell_size * np.column_stack(
+            [self.occupied // self.shape[1], self.occupied % self.shape[1]]
+        )
+
+    def _cells(self, points):
+        with np.errstate(invalid='ignore'):
+            cells = np.floor((points - self.origin) / self.cell_size)
+        return np.clip(cells, 0, np.array(self.shape) - 1).astype(np.intp)
+
+    def _gather(self, start, stop):
+        """The indices of the points in the ranges [start, stop) of the sorted points"""
+        counts = stop - start
+        first = np.cumsum(counts) - counts
+        return np.arange(counts.sum()) - np.repeat(first - start, counts)
+
+    def _points_in(self, lower, upper):
+        """The start and stop of the points of each column of the cells from `lower` to `upper`, inclusive"""
+        n_rows = self.shape[1]
+        columns = np.arange(lower[0], upper[0] + 1)
+        return self.starts[columns * n_rows + lower[1]], self.starts[columns * n_rows + upper[1] + 1]
+
+    def _nearest_labels(self, idx, position, k):
+        """The k labels of the points `idx` nearest to `position`, and their distances"""
+        distances = np.linalg.norm(self.points[idx] - position, axis=1)
+        # the nearest point of each label, nearest first
+        order = np.argsort(distances, kind='stable')
+        labels, first = np.unique(self.labels[idx][order], return_index=True)
+        by_distance = np.argsort(first, kind='stable')[:k]
+        return labels[by_distance], distances[order][first[by_distance]]
+
+    def nearest(self, position, k=1):
+        """The k labels with the points nearest to `position`
+
+        Returns
+        -------
+        labels : np.ndarray
+            Up to k labels, nearest first, or none if the position is not finite
+        distances : np.ndarray
+            The distance from `position` to the nearest point of each label
+        """
+        position = np.asarray(position, dtype=float)[:2]
+        if self.n_points == 0 or k <= 0 or not np.isfinite(position).all():
+            return self.labels[:0], np.zeros(0)
+        last = np.array(self.shape) - 1
+        centre = self._cells(position[np.newaxis])[0]
+        radius = 1
+        while True:
+            lower = np.maximum(centre - radius, 0)
+            upper = np.minimum(centre + radius, last)
+            start, stop = self._points_in(lower, upper)
+            if (stop - start).sum() > self.max_square_points:
+                return self._nearest_cells_first(position, k)
+            labels, distances = self._nearest_labels(self._gather(start, stop), position, k)
+            # every point outside the square is further than this; there are
+            # no points beyond the edges of the grid
+            below = np.where(lower > 0, position - (self.origin + lower * self.cell_size), np.inf)
+            above = np.where(upper < last, self.origin + (upper + 1) * self.cell_size - position, np.inf)
+            bound = min(below.min(), above.min())
+            if bound == np.inf or (labels.size == k and distances[-1] <= bound):
+                return labels, distances
+            radius *= 2
+
+    def _nearest_cells_first(self, position, k):
+        """`nearest`, searching the occupied cells in order of their distance from `position`"""
+        # the distance from the position to the nearest point of each cell
+        gap = np.maximum(self.occupied_corners - position, position - (self.occupied_corners + self.cell_size))
+        cell_distances = np.linalg.norm(np.maximum(gap, 0), axis=1)
+        n_cells = 4 * k
+        while True:
+            if n_cells >= self.occupied.size:
+                cells, bound = self.occupied, np.inf
+            else:
+                partition = np.argpartition(cell_distances, n_cells)
+                cells, bound = self.occupied[partition[:n_cells]], cell_distances[partition[n_cells]]
+            labels, distances = self._nearest_labels(self._gather(self.starts[cells], self.starts[cells + 1]), position, k)
+            if bound == np.inf or (labels.size == k and distances[-1] <= bound):
+                return labels, distances
+            n_cells *= 4
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('vispy')
+pytest.importorskip('simianpy')
+
+from simiview.spikesort.app import SpikeSortApp
+from simiview.util.linecollection import LineCollection
+
+class FakeApp:
+    get_colors = SpikeSortApp.get_colors
+    update_colors = SpikeSortApp.update_colors
+    update_active_lines = SpikeSortApp.update_active_lines
+
+    def __init__(self, waveforms, clusters):
+        self.waveforms = waveforms
+        self.points = np.zeros((waveforms.shape[0], 3))
+        self.clusters = clusters
+        self.n_channels = 1
+        self.active_cluster = 0
+        self.active_point = None
+        self.lines = LineCollection(lines=waveforms)
+        self.active_lines = LineCollection()
+        self._lines_zorder = None
+
+def test_hover_updates_colors_without_sorting():
+    rng = np.random.default_rng(0)
+    app = FakeApp(rng.normal(size=(20, 30)), rng.integers(0, 3, 20))
+    sorts = []
+    set_data = app.lines.set_data
+    app.lines.set_data = lambda **kwargs: sorts.append(kwargs) or set_data(**kwargs)
+    app.update_colors()
+    assert len(sorts) == 1
+    app.active_point = 4
+    app.update_colors()
+    app.active_point = 7
+    app.update_colors()
+    # hovering only changes colours, and draws the hovered waveform on top
+    assert len(sorts) == 1
+    assert app.active_lines.visible
+    assert np.array_equal(app.active_lines.lines, app.waveforms[[7]])
+    # a new active cluster changes the z-order
+    app.active_cluster = 2
+    app.update_colors()
+    assert len(sorts) == 2
+    order = app.lines.line_order
+    assert np.all(app.clusters[order[:np.sum(app.clusters == 2)]] == 2)
+    app.active_point = None
+    app.update_colors()
+    assert not app.active_lines.visible
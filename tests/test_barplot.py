@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('vispy')
+
+from simiview.util.barplot import BarPlot, step_vertices
+
+def loop_vertices(x, y, bottom):
+    width = np.diff(x)
+    width = np.insert(width, -1, width[-1])
+    vertices = [(x[0] - width[0] / 2, bottom[0])]
+    for xi, yi, wi in zip(x, y, width):
+        vertices.append((xi - wi / 2, yi))
+        vertices.append((xi + wi / 2, yi))
+    vertices.append((x[-1] + width[-1] / 2, bottom[-1]))
+    return np.array(vertices)
+
+def test_step_vertices_matches_the_loop():
+    x = np.arange(6.) * 0.5
+    y = np.array([1., 3., 0., 2., 5., 4.])
+    bottom = np.linspace(-1, 0, 6)
+    assert np.allclose(step_vertices(x, y, bottom), loop_vertices(x, y, bottom))
+    # bin edges give the same outline as their centres
+    edges = np.arange(7.) * 0.5 - 0.25
+    assert np.allclose(step_vertices(edges, y, 0.), loop_vertices(x, y, np.zeros(6)))
+    with pytest.raises(ValueError):
+        step_vertices(x, np.ones((2, 6)))
+
+def test_bar_plot_reuses_its_buffer():
+    x = np.arange(5.)
+    bars = BarPlot(x, np.ones(5))
+    buffer = bars._vertices
+    y = np.arange(5.)
+    bars.set_data(y=y)
+    assert bars._vertices is buffer
+    assert np.allclose(bars.pos, loop_vertices(x, y, np.full(5, -.1)))
+    bars.set_data(x=np.arange(3.), y=np.ones(3), bottom=0.)
+    assert np.allclose(bars.pos, loop_vertices(np.arange(3.), np.ones(3), np.zeros(3)))
+    with pytest.raises(ValueError):
+        bars.set_data(y=np.ones((2, 3)))
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('vispy')
+from vispy.scene import Widget
+
+from simiview.util.barplot import BarMesh
+from simiview.spikesort.ccg_view_manager import CCGViewManager
+
+class FakeClusterIndex:
+    def __init__(self, cluster_ids):
+        self.cluster_ids = cluster_ids
+
+    def get_sorted_cluster_ids(self):
+        return self.cluster_ids
+
+class FakeApp:
+    def __init__(self, cluster_ids):
+        self.cluster_index = FakeClusterIndex(cluster_ids)
+
+def test_bar_mesh_set_data():
+    bars = BarMesh()
+    edges = np.linspace(-1, 1, 6)
+    bars.set_data(edges, np.ones((3, 5)), np.zeros((3, 2)), np.ones((3, 4)))
+    assert bars._bar_shape == (3, 5)
+    # the buffers are reused for the same shape, and reallocated for a new one
+    bars.set_data(edges, 2 * np.ones((3, 5)), np.zeros((3, 2)), np.ones((3, 4)))
+    bars.set_data(edges[:3], np.ones((1, 2)), np.zeros((1, 2)), np.ones((1, 4)))
+    assert bars._bar_shape == (1, 2)
+    bars.set_data(edges, np.ones((0, 5)), np.zeros((0, 2)), np.ones((0, 4)))
+    assert not bars.visible
+
+def test_ccg_view_manager_draws_cells():
+    manager = CCGViewManager(FakeApp([1, 2]), Widget())
+    manager.update_ccg_grid()
+    assert set(manager.cells) == {(1, 1), (2, 2), (1, 2)}
+    n_bins = 2 * int(manager.MAX_LAG / manager.BIN_SIZE)
+    ccg = {pair: np.arange(n_bins, dtype=float) for pair in manager.cells}
+    manager._set_ccgs(np.linspace(-manager.MAX_LAG, manager.MAX_LAG, n_bins), ccg)
+    assert manager.bars._bar_shape == (3, n_bins)
@@ -0,0 +1,21 @@
+import pytest
+
+from simiview.spikesort.__main__ import build_parser
+
+@pytest.mark.parametrize('argv', [
+    ['--profile', 'detect', 'rec.rec'],
+    ['detect', 'rec.rec', '--profile'],
+])
+def test_profile_does_not_take_the_command(argv):
+    args = build_parser().parse_args(argv)
+    assert args.command == 'detect'
+    assert args.file == 'rec.rec'
+    assert args.profile
+    assert args.profile_out == 'spikesort_profile.json'
+
+def test_profile_out():
+    args = build_parser().parse_args(['assign', 'rec.rec', '--profile', '--profile-out', 'out.json'])
+    assert args.profile and args.profile_out == 'out.json'
+    args = build_parser().parse_args(['--profile'])
+    assert args.command is None and args.profile
+    assert not build_parser().parse_args([]).profile
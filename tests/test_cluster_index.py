@@ -0,0 +1,63 @@
+import numpy as np
+
+from simiview.spikesort.cluster_index import ClusterIndex
+from simiview.spikesort.isi import isi_histogram, log_bins
+
+def test_indices_are_sorted_by_time():
+    rng = np.random.default_rng(0)
+    clusters = rng.integers(-1, 4, 200)
+    timestamps = rng.permutation(200).astype(float)
+    index = ClusterIndex()
+    index.update(clusters, timestamps)
+    assert sorted(index.cluster_ids) == [-1, 0, 1, 2, 3]
+    assert index.get_sorted_cluster_ids() == [1, 2, 3]
+    for cluster in index.cluster_ids:
+        assert np.array_equal(index.times(cluster), np.sort(timestamps[clusters == cluster]))
+
+def test_only_edited_clusters_are_recomputed():
+    rng = np.random.default_rng(1)
+    clusters = rng.integers(1, 4, 100)
+    timestamps = np.arange(100.)
+    index = ClusterIndex()
+    index.update(clusters, timestamps)
+    calls = []
+    def compute(cluster):
+        return index.cached('count', cluster, lambda idx: calls.append(cluster) or idx.size)
+    for cluster in [1, 2, 3]:
+        compute(cluster)
+    # move a spike from cluster 1 to cluster 2, leaving cluster 3 unchanged
+    spike = np.flatnonzero(clusters == 1)[0]
+    clusters[spike] = 2
+    index.update(clusters, timestamps)
+    calls.clear()
+    counts = {cluster: compute(cluster) for cluster in [1, 2, 3]}
+    assert sorted(calls) == [1, 2]
+    assert counts == {cluster: int(np.sum(clusters == cluster)) for cluster in [1, 2, 3]}
+    # a cluster that disappears is dropped from the cache
+    clusters[clusters == 3] = 1
+    index.update(clusters, timestamps)
+    assert 3 not in index._cache['count']
+    # new timestamps invalidate everything
+    index.update(clusters, timestamps.copy())
+    calls.clear()
+    compute(1)
+    assert calls == [1]
+
+def test_isi_histogram_matches_np_histogram():
+    rng = np.random.default_rng(2)
+    isi = np.exp(rng.uniform(np.log(0.1), np.log(3000), 5000))
+    spike_times = np.cumsum(isi)
+    isi = np.diff(spike_times)
+    edges, counts = isi_histogram(spike_times, min_isi=0.5, max_isi=1000, n_bins=40)
+    assert np.allclose(edges, log_bins(0.5, 1000, 40))
+    expected, _ = np.histogram(isi[(isi >= 0.5) & (isi < 1000)], bins=edges)
+    assert np.array_equal(counts, expected)
+    # intervals at an edge are counted in the bin it starts, as by np.histogram
+    for isi in np.concatenate([edges[:-1], np.nextafter(edges[1:-1], 0)]):
+        _, counts = isi_histogram(np.array([0., isi]), min_isi=0.5, max_isi=1000, n_bins=40)
+        assert np.array_equal(counts, np.histogram([isi], bins=edges)[0])
+    # intervals at the first edge are counted, at the last edge are not
+    edges, counts = isi_histogram(np.array([0., 0.5, 1000.5, 1500.5]), min_isi=0.5, max_isi=1000, n_bins=10)
+    assert counts[0] == 1 and counts.sum() == 2
+    edges, counts = isi_histogram(np.array([3.]), n_bins=5)
+    assert counts.shape == (5,) and counts.sum() == 0
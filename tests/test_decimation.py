@@ -0,0 +1,46 @@
+import numpy as np
+
+from simiview.util.decimation import lod_level, minmax_envelope, simplify_paths
+
+def test_lod_level():
+    assert lod_level(0.5) is None
+    assert lod_level(np.inf) is None
+    assert lod_level(3.) == 2.
+    assert lod_level(4.) == 4.
+    assert lod_level(7.9, full_resolution=2.) == 4.
+
+def test_minmax_envelope_matches_each_bin():
+    rng = np.random.default_rng(0)
+    lines = rng.normal(size=(4, 103))
+    for bin_size in [1, 2, 10, 103, 200]:
+        x, envelope = minmax_envelope(lines, bin_size)
+        n_bins = -(-103 // bin_size)
+        assert envelope.shape == (4, 2 * n_bins) and x.shape == (2 * n_bins,)
+        for idx in range(n_bins):
+            bin_lines = lines[:, idx * bin_size:(idx + 1) * bin_size]
+            assert np.array_equal(envelope[:, 2 * idx], bin_lines.min(axis=1))
+            assert np.array_equal(envelope[:, 2 * idx + 1], bin_lines.max(axis=1))
+            assert idx * bin_size <= x[2 * idx] == x[2 * idx + 1] <= min((idx + 1) * bin_size, 103) - 1
+
+def naive_simplify(path, cell_size):
+    cells = np.floor(path / cell_size)
+    kept = [path[0]]
+    for idx in range(1, len(path)):
+        if np.any(cells[idx] != cells[idx - 1]) or idx == len(path) - 1:
+            kept.append(path[idx])
+    return np.array(kept)
+
+def test_simplify_paths_matches_a_loop():
+    rng = np.random.default_rng(1)
+    paths = np.cumsum(rng.normal(0, 0.1, (5, 200, 2)), axis=1)
+    # a path that stays in one cell keeps only its ends
+    paths[2] = 0.5
+    simplified = simplify_paths(paths, 0.5)
+    assert simplified.shape[1] < paths.shape[1]
+    for path, result in zip(paths, simplified):
+        kept = naive_simplify(path, 0.5)
+        assert np.array_equal(result[:len(kept)], kept)
+        # padded with the last vertex
+        assert np.all(result[len(kept):] == path[-1])
+    short = np.zeros((3, 2, 2))
+    assert simplify_paths(short, 1.) is short
@@ -0,0 +1,267 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('xarray')
+
+from simiview.gaze import (
+    GazeData, GazeDataSet, IntervalIndex, blink_intervals, fill_intervals, find_runs, fixation_columns, gather_windows, radial_velocity, saccade_columns, stream_velocity,
+    velocity_events
+)
+
+def naive_runs(mask):
+    runs = []
+    for row, values in enumerate(mask):
+        onset = None
+        for sample, value in enumerate(list(values) + [False]):
+            if value and onset is None:
+                onset = sample
+            elif not value and onset is not None:
+                runs.append((row, onset, sample))
+                onset = None
+    return runs
+
+def naive_fill(rows, onsets, offsets, shape):
+    mask = np.zeros(shape, dtype=bool)
+    for row, onset, offset in zip(rows, onsets, offsets):
+        mask[row, max(onset, 0):max(offset, 0)] = True
+    return mask
+
+def random_mask(rng, shape, p=0.3):
+    mask = rng.random(shape) < p
+    # runs touching the first and last sample
+    mask[0, :3] = True
+    mask[-1, -3:] = True
+    return mask
+
+def test_find_runs():
+    rng = np.random.default_rng(0)
+    for shape in [(1, 1), (3, 1), (4, 50), (2, 7)]:
+        mask = random_mask(rng, shape)
+        rows, onsets, offsets = find_runs(mask)
+        assert list(zip(rows, onsets, offsets)) == naive_runs(mask)
+    rows, onsets, offsets = find_runs(np.zeros((2, 5), dtype=bool))
+    assert rows.size == onsets.size == offsets.size == 0
+
+def test_fill_intervals():
+    rng = np.random.default_rng(1)
+    shape = (3, 40)
+    rows = rng.integers(0, 3, 20)
+    onsets = rng.integers(-10, 45, 20)
+    offsets = onsets + rng.integers(0, 15, 20)
+    # overlapping intervals and intervals clipped at both ends
+    rows, onsets, offsets = np.append(rows, [0, 0, 2]), np.append(onsets, [-5, 2, 35]), np.append(offsets, [3, 6, 60])
+    assert np.array_equal(fill_intervals(rows, onsets, offsets, shape), naive_fill(rows, onsets, offsets, shape))
+
+def test_blink_intervals():
+    rng = np.random.default_rng(2)
+    position = rng.uniform(-20, 20, (3, 60, 2))
+    position[0, 0, 0] = 40
+    position[1, 20:25, 1] = -35
+    position[2, -1] = 50
+    for pad in [None, 0, 3]:
+        expected = np.zeros((3, 60), dtype=bool)
+        for row, onset, offset in naive_runs(np.any(np.abs(position) >= 30, axis=-1)):
+            expected[row, max(onset - (pad or 0), 0):offset + (pad or 0)] = True
+        assert np.array_equal(blink_intervals(position, 30, pad), expected)
+
+def test_saccade_columns():
+    rng = np.random.default_rng(3)
+    time = np.arange(80) / 1000
+    position = np.cumsum(rng.normal(size=(3, 80, 2)), axis=1)
+    velocity = radial_velocity(time, position)
+    # events at the first and last velocity of a trial
+    velocity[0, :2] = velocity[2, -2:] = 5000
+    rows, onsets, offsets = velocity_events(velocity, {'min': 1000})
+    columns = saccade_columns(time, position, velocity, rows, onsets, offsets, ['x', 'y'])
+    assert (0, 0) in zip(columns['trial'], columns['onset'])
+    assert (2, 79) in zip(columns['trial'], columns['offset'])
+    for idx, (row, onset, offset) in enumerate(naive_runs(np.abs(velocity) > 1000)):
+        assert (columns['trial'][idx], columns['onset'][idx], columns['offset'][idx]) == (row, onset, offset)
+        assert columns['peak_velocity'][idx] == velocity[row, onset:offset].max()
+        assert columns['duration'][idx] == time[offset] - time[onset]
+        assert columns['onset.x'][idx] == position[row, onset, 0]
+        assert columns['offset.y'][idx] == position[row, offset, 1]
+        assert np.isclose(columns['amplitude'][idx], np.linalg.norm(position[row, offset] - position[row, onset]))
+
+def test_saccade_columns_queries():
+    rng = np.random.default_rng(4)
+    time = np.arange(200) / 1000
+    position = np.cumsum(rng.normal(size=(2, 200, 2)), axis=1)
+    velocity = radial_velocity(time, position)
+    rows, onsets, offsets = velocity_events(velocity, {'min': 800})
+    columns = saccade_columns(
+        time, position, velocity, rows, onsets, offsets, ['x', 'y'],
+        duration_query={'min': 0.0015}, peak_velocity_query={'max': 3000}
+    )
+    expected = [
+        (row, onset, offset) for row, onset, offset in naive_runs(np.abs(velocity) > 800)
+        if time[offset] - time[onset] > 0.0015 and velocity[row, onset:offset].max() < 3000
+    ]
+    assert list(zip(columns['trial'], columns['onset'], columns['offset'])) == expected
+    empty = saccade_columns(time, position, velocity, rows[:0], onsets[:0], offsets[:0], ['x', 'y'])
+    assert empty['peak_velocity'].size == 0
+
+def test_fixation_columns():
+    rng = np.random.default_rng(5)
+    time = np.arange(60) / 1000
+    position = np.cumsum(rng.normal(size=(3, 60, 2)), axis=1)
+    blink_mask = rng.random((3, 60)) > 0.05
+    velocity = radial_velocity(time, position)
+    # fixations from the first sample and to the last sample of a trial
+    velocity[0, :3] = velocity[2, -3:] = 0
+    blink_mask[0, :4] = blink_mask[2, -4:] = True
+    rows, onsets, offsets = velocity_events(velocity, {'max': 1200}, blink_mask=blink_mask)
+    columns = fixation_columns(time, position, rows, onsets, offsets, ['x', 'y'])
+    below = (np.abs(velocity) < 1200) & blink_mask[:, :-1] & blink_mask[:, 1:]
+    expected = naive_runs(below)
+    assert list(zip(columns['trial'], columns['onset'], columns['offset'])) == expected
+    assert expected[0][:2] == (0, 0) and expected[-1][::2] == (2, 59)
+    for idx, (row, onset, offset) in enumerate(expected):
+        mean = position[row, onset:offset + 1].mean(axis=0)
+        assert np.allclose([columns['x'][idx], columns['y'][idx]], mean)
+        assert columns['duration'][idx] == time[offset] - time[onset]
+    long = fixation_columns(time, position, rows, onsets, offsets, ['x', 'y'], duration_query={'min': 0.004})
+    assert np.all(long['duration'] > 0.004)
+    assert long['trial'].size == sum(time[offset] - time[onset] > 0.004 for _, onset, offset in expected)
+
+def naive_overlapping(onsets, offsets, left, right):
+    return sorted(
+        (window, interval)
+        for window in range(len(left)) for interval in range(len(onsets))
+        if onsets[interval] < right[window] and offsets[interval] > left[window]
+    )
+
+@pytest.mark.parametrize('disjoint', [True, False])
+def test_interval_index_overlapping(disjoint):
+    rng = np.random.default_rng(6)
+    if disjoint:
+        bounds = np.sort(rng.choice(1000, 40, replace=False))
+        onsets, offsets = bounds[::2], bounds[1::2]
+    else:
+        onsets = rng.uniform(0, 1000, 30)
+        offsets = onsets + rng.uniform(0, 200, 30)
+    # shuffled, as the index sorts them
+    order = rng.permutation(onsets.size)
+    onsets, offsets = onsets[order], offsets[order]
+    left = np.concatenate([rng.uniform(-100, 1100, 50), [-50., onsets.min(), offsets.max()]])
+    right = left + np.concatenate([rng.uniform(0, 150, 50), [50., 1., 10.]])
+    index = IntervalIndex(onsets, offsets)
+    assert index.disjoint == disjoint
+    windows, intervals = index.overlapping(left, right)
+    assert sorted(zip(windows, intervals)) == naive_overlapping(onsets, offsets, left, right)
+    windows, intervals = IntervalIndex([], []).overlapping(left, right)
+    assert windows.size == intervals.size == 0
+
+def test_gather_windows():
+    array = np.arange(20.).reshape(10, 2)
+    starts = np.array([-3, 0, 4, 7, 9, 12, -15])
+    for n_window in [1, 4, 10, 12]:
+        result = gather_windows(array, starts, n_window, np.nan)
+        assert result.shape == (starts.size, n_window, 2)
+        for window, start in enumerate(starts):
+            for sample in range(n_window):
+                if 0 <= start + sample < 10:
+                    assert np.array_equal(result[window, sample], array[start + sample])
+                else:
+                    assert np.isnan(result[window, sample]).all()
+    mask = gather_windows(np.ones(10, dtype=bool), starts, 4, False)
+    assert mask.dtype == bool
+    assert np.array_equal(mask.sum(axis=1), [1, 4, 4, 3, 1, 0, 0])
+
+def test_get_by_events():
+    time = 10 + np.arange(100) * 0.5
+    position = np.column_stack([np.arange(100.), -np.arange(100.)])
+    data = GazeData(time, position, ['x', 'y'])
+    data.inferred['saccades'] = np.array(
+        [(0, 3, 10., 11.5), (40, 45, 30., 32.5), (98, 99, 59., 59.5)],
+        dtype=[('onset', int), ('offset', int), ('onset.time', float), ('offset.time', float)]
+    )
+    # windows starting before the first sample, within the data and ending after the last
+    timestamps = np.array([10., 31., 59.5])
+    result = data.get_by_events(timestamps, (-2., 3.))
+    assert result['time'].shape == (3, 10)
+    assert np.allclose(result['time'], np.arange(-2., 3., 0.5))
+    for event, timestamp in enumerate(timestamps):
+        sample_time = timestamp + result['time'][event]
+        inside = (sample_time >= time[0]) & (sample_time <= time[-1])
+        samples = np.round((sample_time[inside] - time[0]) / 0.5).astype(int)
+        assert np.array_equal(result['trace'][event, inside, 0], samples)
+        assert np.isnan(result['trace'][event, ~inside]).all()
+        assert np.array_equal(result['mask'][event], inside)
+    saccades = result['saccades']
+    assert sorted(zip(saccades['event'], saccades['onset'])) == [(0, 0), (1, 40), (2, 98)]
+    assert np.allclose(saccades['latency'], saccades['onset.time'] - timestamps[saccades['event']])
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 50, 1000])
+@pytest.mark.parametrize('masked', [False, True])
+def test_stream_velocity_matches_whole_recording(chunk_size, masked):
+    rng = np.random.default_rng(7)
+    time = np.arange(200) / 1000
+    position = np.cumsum(rng.normal(size=(200, 3)), axis=0)
+    # events at the first and last sample
+    position[:3] += np.arange(3)[:, np.newaxis] * 10
+    position[-3:] += np.arange(3)[:, np.newaxis] * 10
+    blink_mask = rng.random(200) > 0.05 if masked else None
+    query = {'min': 1500}
+    chunks = list(stream_velocity(time, position, query, blink_mask=blink_mask, dims=[0, 2], chunk_size=chunk_size))
+
+    velocity = radial_velocity(time, position[:, [0, 2]])
+    _, onsets, offsets = velocity_events(velocity[np.newaxis], query, None if blink_mask is None else blink_mask[np.newaxis])
+    assert onsets[0] == 0 and offsets[-1] == 199
+    assert np.allclose(np.concatenate([chunk['velocity'] for chunk in chunks]), velocity)
+    assert [chunk['start'] for chunk in chunks] == [max(first - 1, 0) for first in range(0, 200, chunk_size)]
+    assert np.array_equal(np.concatenate([chunk['onset'] for chunk in chunks]), onsets)
+    assert np.array_equal(np.concatenate([chunk['offset'] for chunk in chunks]), offsets)
+
+def test_stream_velocity_filter_state():
+    signal = pytest.importorskip('scipy.signal')
+    rng = np.random.default_rng(8)
+    time = np.arange(300) / 1000
+    position = np.cumsum(rng.normal(size=(300, 2)), axis=0)
+    sos = signal.butter(4, 50, fs=1000, output='sos')
+    velocity = np.concatenate([chunk['velocity'] for chunk in stream_velocity(time, position, sos=sos, chunk_size=64)])
+    expected = radial_velocity(time, position, filter_method=lambda difference: signal.sosfilt(sos, difference, axis=0))
+    assert np.allclose(velocity, expected)
+
+def fixations_and_saccades(n_samples, seed):
+    """Positions holding still between ramps of 20 samples, with some blinks"""
+    rng = np.random.default_rng(seed)
+    steps = np.zeros((n_samples, 2))
+    for onset in rng.choice(n_samples - 20, n_samples // 300, replace=False):
+        steps[onset:onset + 20] += rng.uniform(-0.3, 0.3, 2)
+    position = np.cumsum(steps, axis=0) + rng.normal(0, 0.002, (n_samples, 2))
+    for onset in rng.choice(n_samples - 50, n_samples // 2000, replace=False):
+        position[onset:onset + 50] = 40
+    return position
+
+@pytest.mark.parametrize('kind, query, overlap', [('saccades', {'min': 0.1}, 8), ('fixations', {'max': 0.03}, 50)])
+def test_detect_parallel_matches_serial(kind, query, overlap):
+    position = fixations_and_saccades(5000, seed=9)
+    data = GazeData(np.arange(5000.), position, ['x', 'y'])
+    data.mask_blinks(threshold=30, pad=5)
+    expected = getattr(data, f'get_{kind}')(query, duration_query={'min': 2})
+    # chunks shorter than many events, with less context than them, so they are detected again
+    assert (expected['offset'] - expected['onset']).max() > overlap
+    for chunk_size in [1, 37, 300, 10_000]:
+        events = data.detect_parallel(kind, query, duration_query={'min': 2}, n_jobs=1, chunk_size=chunk_size, overlap=overlap)
+        assert events.dtype == expected.dtype
+        assert np.array_equal(events, expected)
+
+def test_detect_parallel_without_samples():
+    data = GazeData(np.zeros(0), np.zeros((0, 2)), ['x', 'y'])
+    for kind, query in [('saccades', {'min': 0.1}), ('fixations', {'max': 0.03})]:
+        events = data.detect_parallel(kind, query, n_jobs=1)
+        assert events.size == 0
+        assert events.dtype == getattr(data, f'get_{kind}')(query).dtype
+
+def test_dataset_detect_parallel():
+    position = np.stack([fixations_and_saccades(1000, seed) for seed in range(5)])
+    dataset = GazeDataSet(np.arange(1000.), position, ['x', 'y'])
+    dataset.mask_blinks(threshold=30)
+    expected = dataset.get_saccades({'min': 0.1})
+    events = dataset.detect_parallel('saccades', {'min': 0.1}, n_jobs=1, trials_per_job=2)
+    assert np.array_equal(events, expected)
+    empty = GazeDataSet(np.arange(1000.), position[:0], ['x', 'y'])
+    events = empty.detect_parallel('fixations', {'max': 0.03}, n_jobs=1)
+    assert events.size == 0
+    assert events.dtype == empty.get_fixations({'max': 0.03}).dtype
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from simiview.spikesort.journal import ClusterJournal, decode_indices, decode_labels, encode_indices, encode_labels
+
+@pytest.mark.parametrize('indices, encoding', [
+    (np.array([3, 1000, 70_000]), 'array'),
+    (np.arange(100, 5000), 'runs'),
+    (np.concatenate([np.arange(0, 50), np.arange(60, 2000), np.array([2**33])]), 'runs'),
+    (np.arange(0, 10_000, 3), 'bitmap'),
+    (np.array([], dtype=np.intp), 'array'),
+])
+def test_index_encodings_round_trip(indices, encoding):
+    encoded = encode_indices(indices)
+    assert encoded[0] == encoding
+    assert np.array_equal(decode_indices(encoded), indices)
+
+@pytest.mark.parametrize('labels, encoding', [
+    (np.repeat(np.array([1, 5, 2], dtype=np.int64), [400, 10, 90]), 'runs'),
+    (np.arange(20, dtype=np.int64) % 3, 'array'),
+    (np.array([], dtype=np.int64), 'array'),
+])
+def test_label_encodings_round_trip(labels, encoding):
+    encoded = encode_labels(labels)
+    assert encoded[0] == encoding
+    assert np.array_equal(decode_labels(encoded), labels)
+
+def test_apply_undo_redo_restores_labels():
+    rng = np.random.default_rng(0)
+    clusters = rng.integers(0, 5, 1000)
+    journal = ClusterJournal()
+    history = [clusters.copy()]
+    for _ in range(5):
+        # repeated indices keep the last value assigned to them, as with clusters[indices] = values
+        indices = rng.integers(0, 1000, 300)
+        values = rng.integers(0, 5, 300)
+        expected = history[-1].copy()
+        expected[indices] = values
+        journal.apply(clusters, indices, values)
+        assert np.array_equal(clusters, expected)
+        history.append(expected)
+    for expected in history[-2::-1]:
+        journal.undo(clusters)
+        assert np.array_equal(clusters, expected)
+    assert journal.undo(clusters) is None
+    for expected in history[1:]:
+        journal.redo(clusters)
+        assert np.array_equal(clusters, expected)
+    assert journal.redo(clusters) is None
+
+def test_apply_with_a_mask_and_no_change():
+    clusters = np.zeros(10, dtype=int)
+    journal = ClusterJournal()
+    edit = journal.apply(clusters, clusters == 0, 3)
+    assert np.array_equal(clusters, np.full(10, 3))
+    assert edit.n_changed == 10
+    assert journal.apply(clusters, [1, 2], 3) is None
+    assert len(journal.undo_stack) == 1
+
+def test_max_bytes_drops_the_oldest_edits():
+    clusters = np.zeros(100_000, dtype=np.int64)
+    rng = np.random.default_rng(1)
+    journal = ClusterJournal(max_bytes=20_000)
+    for label in range(1, 20):
+        journal.apply(clusters, rng.choice(100_000, 500, replace=False), label)
+        assert journal.nbytes == sum(edit.nbytes for edit in journal.undo_stack)
+        assert journal.nbytes <= journal.max_bytes
+    assert 1 < len(journal.undo_stack) < 19
+    # an edit larger than the bound is still kept, so it can be undone
+    journal.apply(clusters, np.arange(0, 100_000, 7), 99)
+    assert len(journal.undo_stack) == 1
+    assert journal.undo(clusters) is not None
+
+def test_app_undo_redo():
+    pytest.importorskip('vispy')
+    pytest.importorskip('simianpy')
+    from simiview.spikesort.app import SpikeSortApp
+
+    class FakeApp:
+        edit_clusters = SpikeSortApp.edit_clusters
+        undo = SpikeSortApp.undo
+        redo = SpikeSortApp.redo
+
+        def __init__(self, clusters):
+            self.clusters = clusters
+            self.journal = ClusterJournal()
+            self.deltas = []
+
+        def _update_clusters(self, delta=None):
+            self.deltas.append(delta)
+
+    app = FakeApp(np.zeros(10, dtype=int))
+    app.edit_clusters([1, 2, 2], [4, 5, 6])
+    assert np.array_equal(app.clusters[:3], [0, 4, 6])
+    app.undo()
+    assert not app.clusters.any()
+    indices, labels = app.deltas[-1]
+    assert np.array_equal(indices, [1, 2]) and np.array_equal(labels, [0, 0])
+    app.redo()
+    assert np.array_equal(app.clusters[:3], [0, 4, 6])
+    assert len(app.deltas) == 3
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('vispy')
+
+from simiview.util.linecollection import LineCollection, PathCollection
+
+def closest_lines(pos, n_points, position, k):
+    distances = np.linalg.norm(pos - position, axis=1).reshape(-1, n_points).min(axis=1)
+    return np.argsort(distances, kind='stable')[:k]
+
+def wait_for_index(collection):
+    thread = collection._index_thread
+    if thread is not None:
+        thread.join()
+
+def test_closest_paths_before_and_after_indexing():
+    rng = np.random.default_rng(0)
+    paths = np.cumsum(rng.normal(size=(50, 40, 2)), axis=1)
+    collection = PathCollection(paths=paths, zorder=rng.permutation(50))
+    clicks = rng.uniform(-20, 20, (20, 2))
+    expected = [closest_lines(paths.reshape(-1, 2), 40, click, 3) for click in clicks]
+    wait_for_index(collection)
+    assert collection._current_spatial_index() is not None
+    for click, lines in zip(clicks, expected):
+        # found through the index, or by a scan while it is built
+        assert np.array_equal(collection.get_closest_lines(click, 3), lines)
+        assert np.array_equal(collection._scan_closest_lines(click, 3), lines)
+
+def test_set_data_replaces_the_index():
+    rng = np.random.default_rng(1)
+    collection = LineCollection(lines=rng.normal(size=(10, 30)), offset=5)
+    wait_for_index(collection)
+    lines = rng.normal(size=(20, 30))
+    collection.set_data(lines=lines, offset=5)
+    wait_for_index(collection)
+    pos = collection.get_pos()
+    for click in rng.uniform([0, -5], [30, 100], (10, 2)):
+        assert collection.get_closest_line(click) == closest_lines(pos, 30, click, 1)[0]
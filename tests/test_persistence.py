@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from simiview.spikesort import persistence
+from simiview.spikesort.persistence import ClusterWriteError, ClusterWriter, load_clusters, save_atomic
+
+def test_save_atomic_keeps_existing_maps_valid(tmp_path):
+    path = tmp_path / 'waveforms.npy'
+    np.save(path, np.arange(100_000, dtype=float))
+    mapped = np.load(path, mmap_mode='r')
+    save_atomic(path, np.arange(10, dtype=float))
+    # the map still reads the old data, rather than a truncated file
+    assert mapped[-1] == 99_999
+    assert np.array_equal(np.load(path), np.arange(10))
+
+def test_failed_append_is_retried_as_a_snapshot(tmp_path, monkeypatch):
+    writer = ClusterWriter(debounce=0.)
+    clusters = np.zeros(10, dtype=int)
+    writer.submit(tmp_path, clusters)
+    writer.flush()
+
+    def fail(*args):
+        raise OSError("disk full")
+    monkeypatch.setattr(persistence, 'append_delta', fail)
+    clusters[:3] = 1
+    writer.submit(tmp_path, clusters, (np.arange(3), np.ones(3, dtype=int)))
+    with pytest.raises(ClusterWriteError):
+        writer.flush()
+
+    monkeypatch.undo()
+    clusters[5] = 2
+    writer.submit(tmp_path, clusters, (np.array([5]), np.array([2])))
+    writer.close()
+    # the failed edit is in a snapshot, so replaying the log does not skip it
+    assert np.array_equal(load_clusters(tmp_path), clusters)
+
+def test_detection_replaces_files_after_a_failed_write(tmp_path, monkeypatch):
+    pytest.importorskip('vispy')
+    pytest.importorskip('simianpy')
+    import logging
+    from simiview.spikesort.app import SpikeSortApp
+    from simiview.spikesort.memory import MemoryBudget
+
+    class FakeApp:
+        on_waveforms_detected = SpikeSortApp.on_waveforms_detected
+
+        def __init__(self):
+            self.save_path = tmp_path
+            self.cluster_writer = ClusterWriter(debounce=60.)
+            self.memory = MemoryBudget()
+            self.logger = logging.getLogger('test')
+            self.loaded = None
+
+        def load_data(self, waveforms, timestamps, save_waveforms=True):
+            self.loaded = waveforms, timestamps
+
+    def fail(*args):
+        raise OSError("disk full")
+    monkeypatch.setattr(persistence, 'append_delta', fail)
+    app = FakeApp()
+    np.save(tmp_path / 'points.npy', np.zeros((3, 3)))
+    app.cluster_writer.submit(tmp_path, np.ones(3, dtype=int), (np.arange(3), np.ones(3, dtype=int)))
+    waveforms, timestamps = np.ones((5, 10)), np.arange(5.)
+    app.on_waveforms_detected(waveforms, timestamps)
+    assert np.array_equal(np.load(tmp_path / 'waveforms.npy'), waveforms)
+    assert np.array_equal(np.load(tmp_path / 'timestamps.npy'), timestamps)
+    assert not (tmp_path / 'points.npy').exists()
+    assert app.loaded is not None
+    # the labels of the old waveforms are not saved later
+    app.cluster_writer.close()
+    assert load_clusters(tmp_path) is None
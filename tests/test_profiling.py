@@ -0,0 +1,16 @@
+import numpy as np
+
+from simiview.util.profiling import Profiler
+
+def test_span_samples_are_bounded():
+    profiler = Profiler(max_events=10, max_samples=100)
+    durations = np.linspace(0, 1, 10_000)
+    for duration in durations:
+        profiler.record('frame', 0., duration)
+    assert len(profiler.stats['frame'].samples) == 100
+    assert len(profiler.events) == 10
+    stats = profiler.summary()['frame']
+    assert stats['count'] == durations.size
+    assert np.isclose(stats['total'], durations.sum())
+    assert stats['max'] == 1.
+    assert abs(stats['p50'] - 0.5) < 0.2
@@ -0,0 +1,56 @@
+import threading
+
+import numpy as np
+import pytest
+
+pytest.importorskip('vispy')
+pytest.importorskip('simianpy')
+from vispy.scene import Widget
+
+from simiview.spikesort.single_channel_viewer import SingleChannelViewer
+
+class FakeSignal:
+    """A (n_samples, n_channels) recording, sampled at 1 Hz from t=0"""
+    def __init__(self, data):
+        self.data = data
+        self.shape = data.shape
+        self.t_start = 0
+        self.sampling_rate = 1
+
+def make_viewer(n_samples=10_000, n_channels=4):
+    viewer = SingleChannelViewer(Widget().add_view())
+    viewer.sig = FakeSignal(np.random.default_rng(0).normal(size=(n_samples, n_channels)))
+    viewer.all_channels = list(range(n_channels))
+    viewer._load_data = lambda t_slice, channels: viewer.sig.data[slice(*t_slice)][:, channels]
+    return viewer
+
+def test_median_trace_survives_concurrent_clears():
+    viewer = make_viewer()
+    expected = np.median(viewer.sig.data, axis=1).astype(np.float16)
+    errors = []
+
+    def compute():
+        try:
+            for start in range(0, 10_000, 500):
+                median = viewer.get_median_trace((start, start + 500))
+                assert np.array_equal(median, expected[start:start + 500])
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=compute) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        viewer.clear_median_trace()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+def test_clear_is_skipped_while_the_trace_is_in_use():
+    viewer = make_viewer()
+    viewer.get_median_trace((0, 100))
+    with viewer._median_lock:
+        assert viewer.clear_median_trace() is False
+    assert viewer._median_trace is not None
+    assert viewer.clear_median_trace() is True
+    assert viewer._median_trace is None
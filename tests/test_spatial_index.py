@@ -0,0 +1,63 @@
+import numpy as np
+
+from simiview.util.spatial_index import GridIndex
+
+def brute_force(points, labels, position, k):
+    distances = np.linalg.norm(points - position, axis=1)
+    nearest = {}
+    for label, distance in zip(labels, distances):
+        if np.isfinite(distance):
+            nearest[label] = min(distance, nearest.get(label, np.inf))
+    order = sorted(nearest, key=lambda label: (nearest[label], label))[:k]
+    return np.array(order), np.array([nearest[label] for label in order])
+
+def random_lines(rng, n_lines, n_points):
+    points = np.cumsum(rng.normal(size=(n_lines, n_points, 2)), axis=1).reshape(-1, 2)
+    return points, np.repeat(np.arange(n_lines), n_points)
+
+def check(index, points, labels, position, k):
+    found, distances = index.nearest(position, k)
+    _, expected_distances = brute_force(points, labels, position, k)
+    assert np.allclose(distances, expected_distances)
+    # labels at the same distance may come in either order, so each is checked by its own distance
+    for label, distance in zip(found, distances):
+        line = points[labels == label]
+        line = line[np.isfinite(line).all(axis=1)]
+        assert np.isclose(np.linalg.norm(line - position, axis=1).min(), distance)
+
+def test_nearest_matches_brute_force():
+    rng = np.random.default_rng(0)
+    points, labels = random_lines(rng, 60, 50)
+    points[::97] = np.nan
+    index = GridIndex(points, labels)
+    for position in rng.uniform(points[np.isfinite(points)].min(), points[np.isfinite(points)].max(), (50, 2)):
+        for k in [1, 3, 10]:
+            check(index, points, labels, position, k)
+    # more labels than exist
+    found, _ = index.nearest(points[1], 100)
+    assert found.size == 60
+    assert index.nearest((np.nan, 0), 1)[0].size == 0
+
+def test_far_queries_search_cells_nearest_first():
+    rng = np.random.default_rng(1)
+    points, labels = random_lines(rng, 200, 100)
+    index = GridIndex(points, labels)
+    index.max_square_points = 500
+    for position in [(1e4, 1e4), (-5e3, 0), (0, 1e6)]:
+        for k in [1, 5]:
+            check(index, points, labels, np.array(position), k)
+    assert np.array_equal(
+        index.nearest((1e4, 1e4), 5)[0],
+        index._nearest_cells_first(np.array([1e4, 1e4]), 5)[0]
+    )
+
+def test_degenerate_points():
+    empty = GridIndex(np.zeros((0, 2)), np.zeros(0, dtype=int))
+    labels, distances = empty.nearest((0, 0), 3)
+    assert labels.size == distances.size == 0
+    # every point on a line, so the grid has no height
+    points = np.column_stack([np.arange(10.), np.zeros(10)])
+    index = GridIndex(points, np.arange(10) // 2)
+    check(index, points, np.arange(10) // 2, np.array([3.2, 5.]), 2)
+    single = GridIndex(np.ones((1, 2)), np.array([7]))
+    assert single.nearest((5, 5), 1)[0].tolist() == [7]
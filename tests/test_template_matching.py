@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from simiview.spikesort.cluster_index import ClusterIndex
+from simiview.spikesort.template_matching import compute_templates, match_templates
+
+def nearest_templates(waveforms, templates, template_ids, max_distance=None, unassigned=0):
+    """The labels and RMS distances of the nearest templates, and the threshold of each spike"""
+    flat = waveforms.reshape(waveforms.shape[0], -1).astype(float)
+    rms = np.sqrt(np.mean((flat[:, np.newaxis] - templates[np.newaxis]) ** 2, axis=-1))
+    nearest = rms.argmin(axis=1)
+    distances = rms[np.arange(nearest.size), nearest]
+    labels = template_ids[nearest]
+    if max_distance is None:
+        return labels, distances, np.full(nearest.size, np.inf)
+    thresholds = np.broadcast_to(max_distance, template_ids.shape)[nearest]
+    return np.where(distances > thresholds, unassigned, labels), distances, thresholds
+
+@pytest.mark.parametrize('shape', [(30,), (4, 10)])
+@pytest.mark.parametrize('max_bytes', [1, 4 * 50 * 3, 2**20])
+def test_match_templates_matches_brute_force(shape, max_bytes):
+    rng = np.random.default_rng(0)
+    n_features = int(np.prod(shape))
+    templates = rng.normal(0, 3, (3, n_features)).astype(np.float32)
+    template_ids = np.array([2, 5, 7])
+    waveforms = (templates[rng.integers(0, 3, 100)] + rng.normal(0, 1, (100, n_features))).reshape((100,) + shape)
+    for max_distance in [None, 1.1, np.array([0.9, 1.2, 1.0])]:
+        labels, distances = match_templates(
+            waveforms, templates, template_ids, max_distance=max_distance, max_bytes=max_bytes, unassigned=-1
+        )
+        expected_labels, expected_distances, thresholds = nearest_templates(waveforms, templates, template_ids, max_distance, -1)
+        assert np.allclose(distances, expected_distances, atol=1e-4)
+        # distances within rounding of the threshold may go either way
+        clear = ~np.isclose(expected_distances, thresholds, atol=1e-4)
+        assert np.array_equal(labels[clear], expected_labels[clear])
+        if max_distance is not None:
+            assert np.any(labels == -1) and np.any(labels != -1)
+
+def test_match_templates_candidates():
+    rng = np.random.default_rng(1)
+    templates = rng.normal(0, 3, (2, 20)).astype(np.float32)
+    waveforms = rng.normal(0, 3, (50, 20))
+    candidates = np.array([0, 3, 4, 17, 49])
+    labels, distances = match_templates(waveforms, templates, np.array([1, 2]), candidates=candidates, max_bytes=1)
+    expected_labels, expected_distances, _ = nearest_templates(waveforms[candidates], templates, np.array([1, 2]))
+    assert np.array_equal(labels, expected_labels)
+    assert np.allclose(distances, expected_distances, atol=1e-4)
+
+def test_match_templates_without_templates():
+    labels, distances = match_templates(np.zeros((4, 10)), np.zeros((0, 10)), np.array([], dtype=int))
+    assert np.array_equal(labels, np.zeros(4)) and np.all(np.isinf(distances))
+
+def test_compute_templates():
+    rng = np.random.default_rng(2)
+    waveforms = rng.normal(size=(60, 2, 8))
+    clusters = rng.integers(0, 4, 60)
+    index = ClusterIndex()
+    index.update(clusters, np.arange(60.))
+    cluster_ids, templates, spreads = compute_templates(waveforms, index)
+    assert cluster_ids.tolist() == [1, 2, 3]
+    for cluster, template, spread in zip(cluster_ids, templates, spreads):
+        members = waveforms[clusters == cluster]
+        assert np.allclose(template, members.mean(axis=0).ravel(), atol=1e-6)
+        assert np.isclose(spread, np.sqrt(np.mean(members.std(axis=0) ** 2)), atol=1e-6)